@@ -0,0 +1,6 @@
+# Nuke sources this file when it meets the first Aton node, from
+# nuke.createNode("Aton") or an opened script, and loads the plugin on demand.
+# Set ATON_LOAD=off to skip the plugin in batch jobs, see init.py
+if {![info exists env(ATON_LOAD)] || $env(ATON_LOAD) != "off"} {
+    load aton
+}
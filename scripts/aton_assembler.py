@@ -0,0 +1,526 @@
+"""
+Aton Assembler
+
+Headless receiver writing finished renders to disk, so a distributed farm
+session is kept even if no Nuke is listening. Buckets are accumulated per
+session, frame and AOV into planar float buffers memory-mapped from
+scratch files, one channel plane after another. A frame is written as a
+multi-channel OpenEXR file once its buckets cover the image in every AOV
+and none of its tile connections is open any more, or once no tile has
+arrived for the settle time. Drivers disconnecting without a close
+message count as closed tiles. Only the buffers of the frames still receiving buckets are
+mapped, the least recently used ones are unmapped beyond max_resident
+frames, so a whole sequence can be captured with bounded memory.
+
+Frames written before all tiles arrived keep their scratch files and are
+written again if the missing tiles come in later, e.g. re-submitted ones.
+
+python aton_assembler.py "/renders/shot.%(frame)04d.exr" --port 9601
+
+Output paths are formatted with session, frame and output, the output name
+of the image header. Put it next to Nuke with aton_broadcast.py.
+"""
+
+import os
+import sys
+import time
+import zlib
+import shutil
+import struct
+import asyncio
+import argparse
+import tempfile
+import collections
+import concurrent.futures
+
+import numpy as np
+
+from aton_protocol import get_port
+from aton_receiver import Receiver, Handler
+
+
+__author__ = "Vahan Sosoyan"
+__copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
+__version__ = "1.3.7"
+
+
+EXR_MAGIC = 20000630
+EXR_VERSION = 2
+EXR_LONG_NAMES = 0x400
+EXR_FLOAT = 2
+
+EXR_NO_COMPRESSION = 0
+EXR_ZIP_COMPRESSION = 3
+EXR_COMPRESSIONS = {"none": EXR_NO_COMPRESSION, "zip": EXR_ZIP_COMPRESSION}
+
+# Scanlines per chunk of each compression
+EXR_LINES = {EXR_NO_COMPRESSION: 1, EXR_ZIP_COMPRESSION: 16}
+
+CHANNEL_NAMES = "RGBA"
+
+
+def channel_names(aov_name, spp):
+    """
+    Returns EXR channel names of an AOV, RGBA becomes the main layer
+    @param aov_name: str
+    @param spp: int
+    @return: list: str
+    """
+    if spp == 1:
+        return [aov_name]
+    names = CHANNEL_NAMES[:spp] if spp <= len(CHANNEL_NAMES) else \
+        ["%d" % i for i in range(spp)]
+    if aov_name == "RGBA":
+        return list(names)
+    return ["%s.%s" % (aov_name, name) for name in names]
+
+
+def exr_attribute(name, attr_type, value):
+    """
+    Returns a packed EXR header attribute
+    @param name: str
+    @param attr_type: str
+    @param value: bytes
+    @return: bytes
+    """
+    return name.encode() + b"\0" + attr_type.encode() + b"\0" + struct.pack("<i", len(value)) + \
+        value
+
+
+def exr_compress(data, level=4):
+    """
+    Compresses a chunk with the EXR zip predictor, returns the data as it is
+    if it doesn't get any smaller
+    @param data: bytes
+    @param level: int: zlib level
+    @return: bytes
+    """
+    raw = np.frombuffer(data, np.uint8)
+    reordered = np.concatenate((raw[0::2], raw[1::2]))
+    predicted = np.empty_like(reordered)
+    predicted[:1] = reordered[:1]
+    np.subtract(reordered[1:], reordered[:-1], out=predicted[1:])
+    predicted[1:] += 128
+
+    compressed = zlib.compress(predicted.tobytes(), level)
+    return compressed if len(compressed) < len(data) else data
+
+
+def write_exr(path, channels, xres, yres, pixel_aspect=1.0, compression=EXR_ZIP_COMPRESSION):
+    """
+    Writes a scanline OpenEXR file of float channels, one chunk at a time
+    @param path: str
+    @param channels: dict: channel name: numpy.ndarray of shape yres, xres
+    @param xres: int
+    @param yres: int
+    @param pixel_aspect: float
+    @param compression: int: EXR_NO_COMPRESSION or EXR_ZIP_COMPRESSION
+    @return:
+    """
+    names = sorted(channels, key=lambda name: name.encode())
+    version = EXR_VERSION
+    if any(len(name.encode()) > 31 for name in names):
+        version |= EXR_LONG_NAMES
+
+    chlist = b"".join(name.encode() + b"\0" + struct.pack("<iB3xii", EXR_FLOAT, 0, 1, 1)
+                      for name in names) + b"\0"
+    window = struct.pack("<iiii", 0, 0, xres - 1, yres - 1)
+
+    header = struct.pack("<ii", EXR_MAGIC, version)
+    header += exr_attribute("channels", "chlist", chlist)
+    header += exr_attribute("compression", "compression", struct.pack("<B", compression))
+    header += exr_attribute("dataWindow", "box2i", window)
+    header += exr_attribute("displayWindow", "box2i", window)
+    header += exr_attribute("lineOrder", "lineOrder", struct.pack("<B", 0))
+    header += exr_attribute("pixelAspectRatio", "float", struct.pack("<f", pixel_aspect or 1.0))
+    header += exr_attribute("screenWindowCenter", "v2f", struct.pack("<ff", 0.0, 0.0))
+    header += exr_attribute("screenWindowWidth", "float", struct.pack("<f", 1.0))
+    header += b"\0"
+
+    lines = EXR_LINES[compression]
+    offsets = np.zeros((yres + lines - 1) // lines, np.dtype("<u8"))
+    chunk = np.empty((lines, len(names), xres), np.dtype("<f4"))
+
+    with open(path, "wb") as f:
+        f.write(header)
+        table = f.tell()
+        f.write(offsets.tobytes())
+
+        for i, y in enumerate(range(0, yres, lines)):
+            count = min(lines, yres - y)
+            for c, name in enumerate(names):
+                chunk[:count, c] = channels[name][y:y + count]
+
+            data = chunk[:count].tobytes()
+            if compression == EXR_ZIP_COMPRESSION:
+                data = exr_compress(data)
+
+            offsets[i] = f.tell()
+            f.write(struct.pack("<ii", y, len(data)))
+            f.write(data)
+
+        f.seek(table)
+        f.write(offsets.tobytes())
+
+
+class AssemblyFrame(object):
+    """
+    Planar buffers of a single session and frame
+    """
+    def __init__(self, header, directory):
+        """
+        @param header: DataHeader
+        @param directory: str: scratch directory of its buffers
+        """
+        self.header = header
+        self.directory = directory
+        self.aovs = collections.OrderedDict()
+        self.tiles = 0
+        self.covered = dict()
+        self.dirty = False
+        self.written = False
+        self.time = time.time()
+
+        self._buffers = dict()
+        self._masks = dict()
+
+    def __repr__(self):
+        return "AssemblyFrame(%d, %g, %s)" % (self.header.session, self.header.frame,
+                                              list(self.aovs))
+
+    @property
+    def resident(self):
+        """
+        Returns True if the buffers are mapped
+        @return: bool
+        """
+        return bool(self._buffers)
+
+    @property
+    def complete(self):
+        """
+        Returns True if no tile is open and the buckets cover the image in every AOV
+        @return: bool
+        """
+        area = self.header.xres * self.header.yres
+        return not self.tiles and bool(self.covered) and \
+            all(covered >= area for covered in self.covered.values())
+
+    def buffer(self, aov_name):
+        """
+        Returns planar buffer of the given AOV, mapping it if needed
+        @param aov_name: str
+        @return: numpy.memmap: spp, yres, xres
+        """
+        buf = self._buffers.get(aov_name)
+        if buf is None:
+            spp = self.aovs[aov_name]
+            path = os.path.join(self.directory, "%d.raw" % list(self.aovs).index(aov_name))
+            buf = np.memmap(path, np.float32, "r+" if os.path.exists(path) else "w+",
+                            shape=(spp, self.header.yres, self.header.xres))
+            self._buffers[aov_name] = buf
+        return buf
+
+    def mask(self, aov_name):
+        """
+        Returns coverage mask of the given AOV, mapping it if needed
+        @param aov_name: str
+        @return: numpy.memmap: yres, xres, non zero where buckets have arrived
+        """
+        mask = self._masks.get(aov_name)
+        if mask is None:
+            path = os.path.join(self.directory, "%d.mask" % list(self.aovs).index(aov_name))
+            mask = np.memmap(path, np.uint8, "r+" if os.path.exists(path) else "w+",
+                             shape=(self.header.yres, self.header.xres))
+            self._masks[aov_name] = mask
+        return mask
+
+    def add(self, pixels):
+        """
+        Copies a bucket into the buffer of its AOV
+        @param pixels: DataPixels
+        @return:
+        """
+        if pixels.aov_name not in self.aovs:
+            self.aovs[pixels.aov_name] = pixels.spp
+            self.covered[pixels.aov_name] = 0
+
+        x, y, width, height = pixels.rect
+        buf = self.buffer(pixels.aov_name)
+        width = min(width, buf.shape[2] - x)
+        height = min(height, buf.shape[1] - y)
+        buf[:, y:y + height, x:x + width] = \
+            pixels.data[:height, :width, :buf.shape[0]].transpose(2, 0, 1)
+
+        # Count the pixels covered for the first time
+        region = self.mask(pixels.aov_name)[y:y + height, x:x + width]
+        self.covered[pixels.aov_name] += region.size - np.count_nonzero(region)
+        region[:] = 1
+
+        self.dirty = True
+        self.time = time.time()
+
+    def release(self):
+        """
+        Unmaps the buffers, their pages are written back to the scratch files
+        @return:
+        """
+        for buf in list(self._buffers.values()) + list(self._masks.values()):
+            buf.flush()
+        self._buffers.clear()
+        self._masks.clear()
+
+    def write(self, path, compression=EXR_ZIP_COMPRESSION):
+        """
+        Writes all AOVs into a multi-channel EXR file, replacing it atomically
+        @param path: str
+        @param compression: int
+        @return:
+        """
+        self.dirty = False
+        channels = dict()
+        for aov_name in self.aovs:
+            buf = self.buffer(aov_name)
+            for i, name in enumerate(channel_names(aov_name, buf.shape[0])):
+                channels[name] = buf[i]
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            write_exr(temp_path, channels, self.header.xres, self.header.yres,
+                      self.header.pixel_aspect, compression)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.written = True
+
+    def remove(self):
+        """
+        Unmaps the buffers and removes their scratch files
+        @return:
+        """
+        self._buffers.clear()
+        self._masks.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class AssemblerHandler(Handler):
+    """
+    Assembles incoming buckets into frames and writes them to disk
+    """
+    def __init__(self, output_path, scratch=None, max_resident=2, settle=10.0,
+                 compression=EXR_ZIP_COMPRESSION, stream=sys.stdout):
+        """
+        @param output_path: str: formatted with session, frame and output
+        @param scratch: str: directory of the planar buffers, the temp directory by default
+        @param max_resident: int: frames kept mapped in memory
+        @param settle: float: seconds without tiles before an incomplete frame is written
+        @param compression: int: EXR_NO_COMPRESSION or EXR_ZIP_COMPRESSION
+        @param stream: file: written frames are reported to, None is quiet
+        """
+        self.output_path = output_path
+        self.scratch = tempfile.mkdtemp(prefix="aton_assembler_", dir=scratch)
+        self.max_resident = max_resident
+        self.settle = settle
+        self.compression = compression
+        self.stream = stream
+
+        self.frames = collections.OrderedDict()
+        self.written = set()
+        self.late = 0
+
+        self._tiles = dict()
+        self._writing = dict()
+        self._executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    def path(self, frame):
+        """
+        Returns output path of the given frame
+        @param frame: AssemblyFrame
+        @return: str
+        """
+        header = frame.header
+        return self.output_path % dict(session=header.session, frame=int(round(header.frame)),
+                                       output=os.path.basename(header.output_name or "aton"))
+
+    def frame(self, header):
+        """
+        Returns the frame of the given header, creating it if needed
+        @param header: DataHeader
+        @return: AssemblyFrame or None if it has been written completely
+        """
+        key = header.session, header.frame
+        if key in self.written:
+            return None
+
+        frame = self.frames.get(key)
+        if frame is None:
+            directory = os.path.join(self.scratch, "%d_%g" % key)
+            os.makedirs(directory)
+            frame = self.frames[key] = AssemblyFrame(header, directory)
+        return frame
+
+    def touch(self, frame):
+        """
+        Marks the frame as most recently used, unmapping the least recently used ones
+        @param frame: AssemblyFrame
+        @return:
+        """
+        key = frame.header.session, frame.header.frame
+        self.frames.move_to_end(key)
+
+        resident = [f for f in self.frames.values() if f.resident and f is not frame]
+        for f in resident[:max(0, len(resident) + 1 - self.max_resident)]:
+            if f not in self._writing.values():
+                f.release()
+
+    def header(self, connection, header):
+        frame = self.frame(header)
+        if frame is not None:
+            frame.tiles += 1
+            frame.time = time.time()
+        self._tiles[connection] = header, frame
+
+    async def pixels(self, connection, pixels):
+        header, frame = self._tiles.get(connection, (None, None))
+
+        # Reconnecting drivers send buckets without a header
+        if header is None or header.session != pixels.session:
+            header = connection.receiver.sessions.get(pixels.session)
+            if header is None:
+                return
+            frame = self.frame(header)
+
+        if frame is None:
+            self.late += 1
+            return
+
+        frame.add(pixels)
+        self.touch(frame)
+
+        # Buckets of reconnecting drivers may complete a frame without any open tile
+        if frame.complete:
+            await self.flush(frame)
+
+    async def close(self, connection):
+        header, frame = self._tiles.pop(connection, (None, None))
+        if frame is None:
+            return
+
+        frame.tiles -= 1
+        if frame.complete:
+            await self.flush(frame)
+
+    async def disconnected(self, connection):
+        # Drivers disconnect without a close message once they are done,
+        # frames missing buckets wait for re-submitted tiles
+        await self.close(connection)
+
+    async def flush(self, frame):
+        """
+        Writes the frame in the writer thread, removing it once complete
+        @param frame: AssemblyFrame
+        @return:
+        """
+        key = frame.header.session, frame.header.frame
+        if key in self._writing:
+            return
+
+        self._writing[key] = frame
+        try:
+            path = self.path(frame)
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(self._executor, frame.write, path, self.compression)
+        finally:
+            del self._writing[key]
+
+        if self.stream is not None:
+            self.stream.write("Aton | Written %s%s\n" %
+                              (path, "" if frame.complete else " (incomplete)"))
+
+        if frame.complete and not frame.dirty:
+            frame.remove()
+            del self.frames[key]
+            self.written.add(key)
+        else:
+            frame.release()
+
+    async def watch(self, interval=1.0):
+        """
+        Writes frames which haven't received any tile for the settle time
+        @param interval: float: seconds between checks
+        @return:
+        """
+        while True:
+            await asyncio.sleep(interval)
+            now = time.time()
+            for frame in list(self.frames.values()):
+                if frame.dirty and not frame.tiles and now - frame.time >= self.settle:
+                    await self.flush(frame)
+
+    def close_all(self):
+        """
+        Writes all pending frames and removes the scratch directory
+        @return:
+        """
+        self._executor.shutdown()
+        for frame in list(self.frames.values()):
+            if frame.dirty:
+                frame.write(self.path(frame), self.compression)
+                if self.stream is not None:
+                    self.stream.write("Aton | Written %s%s\n" %
+                                      (self.path(frame), "" if frame.complete else
+                                       " (incomplete)"))
+            frame.remove()
+        self.frames.clear()
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    @param argv: list
+    @return: int
+    """
+    parser = argparse.ArgumentParser(description="Assemble Aton driver streams into EXR files.")
+    parser.add_argument("output", help="output path formatted with %%(session)d, %%(frame)d "
+                                       "and %%(output)s")
+    parser.add_argument("--host", default="", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=get_port() + 400, help="port to listen on")
+    parser.add_argument("--scratch", help="directory of the frame buffers")
+    parser.add_argument("--max-resident", type=int, default=2,
+                        help="frames kept in memory at once")
+    parser.add_argument("--settle", type=float, default=10.0,
+                        help="seconds without tiles before an incomplete frame is written")
+    parser.add_argument("--compression", choices=sorted(EXR_COMPRESSIONS), default="zip",
+                        help="EXR compression")
+    args = parser.parse_args(argv)
+
+    handler = AssemblerHandler(args.output, args.scratch, args.max_resident, args.settle,
+                               EXR_COMPRESSIONS[args.compression])
+    receiver = Receiver(handler, args.host, args.port)
+    receiver.listen()
+    sys.stdout.write("Aton | Assembling port %d to %s\n" % (receiver.port, args.output))
+
+    async def serve():
+        watch = asyncio.ensure_future(handler.watch())
+        try:
+            await receiver.serve_forever()
+        finally:
+            watch.cancel()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        handler.close_all()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
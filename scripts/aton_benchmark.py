@@ -0,0 +1,368 @@
+"""
+Aton Benchmark
+
+Synthesises driver_aton traffic and measures how fast it is received.
+Every connection renders the given number of frames, sending every bucket
+once per AOV the same way as driver_write_bucket does. Without a port the
+benchmark starts its own Python receiver in the background, which also
+measures the latency of every bucket from its first byte being sent until
+it has been fully received. With a port only the sender side throughput
+is reported, e.g. for a running Nuke session. The receiver may also run
+in its own process like Nuke does, so it doesn't share the GIL with the
+senders. Compare compression codecs on realistic AOVs with
+aton_compression and shared memory with loopback TCP with aton_shm.
+
+python aton_benchmark.py --res 1920 1080 --aovs 4 --spp 4 3 1 1 --connections 2
+python aton_benchmark.py --port 9201 --json results.json
+python aton_benchmark.py --host 10.0.0.2 --port 9201 --compression zstd
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import multiprocessing
+
+import numpy as np
+
+from aton_protocol import PROTOCOL_V2, DataHeader, DataPixels, get_host, get_spp
+from aton_receiver import Receiver, Handler
+from aton_client import Client, generate_buckets
+
+
+__author__ = "Vahan Sosoyan"
+__copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
+__version__ = "1.3.7"
+
+
+class BenchmarkHandler(Handler):
+    """
+    Counts received buckets and their latency, the send time
+    is carried in the ram field of every bucket
+    """
+    def __init__(self, counter=None):
+        """
+        @param counter: multiprocessing.Value: shared bucket count
+        """
+        self.counter = counter
+        self.buckets = 0
+        self.bytes = 0
+        self.latencies = list()
+        self.last_time = None
+        self.lock = threading.Lock()
+
+    def pixels(self, connection, pixels):
+        now = time.time_ns()
+        with self.lock:
+            self.last_time = now
+            self.buckets += 1
+            self.bytes += pixels.data.nbytes
+            self.latencies.append(now - pixels.ram)
+        if self.counter is not None:
+            self.counter.value = self.buckets
+
+
+class BackgroundReceiver(object):
+    """
+    Receiver running its own event loop in a thread
+    """
+    def __init__(self, handler, host="127.0.0.1"):
+        """
+        @param handler: Handler
+        @param host: str
+        """
+        self.handler = handler
+        self.receiver = Receiver(handler, host, 0)
+        self.port = self.receiver.listen()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self.receiver.serve_forever())
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self.receiver.close)
+        self._thread.join()
+
+    @property
+    def buckets(self):
+        return self.handler.buckets
+
+
+def serve_process(host, pipe, counter):
+    """
+    Runs a benchmark receiver until the pipe is written to,
+    then sends the handler results back
+    @param host: str
+    @param pipe: multiprocessing.connection.Connection
+    @param counter: multiprocessing.Value
+    @return:
+    """
+    handler = BenchmarkHandler(counter)
+    receiver = Receiver(handler, host, 0)
+    pipe.send(receiver.listen())
+
+    async def serve():
+        asyncio.get_event_loop().add_reader(pipe.fileno(), receiver.close)
+        await receiver.serve_forever()
+
+    asyncio.run(serve())
+    pipe.recv()
+    pipe.send((handler.buckets, handler.bytes, handler.latencies, handler.last_time))
+
+
+class ProcessReceiver(object):
+    """
+    Receiver running in its own process, with the interface of BackgroundReceiver
+    """
+    def __init__(self, host="127.0.0.1"):
+        """
+        @param host: str
+        """
+        self.handler = BenchmarkHandler()
+        self.port = None
+        self._counter = multiprocessing.Value("q", 0, lock=False)
+        self._pipe, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=serve_process,
+                                                args=(host, child, self._counter))
+        self._process.daemon = True
+
+    def start(self):
+        self._process.start()
+        self.port = self._pipe.recv()
+
+    def stop(self):
+        self._pipe.send(None)
+        handler = self.handler
+        handler.buckets, handler.bytes, handler.latencies, handler.last_time = self._pipe.recv()
+        self._process.join()
+
+    @property
+    def buckets(self):
+        return self._counter.value
+
+
+class Benchmark(object):
+    """
+    Synthetic load generator
+    """
+    def __init__(self, xres=1920, yres=1080, bucket_size=64, aovs=1, spp=(4,), frames=1,
+                 connections=1, host=None, port=None, protocol=PROTOCOL_V2, encodings=None,
+                 compression=None, adaptive=True, images=None, shared_memory=None,
+                 process=False):
+        """
+        @param xres: int
+        @param yres: int
+        @param bucket_size: int
+        @param aovs: int: number of AOVs
+        @param spp: list: samples per pixel cycled over the AOVs, 1, 3 or 4
+        @param frames: int: frames rendered by every connection
+        @param connections: int: number of concurrent driver connections
+        @param host: str
+        @param port: int: None starts a background receiver
+        @param protocol: int: highest protocol version to negotiate
+        @param encodings: str: AOV encodings, e.g. "*=half Z=float"
+        @param compression: str: codec name or auto
+        @param adaptive: bool: False compresses every bucket
+        @param images: list: tuple: name, (yres, xres, spp) array, replaces random AOVs
+        @param shared_memory: bool: pass pixels through shared memory, None for local hosts
+        @param process: bool: run the background receiver in its own process
+        """
+        self.xres = xres
+        self.yres = yres
+        self.bucket_size = bucket_size
+        self.frames = frames
+        self.connections = connections
+        self.host = get_host() if host is None else host
+        self.port = port
+        self.protocol = protocol
+        self.encodings = encodings
+        self.compression = compression
+        self.adaptive = adaptive
+        self.shared_memory = shared_memory
+        self.process = process
+
+        self.aovs = list(images or ())
+        for i in range(0 if images else aovs):
+            aov_spp = get_spp(spp[i % len(spp)])
+            name = "RGBA" if not i else "aov%d" % i
+            self.aovs.append((name, np.random.rand(yres, xres, aov_spp).astype(np.float32)))
+
+        self.buckets = list(generate_buckets(xres, yres, bucket_size))
+        self.sent_bytes = 0
+        self.wire_bytes = 0
+        self.transport = None
+        self._lock = threading.Lock()
+
+    @property
+    def num_buckets(self):
+        """
+        Returns number of buckets sent by the whole benchmark
+        @return: int
+        """
+        return len(self.buckets) * len(self.aovs) * self.frames * self.connections
+
+    def render(self, session):
+        """
+        Sends all frames of a single connection
+        @param session: int
+        @return:
+        """
+        client = Client(self.host, self.port, self.protocol, self.encodings, self.compression,
+                        self.adaptive, self.shared_memory)
+        sent_bytes = 0
+
+        for frame in range(self.frames):
+            client.send_header(DataHeader(session, self.xres, self.yres, frame=float(frame),
+                                          output_name="benchmark"))
+
+            for x, y, width, height in self.buckets:
+                for name, image in self.aovs:
+                    data = image[y:y + height, x:x + width]
+                    pixels = DataPixels(session, self.xres, self.yres, x, y, width, height,
+                                        data.shape[2], time.time_ns(), 0, name, data)
+                    client.send_pixels(pixels)
+                    sent_bytes += data.nbytes
+
+            transport = "shm" if client.ring is not None else "tcp"
+            client.close_image()
+
+        with self._lock:
+            self.sent_bytes += sent_bytes
+            self.wire_bytes += client.bytes
+            self.transport = transport
+
+    def run(self, timeout=60.0):
+        """
+        Runs the benchmark and returns its results
+        @param timeout: float: seconds to wait for the receiver to catch up
+        @return: dict
+        """
+        handler = background = None
+        port = self.port
+
+        if port is None:
+            if self.process:
+                background = ProcessReceiver(self.host)
+            else:
+                background = BackgroundReceiver(BenchmarkHandler(), self.host)
+            background.start()
+            handler = background.handler
+            self.port = background.port
+
+        try:
+            threads = [threading.Thread(target=self.render, args=(i + 1,))
+                       for i in range(self.connections)]
+
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            send_elapsed = time.time() - start
+
+            if handler is not None:
+                deadline = time.time() + timeout
+                while background.buckets < self.num_buckets and time.time() < deadline:
+                    time.sleep(0.01)
+        finally:
+            if background is not None:
+                background.stop()
+            self.port = port
+
+        results = dict(config=dict(xres=self.xres, yres=self.yres, bucket_size=self.bucket_size,
+                                   aovs=[(name, image.shape[2]) for name, image in self.aovs],
+                                   frames=self.frames, connections=self.connections,
+                                   protocol=self.protocol, encodings=self.encodings,
+                                   compression=self.compression, adaptive=self.adaptive,
+                                   transport=self.transport, process=self.process,
+                                   receiver="python" if handler else "%s:%d" % (self.host, port)),
+                       sent_buckets=self.num_buckets,
+                       sent_bytes=self.sent_bytes,
+                       wire_bytes=self.wire_bytes,
+                       send_seconds=send_elapsed)
+
+        if handler is None:
+            elapsed = send_elapsed
+            results.update(received_buckets=None, latency_ms=None)
+        else:
+            elapsed = handler.last_time / 1e9 - start if handler.buckets else send_elapsed
+            latencies = np.asarray(handler.latencies, np.float64) / 1e6
+            results.update(received_buckets=handler.buckets,
+                           latency_ms=dict(zip(("p50", "p90", "p99", "max"),
+                                               np.percentile(latencies, [50, 90, 99, 100])
+                                               .tolist())) if len(latencies) else None)
+
+        elapsed = max(elapsed, 1e-9)
+        results.update(seconds=elapsed,
+                       mb_per_s=self.sent_bytes / elapsed / 1e6,
+                       wire_mb_per_s=self.wire_bytes / elapsed / 1e6,
+                       buckets_per_s=self.num_buckets / elapsed)
+        return results
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    @param argv: list
+    @return: int
+    """
+    parser = argparse.ArgumentParser(description="Benchmark Aton protocol throughput.")
+    parser.add_argument("--res", type=int, nargs=2, default=(1920, 1080), metavar=("X", "Y"),
+                        help="image resolution")
+    parser.add_argument("--bucket-size", type=int, default=64, help="bucket size in pixels")
+    parser.add_argument("--aovs", type=int, default=1, help="number of AOVs")
+    parser.add_argument("--spp", type=int, nargs="+", default=[4], choices=(1, 3, 4),
+                        help="samples per pixel cycled over the AOVs")
+    parser.add_argument("--frames", type=int, default=1, help="frames per connection")
+    parser.add_argument("--connections", type=int, default=1, help="concurrent connections")
+    parser.add_argument("--host", default=get_host(), help="receiver host")
+    parser.add_argument("--port", type=int, help="receiver port, default is a Python receiver")
+    parser.add_argument("--protocol", type=int, default=PROTOCOL_V2, choices=(1, 2),
+                        help="highest protocol version to negotiate")
+    parser.add_argument("--encodings", help="AOV encodings, e.g. \"*=half Z=float\"")
+    parser.add_argument("--compression", help="compression codec, zstd, lz4, zlib or auto")
+    parser.add_argument("--no-adaptive", action="store_true",
+                        help="compress every bucket, even when it doesn't pay off")
+    parser.add_argument("--transport", default="auto", choices=("auto", "tcp", "shm"),
+                        help="shared memory or TCP, auto uses shared memory on this host")
+    parser.add_argument("--process", action="store_true",
+                        help="run the Python receiver in its own process")
+    parser.add_argument("--json", help="write results to a JSON file, - for stdout")
+    args = parser.parse_args(argv)
+
+    benchmark = Benchmark(args.res[0], args.res[1], args.bucket_size, args.aovs, args.spp,
+                          args.frames, args.connections, args.host, args.port, args.protocol,
+                          args.encodings, args.compression, not args.no_adaptive,
+                          shared_memory=dict(auto=None, tcp=False, shm=True)[args.transport],
+                          process=args.process)
+    results = benchmark.run()
+
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=4)
+        sys.stdout.write("\n")
+        return 0
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+    sys.stdout.write("Aton | %d buckets | %.2f MB | %.2f MB on wire | %.2f s | %.2f MB/s | "
+                     "%.1f buckets/s\n" %
+                     (results["sent_buckets"], results["sent_bytes"] / 1e6,
+                      results["wire_bytes"] / 1e6, results["seconds"], results["mb_per_s"],
+                      results["buckets_per_s"]))
+    if results["latency_ms"]:
+        sys.stdout.write("Aton | latency ms | p50 %(p50).3f | p90 %(p90).3f | p99 %(p99).3f | "
+                         "max %(max).3f\n" % results["latency_ms"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,462 @@
+"""
+Aton Broadcast
+
+Fan-out relay publishing one driver stream to several Aton nodes, e.g. a
+supervisor's review session next to the artist's Nuke. The image is also
+accumulated in the relay, so a subscriber which starts listening late, or
+reconnects, first receives a snapshot of everything rendered so far and
+then the live buckets. Every subscriber has its own sender thread and
+queue and never slows down the renderer or other subscribers, its policy
+decides what happens once its queue is full:
+
+coalesce: the queue is dropped and replaced by a snapshot once the
+          subscriber has caught up, newer buckets of the same rectangle
+          always replace queued ones
+drop:     new buckets are dropped until the queue has room again, the
+          subscriber gets a snapshot of the finished image on close
+
+Subscribers may only receive some AOVs, matched with fnmatch patterns,
+and a downsampled image, each pixel being the mean of factor x factor
+pixels.
+
+python aton_broadcast.py --port 9501 --subscribe 127.0.0.1:9201 \\
+    --subscribe review:9201:aovs=RGBA,Z:downsample=2:policy=drop
+"""
+
+import sys
+import time
+import fnmatch
+import asyncio
+import argparse
+import threading
+import collections
+
+import numpy as np
+
+from aton_protocol import PROTOCOL_V2, DataHeader, DataPixels, get_port
+from aton_receiver import Receiver, Handler
+from aton_client import Client, generate_buckets
+
+
+__author__ = "Vahan Sosoyan"
+__copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
+__version__ = "1.3.7"
+
+
+POLICY_COALESCE = "coalesce"
+POLICY_DROP = "drop"
+POLICIES = (POLICY_COALESCE, POLICY_DROP)
+
+
+def downsample(data, factor):
+    """
+    Averages factor x factor pixels, partial blocks at the edges included
+    @param data: numpy.ndarray: (height, width, spp)
+    @param factor: int
+    @return: numpy.ndarray: float32
+    """
+    if factor == 1:
+        return data
+
+    height, width = data.shape[:2]
+    rows = np.arange(0, height, factor)
+    cols = np.arange(0, width, factor)
+
+    sums = np.add.reduceat(np.add.reduceat(data, rows, axis=0, dtype=np.float64), cols, axis=1)
+    counts = np.outer(np.diff(np.append(rows, height)), np.diff(np.append(cols, width)))
+    return (sums / counts[..., None]).astype(np.float32)
+
+
+class Subscriber(object):
+    """
+    Aton node receiving the broadcast
+    """
+    def __init__(self, host, port, aovs=None, downsample=1, policy=POLICY_COALESCE,
+                 max_queue=1024, retry_interval=1.0, protocol=PROTOCOL_V2, encodings=None,
+                 compression=None):
+        """
+        @param host: str
+        @param port: int
+        @param aovs: list: fnmatch patterns of AOVs to send, None sends all
+        @param downsample: int: factor the resolution is divided by
+        @param policy: str: one of POLICIES
+        @param max_queue: int: queued buckets before the policy applies
+        @param retry_interval: float: seconds between connection attempts
+        @param protocol: int: highest protocol version to negotiate
+        @param encodings: str: AOV encodings, e.g. "*=half Z=float"
+        @param compression: str: codec name or auto
+        """
+        if policy not in POLICIES:
+            raise ValueError("Unknown policy %s, use one of %s" % (policy, ", ".join(POLICIES)))
+
+        self.client = Client(host, port, protocol, encodings, compression)
+        self.aovs = aovs
+        self.downsample = max(1, int(downsample))
+        self.policy = policy
+        self.max_queue = max_queue
+        self.retry_interval = retry_interval
+        self.broadcast = None
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+        self._queue = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self._resync = True
+        self._dropped = False
+        self._stop = False
+        self._thread = None
+
+    def __repr__(self):
+        return "Subscriber(%s:%d)" % (self.client.host, self.client.port)
+
+    def matches(self, aov_name):
+        """
+        Returns True if the given AOV is sent to this subscriber
+        @param aov_name: str
+        @return: bool
+        """
+        return self.aovs is None or any(fnmatch.fnmatchcase(aov_name, i) for i in self.aovs)
+
+    def start(self, broadcast):
+        """
+        Starts the sender thread
+        @param broadcast: BroadcastHandler
+        @return:
+        """
+        self.broadcast = broadcast
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the sender thread, dropping queued buckets
+        @return:
+        """
+        with self._condition:
+            self._stop = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def publish(self, key, item):
+        """
+        Queues a message according to the policy, never blocks
+        @param key: tuple
+        @param item: DataHeader, DataPixels or None to close the image
+        @return:
+        """
+        with self._condition:
+            if self._resync:
+                # Covered by the coming snapshot
+                self._condition.notify()
+                return
+
+            if key[0] == "close" and self._dropped:
+                # Catch up with the buckets dropped meanwhile
+                self._dropped = False
+                self._queue.clear()
+                self._resync = True
+                self._condition.notify()
+                return
+
+            if key[0] == "header":
+                # Queued buckets belong to the previous image
+                self._queue.pop(key, None)
+            elif key in self._queue:
+                self.coalesced += 1
+            elif len(self._queue) >= self.max_queue:
+                if self.policy == POLICY_DROP:
+                    self.dropped += 1
+                    self._dropped = True
+                    return
+                self.dropped += len(self._queue)
+                self._queue.clear()
+                self._resync = True
+                self._condition.notify()
+                return
+
+            self._queue[key] = item
+            self._condition.notify()
+
+    def _next(self):
+        """
+        Waits for the next message, a snapshot replaces the queue if needed
+        @return: tuple: key, item or None when stopped
+        """
+        with self._condition:
+            while not self._stop and not self._queue and \
+                    not (self._resync and self.broadcast.image_header is not None):
+                self._condition.wait()
+
+            if self._stop:
+                return None
+
+            resync, self._resync = self._resync, False
+            if not resync:
+                return self._queue.popitem(last=False)
+
+        snapshot = collections.OrderedDict(self.broadcast.snapshot(self))
+
+        with self._condition:
+            # Buckets published meanwhile are newer than the snapshot
+            snapshot.update(self._queue)
+            self._queue = snapshot
+            return self._queue.popitem(last=False)
+
+    def _run(self):
+        while True:
+            message = self._next()
+            if message is None:
+                break
+            key, item = message
+
+            try:
+                if key[0] == "header":
+                    self.client.send_header(item, reconnect=False)
+                elif key[0] == "close":
+                    if self.client.connected:
+                        self.client.close_image()
+                else:
+                    self.client.send_pixels(item)
+                    self.sent += 1
+            except OSError as e:
+                sys.stdout.write("Aton | %r: %s\n" % (self, e))
+                self.client.disconnect()
+
+                # Late joiners and reconnects start with a snapshot
+                with self._condition:
+                    self._queue.clear()
+                    self._resync = True
+                time.sleep(self.retry_interval)
+
+        self.client.disconnect()
+        self.client.close_ring()
+
+
+class BroadcastHandler(Handler):
+    """
+    Accumulates the incoming image and publishes it to all subscribers
+    """
+    def __init__(self, subscribers=(), bucket_size=64):
+        """
+        @param subscribers: list: Subscriber
+        @param bucket_size: int: bucket size of snapshots
+        """
+        self.subscribers = list()
+        self.bucket_size = bucket_size
+
+        self.image_header = None
+        self.images = collections.OrderedDict()
+
+        self._lock = threading.RLock()
+
+        for subscriber in subscribers:
+            self.add_subscriber(subscriber)
+
+    def add_subscriber(self, subscriber):
+        """
+        Starts publishing to the given subscriber
+        @param subscriber: Subscriber
+        @return:
+        """
+        with self._lock:
+            self.subscribers.append(subscriber)
+        subscriber.start(self)
+
+    def remove_subscriber(self, subscriber):
+        """
+        Stops publishing to the given subscriber
+        @param subscriber: Subscriber
+        @return:
+        """
+        with self._lock:
+            self.subscribers.remove(subscriber)
+        subscriber.stop()
+
+    def stop(self):
+        """
+        Stops all subscribers
+        @return:
+        """
+        for subscriber in list(self.subscribers):
+            self.remove_subscriber(subscriber)
+
+    def subscriber_header(self, subscriber):
+        """
+        Returns the current header scaled for the given subscriber
+        @param subscriber: Subscriber
+        @return: DataHeader
+        """
+        header, factor = self.image_header, subscriber.downsample
+        if factor == 1:
+            return header
+
+        return DataHeader(header.session, -(-header.xres // factor), -(-header.yres // factor),
+                          header.pixel_aspect, header.region_area // (factor * factor),
+                          header.version, header.frame, header.camera_fov, header.camera_matrix,
+                          header.samples, header.output_name)
+
+    def subscriber_pixels(self, subscriber, aov_name, x, y, width, height, spp=None, ram=0,
+                          time=0):
+        """
+        Returns the accumulated pixels covering the given rectangle scaled for the subscriber
+        @param subscriber: Subscriber
+        @param aov_name: str
+        @param x: int
+        @param y: int
+        @param width: int
+        @param height: int
+        @param spp: int
+        @param ram: int
+        @param time: int
+        @return: tuple: key, DataPixels
+        """
+        factor = subscriber.downsample
+        x0, y0 = x // factor, y // factor
+        x1, y1 = -(-(x + width) // factor), -(-(y + height) // factor)
+
+        with self._lock:
+            header, image = self.image_header, self.images[aov_name]
+            data = downsample(image[y0 * factor:y1 * factor, x0 * factor:x1 * factor], factor)
+            data = np.ascontiguousarray(data, np.float32)
+
+        pixels = DataPixels(header.session, -(-header.xres // factor), -(-header.yres // factor),
+                            x0, y0, x1 - x0, y1 - y0, image.shape[2], ram, time, aov_name, data)
+        return ("pixels", aov_name) + pixels.rect, pixels
+
+    def snapshot(self, subscriber):
+        """
+        Returns the messages bringing a subscriber up to date
+        @param subscriber: Subscriber
+        @return: list: tuple: key, item
+        """
+        with self._lock:
+            header = self.subscriber_header(subscriber)
+            messages = [(("header",), header)]
+
+            for aov_name in self.images:
+                if not subscriber.matches(aov_name):
+                    continue
+                for x, y, width, height in generate_buckets(self.image_header.xres,
+                                                            self.image_header.yres,
+                                                            self.bucket_size * subscriber.downsample):
+                    messages.append(self.subscriber_pixels(subscriber, aov_name, x, y, width,
+                                                           height))
+        return messages
+
+    def header(self, connection, header):
+        with self._lock:
+            last = self.image_header
+            if last is None or (last.session, last.xres, last.yres) != \
+                    (header.session, header.xres, header.yres):
+                self.images.clear()
+            self.image_header = header
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            subscriber.publish(("header",), self.subscriber_header(subscriber))
+
+    def pixels(self, connection, pixels):
+        if self.image_header is None:
+            return
+
+        x, y, width, height = pixels.rect
+        with self._lock:
+            image = self.images.get(pixels.aov_name)
+            if image is None or image.shape[2] != pixels.spp:
+                image = self.images[pixels.aov_name] = np.zeros(
+                    (self.image_header.yres, self.image_header.xres, pixels.spp), np.float32)
+            image[y:y + height, x:x + width] = pixels.data
+            subscribers = list(self.subscribers)
+
+        copy = None
+        for subscriber in subscribers:
+            if not subscriber.matches(pixels.aov_name):
+                continue
+
+            if subscriber.downsample == 1:
+                if copy is None:
+                    copy = DataPixels(pixels.session, pixels.xres, pixels.yres, x, y, width,
+                                      height, pixels.spp, pixels.ram, pixels.time,
+                                      pixels.aov_name, pixels.data.copy())
+                subscriber.publish(("pixels", pixels.aov_name) + pixels.rect, copy)
+            else:
+                subscriber.publish(*self.subscriber_pixels(subscriber, pixels.aov_name, x, y,
+                                                           width, height, pixels.spp, pixels.ram,
+                                                           pixels.time))
+
+    def close(self, connection):
+        for subscriber in list(self.subscribers):
+            subscriber.publish(("close",), None)
+
+
+def parse_subscriber(spec, **kwargs):
+    """
+    Creates a subscriber from host:port[:key=value...], keys being
+    aovs, downsample, policy, max_queue, encodings and compression
+    @param spec: str, e.g. "review:9201:aovs=RGBA,Z:downsample=2:policy=drop"
+    @param kwargs: dict: Subscriber defaults
+    @return: Subscriber
+    """
+    fields = spec.split(":")
+    if len(fields) < 2:
+        raise ValueError("Invalid subscriber %s, expected host:port" % spec)
+
+    options = dict(kwargs)
+    for field in fields[2:]:
+        key, _, value = field.partition("=")
+        if key == "aovs":
+            options[key] = value.split(",")
+        elif key in ("downsample", "max_queue"):
+            options[key] = int(value)
+        elif key in ("policy", "encodings", "compression"):
+            options[key] = value
+        else:
+            raise ValueError("Unknown subscriber option %s" % key)
+
+    return Subscriber(fields[0], int(fields[1]), **options)
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    @param argv: list
+    @return: int
+    """
+    parser = argparse.ArgumentParser(description="Broadcast an Aton driver stream to many nodes.")
+    parser.add_argument("--host", default="", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=get_port() + 300, help="port to listen on")
+    parser.add_argument("--subscribe", action="append", required=True, metavar="SPEC",
+                        help="host:port[:aovs=RGBA,Z][:downsample=2][:policy=drop]"
+                             "[:max_queue=1024][:encodings=*=half][:compression=auto]")
+    parser.add_argument("--bucket-size", type=int, default=64, help="bucket size of snapshots")
+    args = parser.parse_args(argv)
+
+    handler = BroadcastHandler(bucket_size=args.bucket_size)
+    receiver = Receiver(handler, args.host, args.port)
+    receiver.listen()
+
+    for spec in args.subscribe:
+        handler.add_subscriber(parse_subscriber(spec))
+
+    sys.stdout.write("Aton | Broadcasting port %d to %s\n" %
+                     (receiver.port, ", ".join(repr(i) for i in handler.subscribers)))
+
+    try:
+        asyncio.run(receiver.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for subscriber in handler.subscribers:
+            sys.stdout.write("Aton | %r | %d sent | %d dropped | %d coalesced\n" %
+                             (subscriber, subscriber.sent, subscriber.dropped,
+                              subscriber.coalesced))
+        handler.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,328 @@
+"""
+Aton Capture files
+
+A capture keeps Aton messages exactly as they were sent on the wire in an
+append-only data file, next to an index file with one fixed size record
+per message. Both files are memory-mapped when read, so a capture can be
+sliced by session, frame, AOV or region through the index and buckets are
+read as NumPy views without parsing the whole stream.
+
+capture = Capture("session.aton")
+for record in capture.select(frames=[1001], aovs=["RGBA"]):
+    pixels = capture.pixels(record)
+"""
+
+import os
+import time
+
+import numpy as np
+
+from aton_protocol import (KEY_HEADER, KEY_PIXELS, KEY_CLOSE, KEY_STRUCT, HEADER_STRUCT,
+                           PIXELS_STRUCT, PIXEL_DTYPE, DataHeader, DataPixels, decode_name,
+                           encode_name, pixels_view, pixels_buffer, close_message)
+
+
+__author__ = "Vahan Sosoyan"
+__copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
+__version__ = "1.3.7"
+
+
+CAPTURE_MAGIC = b"ATONCAP\x01"
+
+INDEX_EXT = ".idx"
+
+INDEX_DTYPE = np.dtype([("offset", "<u8"),         # Message start in the data file
+                        ("size", "<u8"),           # Message size in bytes including its key
+                        ("pixels_offset", "<u8"),  # Pixels start in the data file, 0 if none
+                        ("time", "<f8"),           # Seconds since the epoch when received
+                        ("session", "<i8"),
+                        ("frame", "<f4"),
+                        ("key", "<i4"),
+                        ("connection", "<i4"),     # Connection number within the capture
+                        ("x", "<i4"),
+                        ("y", "<i4"),
+                        ("width", "<i4"),
+                        ("height", "<i4"),
+                        ("spp", "<i4"),
+                        ("name", "S64")])          # AOV name or output name for headers
+
+
+def index_path(path):
+    """
+    Returns index file path of the given capture
+    @param path: str
+    @return: str
+    """
+    return path + INDEX_EXT
+
+
+class CaptureWriter(object):
+    """
+    Appends messages to a capture
+    """
+    def __init__(self, path):
+        """
+        @param path: str
+        """
+        self.path = path
+        self.frames = dict()
+
+        exists = os.path.exists(path) and os.path.getsize(path)
+
+        # Connections appended keep numbers apart from the recorded ones
+        self.next_connection = 0
+        if exists and os.path.exists(index_path(path)):
+            count = os.path.getsize(index_path(path)) // INDEX_DTYPE.itemsize
+            if count:
+                index = np.fromfile(index_path(path), INDEX_DTYPE, count)
+                self.next_connection = int(index["connection"].max()) + 1
+
+        self._data = open(path, "ab")
+        self._index = open(index_path(path), "ab")
+
+        if not exists:
+            self._data.write(CAPTURE_MAGIC)
+
+        self._offset = self._data.tell()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _append(self, buffers, record):
+        """
+        Writes message buffers and its index record
+        @param buffers: list: bytes-like
+        @param record: numpy.ndarray
+        @return:
+        """
+        record["offset"] = self._offset
+        for buf in buffers:
+            self._data.write(buf)
+            self._offset += memoryview(buf).nbytes
+        record["size"] = self._offset - record["offset"]
+        self._index.write(record.tobytes())
+
+    def write_header(self, header, connection=0, timestamp=None):
+        """
+        Appends a header message
+        @param header: DataHeader
+        @param connection: int
+        @param timestamp: float
+        @return:
+        """
+        self.frames[header.session] = header.frame
+
+        record = np.zeros(1, INDEX_DTYPE)
+        record["time"] = time.time() if timestamp is None else timestamp
+        record["session"] = header.session
+        record["frame"] = header.frame
+        record["key"] = KEY_HEADER
+        record["connection"] = connection
+        record["width"] = header.xres
+        record["height"] = header.yres
+        record["name"] = encode_name(header.output_name)[:64]
+        self._append([header.pack()], record)
+
+    def write_pixels(self, pixels, connection=0, timestamp=None):
+        """
+        Appends a pixels message
+        @param pixels: DataPixels
+        @param connection: int
+        @param timestamp: float
+        @return:
+        """
+        message = pixels.pack_header()
+
+        record = np.zeros(1, INDEX_DTYPE)
+        record["pixels_offset"] = self._offset + len(message)
+        record["time"] = time.time() if timestamp is None else timestamp
+        record["session"] = pixels.session
+        record["frame"] = self.frames.get(pixels.session, 0.0)
+        record["key"] = KEY_PIXELS
+        record["connection"] = connection
+        record["x"] = pixels.bucket_xo
+        record["y"] = pixels.bucket_yo
+        record["width"] = pixels.bucket_size_x
+        record["height"] = pixels.bucket_size_y
+        record["spp"] = pixels.spp
+        record["name"] = encode_name(pixels.aov_name)[:64]
+        self._append([message, pixels_buffer(pixels.data)], record)
+
+    def write_close(self, session=0, connection=0, timestamp=None):
+        """
+        Appends a close image message
+        @param session: int
+        @param connection: int
+        @param timestamp: float
+        @return:
+        """
+        record = np.zeros(1, INDEX_DTYPE)
+        record["time"] = time.time() if timestamp is None else timestamp
+        record["session"] = session
+        record["frame"] = self.frames.get(session, 0.0)
+        record["key"] = KEY_CLOSE
+        record["connection"] = connection
+        self._append([close_message()], record)
+
+    def flush(self):
+        """
+        Flushes both files, the data file first so the index never
+        points past the end of the data
+        @return:
+        """
+        self._data.flush()
+        self._index.flush()
+
+    def close(self):
+        """
+        Closes the capture
+        @return:
+        """
+        self.flush()
+        self._data.close()
+        self._index.close()
+
+
+class Capture(object):
+    """
+    Memory-mapped read access to a capture
+    """
+    def __init__(self, path):
+        """
+        @param path: str
+        """
+        self.path = path
+        self.data = np.memmap(path, np.uint8, "r")
+
+        if bytes(self.data[:len(CAPTURE_MAGIC)]) != CAPTURE_MAGIC:
+            raise ValueError("%s is not an Aton capture" % path)
+
+        # Ignore a partially written trailing record
+        index_file = index_path(path)
+        count = os.path.getsize(index_file) // INDEX_DTYPE.itemsize
+        if count:
+            self.index = np.memmap(index_file, INDEX_DTYPE, "r", shape=(count,))
+        else:
+            self.index = np.zeros(0, INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def sessions(self):
+        """
+        Returns captured session ids
+        @return: list: int
+        """
+        return [int(i) for i in np.unique(self.index["session"])]
+
+    @property
+    def frames(self):
+        """
+        Returns captured frames
+        @return: list: float
+        """
+        return [float(i) for i in np.unique(self.index["frame"])]
+
+    @property
+    def aovs(self):
+        """
+        Returns captured AOV names
+        @return: list: str
+        """
+        pixels = self.index[self.index["key"] == KEY_PIXELS]
+        return [decode_name(i) for i in np.unique(pixels["name"])]
+
+    @property
+    def duration(self):
+        """
+        Returns seconds between the first and the last message
+        @return: float
+        """
+        if not len(self.index):
+            return 0.0
+        return float(self.index["time"][-1] - self.index["time"][0])
+
+    def select(self, sessions=None, frames=None, aovs=None, region=None, keys=None):
+        """
+        Returns index records matching all given filters. Headers and close
+        messages are kept for the selected sessions and frames, AOV and
+        region filters only apply to buckets
+        @param sessions: list: int
+        @param frames: list: float
+        @param aovs: list: str
+        @param region: tuple: x, y, r, t buckets have to overlap
+        @param keys: list: int
+        @return: numpy.ndarray
+        """
+        index = self.index
+        mask = np.ones(len(index), bool)
+        is_pixels = index["key"] == KEY_PIXELS
+
+        if sessions is not None:
+            mask &= np.isin(index["session"], list(sessions))
+
+        if frames is not None:
+            mask &= np.isin(index["frame"], np.asarray(list(frames), np.float32))
+
+        if keys is not None:
+            mask &= np.isin(index["key"], list(keys))
+
+        if aovs is not None:
+            names = [encode_name(i)[:64].rstrip(b"\0") for i in aovs]
+            mask &= ~is_pixels | np.isin(index["name"], names)
+
+        if region is not None:
+            x, y, r, t = region
+            overlap = (index["x"] < r) & (index["x"] + index["width"] > x) & \
+                      (index["y"] < t) & (index["y"] + index["height"] > y)
+            mask &= ~is_pixels | overlap
+
+        return index[mask]
+
+    def message(self, record):
+        """
+        Returns raw message bytes as sent on the wire
+        @param record: numpy.void
+        @return: numpy.ndarray: uint8
+        """
+        offset = int(record["offset"])
+        return self.data[offset:offset + int(record["size"])]
+
+    def pixels_data(self, record):
+        """
+        Returns bucket pixels as a (height, width, spp) float32 view
+        @param record: numpy.void
+        @return: numpy.ndarray
+        """
+        offset = int(record["pixels_offset"])
+        width, height, spp = int(record["width"]), int(record["height"]), int(record["spp"])
+        size = width * height * spp * PIXEL_DTYPE.itemsize
+        return pixels_view(self.data[offset:offset + size], width, height, spp)
+
+    def header(self, record):
+        """
+        Decodes a header message
+        @param record: numpy.void
+        @return: DataHeader
+        """
+        message = self.message(record)
+        start = KEY_STRUCT.size
+        end = start + HEADER_STRUCT.size
+        fields = HEADER_STRUCT.unpack(message[start:end])
+        return DataHeader.unpack(fields, message[end:end + fields[-1]])
+
+    def pixels(self, record):
+        """
+        Decodes a pixels message, its data is a view into the capture
+        @param record: numpy.void
+        @return: DataPixels
+        """
+        message = self.message(record)
+        start = KEY_STRUCT.size
+        end = start + PIXELS_STRUCT.size
+        fields = PIXELS_STRUCT.unpack(message[start:end])
+        return DataPixels.unpack(fields, message[end:end + fields[-1]], self.pixels_data(record))
@@ -0,0 +1,341 @@
+"""
+Aton Client
+
+Python counterpart of the C++ Client class used by driver_aton, sending
+images from NumPy arrays to an Aton node or any other Aton receiver.
+Every bucket header is packed into one buffer and written together with
+the pixel buffer with a single vectored sendmsg call. Protocol v2 is
+negotiated on every connection, falling back to v1 for older servers.
+With v2 the pixels of every AOV may be sent as half floats or 8 and 10 bit
+integers, chosen with the same encodings string as the driver parameter,
+and compressed losslessly if the server can decode the chosen codec.
+Servers on the same host receive the pixels through shared memory.
+
+from aton_client import Client
+from aton_protocol import DataHeader
+
+header = DataHeader(session=1, xres=1920, yres=1080, output_name="python")
+client = Client("127.0.0.1", 9201)
+client.send_header(header)
+client.send_image(header.session, image, "RGBA")
+client.close_image()
+"""
+
+import socket
+
+import numpy as np
+
+from aton_protocol import (PROTOCOL_V1, PROTOCOL_V2, CAPABILITIES, CAP_ENCODINGS, HELLO_MAGIC,
+                           HELLO_STRUCT, ENCODING_FLOAT32, CAP_SHARED_MEMORY, FLAG_SHARED,
+                           SHM_REF_STRUCT, DataPixels, get_host, get_port, get_spp,
+                           pixels_buffer, close_message, quit_message, hello_message, aov_message,
+                           shm_message, parse_encodings, encode_pixels, encoding_itemsize)
+from aton_compression import AdaptiveCompressor, get_codec
+from aton_shm import DEFAULT_RING_SIZE, SharedRing, is_local_host
+
+
+__author__ = "Vahan Sosoyan"
+__copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
+__version__ = "1.3.7"
+
+
+def generate_buckets(xres, yres, bucket_size=64):
+    """
+    Generates bucket rectangles covering the image top to bottom
+    @param xres: int
+    @param yres: int
+    @param bucket_size: int
+    @return: list: tuple: x, y, width, height
+    """
+    for y in range(0, yres, bucket_size):
+        for x in range(0, xres, bucket_size):
+            yield x, y, min(bucket_size, xres - x), min(bucket_size, yres - y)
+
+
+class Client(object):
+    """
+    Sends images to an Aton server
+    """
+    def __init__(self, host=None, port=None, protocol=PROTOCOL_V2, encodings=None,
+                 compression=None, adaptive=True, shared_memory=None, ring_size=DEFAULT_RING_SIZE):
+        """
+        @param host: str
+        @param port: int
+        @param protocol: int: highest protocol version to negotiate
+        @param encodings: str: AOV encodings, e.g. "*=half Z=float"
+        @param compression: str: codec name or auto, None sends uncompressed
+        @param adaptive: bool: only compress while it pays off, see AdaptiveCompressor
+        @param shared_memory: bool: pass pixels through shared memory if the server supports it,
+                              None does so for servers on this host
+        @param ring_size: int: shared memory ring size in bytes
+        """
+        self.host = get_host() if host is None else host
+        self.port = get_port() if port is None else port
+        self.protocol = protocol
+        self.capabilities = 0
+        self.encodings = parse_encodings(encodings)
+        self.compression = compression
+        self.adaptive = adaptive
+        self.compressor = None
+        self.shared_memory = shared_memory
+        self.ring_size = ring_size
+        self.ring = None
+        self._ring_connected = False
+        self.sock = None
+        self.bytes = 0
+
+        self._aov_ids = dict()
+        self._compress = False
+
+    @property
+    def connected(self):
+        """
+        Returns True if connected
+        @return: bool
+        """
+        return self.sock is not None
+
+    def connect(self):
+        """
+        Connects to the server, closing the previous connection
+        @return:
+        """
+        self.disconnect()
+        self.sock = socket.create_connection((self.host, self.port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._aov_ids.clear()
+        self._compress = False
+
+        if self.protocol >= PROTOCOL_V2 and not self.hello():
+            # v1 servers close the connection, stay on v1 from now on
+            self.protocol = PROTOCOL_V1
+            self.connect()
+            return
+
+        if self.compression and self.protocol >= PROTOCOL_V2:
+            codec = get_codec(self.compression, self.capabilities)
+            if codec is not None and (self.compressor is None or
+                                      self.compressor.codec.codec != codec):
+                # Keep compression statistics over reconnects
+                self.compressor = AdaptiveCompressor.for_host(self.host, codec=codec,
+                                                              adaptive=self.adaptive)
+            self._compress = codec is not None
+
+        if self.protocol >= PROTOCOL_V2 and self.capabilities & CAP_SHARED_MEMORY:
+            if self.shared_memory is None:
+                self.shared_memory = is_local_host(self.host)
+            if self.shared_memory:
+                self.open_ring()
+
+    def open_ring(self):
+        """
+        Creates the shared memory ring, or reuses it once the previous
+        connection has released everything, and announces it
+        @return:
+        """
+        if self.ring is not None and not self.ring.drain(1.0):
+            self.close_ring()
+        if self.ring is None:
+            self.ring = SharedRing.create(self.ring_size)
+
+        self.send(shm_message(self.ring.name, self.ring.capacity))
+        self._ring_connected = True
+
+    def close_ring(self):
+        """
+        Closes and removes the shared memory ring
+        @return:
+        """
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        self._ring_connected = False
+
+    def hello(self):
+        """
+        Negotiates the protocol version, returns False if the server has
+        closed the connection
+        @return: bool
+        """
+        reply = bytearray(HELLO_STRUCT.size)
+        try:
+            self.sock.sendall(hello_message(self.protocol))
+            view = memoryview(reply)
+            while view:
+                count = self.sock.recv_into(view)
+                if not count:
+                    return False
+                view = view[count:]
+        except (ConnectionResetError, BrokenPipeError):
+            return False
+
+        magic, version, capabilities = HELLO_STRUCT.unpack(reply)
+        if magic != HELLO_MAGIC:
+            return False
+
+        self.protocol = min(self.protocol, version)
+        self.capabilities = capabilities & CAPABILITIES
+        return True
+
+    def get_encoding(self, aov_name):
+        """
+        Returns pixel encoding of the given AOV for the current connection
+        @param aov_name: str
+        @return: int
+        """
+        if self.protocol < PROTOCOL_V2 or not self.capabilities & CAP_ENCODINGS:
+            return ENCODING_FLOAT32
+        return self.encodings.get(aov_name, self.encodings.get("*", ENCODING_FLOAT32))
+
+    def disconnect(self):
+        """
+        Closes the connection, the shared memory ring is kept for reconnecting
+        @return:
+        """
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self._ring_connected = False
+
+    def send(self, *buffers):
+        """
+        Writes all given buffers with as few system calls as possible
+        @param buffers: list: bytes-like
+        @return:
+        """
+        views = [memoryview(i).cast("B") for i in buffers]
+        self.bytes += sum(len(i) for i in views)
+
+        if not hasattr(self.sock, "sendmsg"):
+            for view in views:
+                self.sock.sendall(view)
+            return
+        while views:
+            sent = self.sock.sendmsg(views)
+            while views and sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            if views and sent:
+                views[0] = views[0][sent:]
+
+    def send_header(self, header, reconnect=True):
+        """
+        Connects and opens a new image
+        @param header: DataHeader
+        @param reconnect: bool: False keeps sending over the current connection
+        @return:
+        """
+        if reconnect or not self.connected:
+            self.connect()
+        if self.protocol >= PROTOCOL_V2:
+            self.send(header.pack_v2())
+        else:
+            self.send(header.pack())
+
+    def send_pixels(self, pixels):
+        """
+        Sends a bucket of pixels
+        @param pixels: DataPixels
+        @return:
+        """
+        data = pixels_buffer(pixels.data)
+        if data.size != pixels.num_samples:
+            raise ValueError("Expected %d samples for %r, got %d" %
+                             (pixels.num_samples, pixels, data.size))
+
+        if self.protocol < PROTOCOL_V2:
+            self.send(pixels.pack_header(), data)
+            return
+
+        buffers = list()
+        aov = self._aov_ids.get(pixels.aov_name)
+        if aov is None:
+            aov = len(self._aov_ids), self.get_encoding(pixels.aov_name)
+            self._aov_ids[pixels.aov_name] = aov
+            buffers.append(aov_message(aov[0], pixels.aov_name, pixels.spp, aov[1]))
+
+        aov_id, encoding = aov
+        if self._ring_connected:
+            size = data.nbytes if encoding == ENCODING_FLOAT32 else None
+            if size is not None:
+                position, view = self.ring.reserve(size)
+                np.copyto(np.frombuffer(view, data.dtype), data.ravel())
+            else:
+                data = encode_pixels(data, encoding)
+                size = data.nbytes
+                position, view = self.ring.reserve(size)
+                view[:] = memoryview(data).cast("B")
+            del view
+
+            buffers += [pixels.pack_header_v2(aov_id, FLAG_SHARED, SHM_REF_STRUCT.size),
+                        SHM_REF_STRUCT.pack(position, size)]
+            self.send(*buffers)
+            return
+
+        data = encode_pixels(data, encoding)
+
+        flags = 0
+        if self._compress:
+            flags, data = self.compressor.compress(pixels.aov_name, data,
+                                                   encoding_itemsize(encoding))
+
+        buffers += [pixels.pack_header_v2(aov_id, flags, len(memoryview(data).cast("B"))), data]
+        self.send(*buffers)
+
+    def send_bucket(self, session, xres, yres, x, y, data, aov_name, ram=0, time=0):
+        """
+        Sends a bucket from a (height, width, spp) or (height, width) array
+        @param session: int
+        @param xres: int
+        @param yres: int
+        @param x: int
+        @param y: int
+        @param data: numpy.ndarray
+        @param aov_name: str
+        @param ram: int
+        @param time: int
+        @return:
+        """
+        height, width = data.shape[:2]
+        spp = data.shape[2] if data.ndim == 3 else 1
+
+        self.send_pixels(DataPixels(session, xres, yres, x, y, width, height, spp, ram, time,
+                                    aov_name, data))
+
+    def send_image(self, session, image, aov_name, bucket_size=64):
+        """
+        Sends the whole (yres, xres, spp) image bucket by bucket
+        @param session: int
+        @param image: numpy.ndarray
+        @param aov_name: str
+        @param bucket_size: int
+        @return:
+        """
+        yres, xres = image.shape[:2]
+        if image.ndim == 3 and image.shape[2] != get_spp(image.shape[2]):
+            raise ValueError("Unsupported number of channels %d" % image.shape[2])
+
+        for x, y, width, height in generate_buckets(xres, yres, bucket_size):
+            self.send_bucket(session, xres, yres, x, y, image[y:y + height, x:x + width], aov_name)
+
+    def close_image(self):
+        """
+        Tells the server the image is finished and disconnects
+        @return:
+        """
+        self.send(close_message(self.protocol))
+        if self._ring_connected:
+            # The server may not have attached to the ring yet
+            self.ring.drain()
+        self.disconnect()
+        self.close_ring()
+
+    def quit(self):
+        """
+        Stops the server
+        @return:
+        """
+        self.connect()
+        self.send(quit_message(self.protocol))
+        self.disconnect()
+        self.close_ring()
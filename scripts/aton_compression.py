@@ -0,0 +1,440 @@
+"""
+Aton Compression
+
+Lossless per bucket compression for protocol v2. The encoded pixels are
+byte-shuffled, i.e. split into planes of the n-th byte of every sample,
+each plane is delta coded and the result is compressed with a fast codec.
+zstd and lz4 are used if the zstandard and lz4 modules are installed,
+zlib is always available.
+
+AdaptiveCompressor decides per AOV whether compressing is worth it, by
+comparing the time compression takes with the time it saves on the link.
+On loopback or when the CPU can't keep up with the link it sends buckets
+uncompressed and probes again every now and then.
+
+Compare codecs on synthetic AOVs from the command line
+
+python aton_compression.py --res 1920 1080
+"""
+
+import sys
+import json
+import time
+import zlib
+import argparse
+import ipaddress
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.block as lz4_block
+except ImportError:
+    lz4_block = None
+
+from aton_protocol import (CAP_AOV_TABLE, CAP_ENCODINGS, CAP_ZLIB, CAP_LZ4, CAP_ZSTD,
+                           COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_LZ4, COMPRESSION_ZSTD,
+                           FLAG_CODEC_MASK, FLAG_SHUFFLE, FLAG_DELTA)
+
+
+__author__ = "Vahan Sosoyan"
+__copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
+__version__ = "1.3.7"
+
+
+CODECS = {"zlib": COMPRESSION_ZLIB,
+          "lz4": COMPRESSION_LZ4,
+          "zstd": COMPRESSION_ZSTD}
+
+CODEC_CAPABILITIES = {COMPRESSION_ZLIB: CAP_ZLIB,
+                      COMPRESSION_LZ4: CAP_LZ4,
+                      COMPRESSION_ZSTD: CAP_ZSTD}
+
+# Bytes per second of a 1 GbE link
+DEFAULT_LINK_SPEED = 125e6
+
+
+def available_codecs():
+    """
+    Returns names of the codecs usable in this Python
+    @return: list: str
+    """
+    codecs = list()
+    if zstandard is not None:
+        codecs.append("zstd")
+    if lz4_block is not None:
+        codecs.append("lz4")
+    codecs.append("zlib")
+    return codecs
+
+
+def capabilities():
+    """
+    Returns hello capabilities of a receiver in this Python
+    @return: int
+    """
+    caps = CAP_AOV_TABLE | CAP_ENCODINGS
+    for name in available_codecs():
+        caps |= CODEC_CAPABILITIES[CODECS[name]]
+    return caps
+
+
+def get_codec(name=None, server_capabilities=None):
+    """
+    Returns codec id of the given name, the fastest available one by default.
+    With server capabilities returns None if the server can't decode it
+    @param name: str: codec name or auto
+    @param server_capabilities: int
+    @return: int
+    """
+    codecs = available_codecs()
+    if server_capabilities is not None:
+        codecs = [i for i in codecs if server_capabilities & CODEC_CAPABILITIES[CODECS[i]]]
+
+    if name is None or name == "auto":
+        return CODECS[codecs[0]] if codecs else None
+
+    if name not in CODECS:
+        raise ValueError("Unknown codec %s, use one of %s" % (name, ", ".join(CODECS)))
+    if name not in codecs:
+        if server_capabilities is not None:
+            return None
+        raise ValueError("Codec %s is not available, install its Python module" % name)
+    return CODECS[name]
+
+
+def shuffle(data, itemsize):
+    """
+    Splits samples of itemsize bytes into byte planes
+    @param data: bytes-like
+    @param itemsize: int
+    @return: numpy.ndarray: (itemsize, samples) uint8
+    """
+    data = np.frombuffer(data, np.uint8)
+    return np.ascontiguousarray(data.reshape(-1, itemsize).T)
+
+
+def unshuffle(planes):
+    """
+    Joins byte planes back into samples
+    @param planes: numpy.ndarray: (itemsize, samples) uint8
+    @return: numpy.ndarray: uint8
+    """
+    return np.ascontiguousarray(planes.T).ravel()
+
+
+def delta(planes):
+    """
+    Replaces every byte of a plane with its difference to the previous one
+    @param planes: numpy.ndarray: (itemsize, samples) uint8
+    @return: numpy.ndarray
+    """
+    out = np.empty_like(planes)
+    out[:, :1] = planes[:, :1]
+    np.subtract(planes[:, 1:], planes[:, :-1], out=out[:, 1:])
+    return out
+
+
+def undelta(planes):
+    """
+    Reverts delta
+    @param planes: numpy.ndarray: (itemsize, samples) uint8
+    @return: numpy.ndarray
+    """
+    return np.cumsum(planes, axis=1, dtype=np.uint8)
+
+
+class Codec(object):
+    """
+    Compresses and decompresses bucket payloads, keeping codec contexts around
+    """
+    def __init__(self, codec=None, level=None):
+        """
+        @param codec: int: one of CODECS, the fastest available by default
+        @param level: int: codec compression level
+        """
+        self.codec = get_codec() if codec is None else codec
+        self.level = level
+
+        self._compressor = self._decompressor = None
+        if zstandard is not None:
+            self._compressor = zstandard.ZstdCompressor(level=1 if level is None else level)
+            self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data, itemsize=4, filters=FLAG_SHUFFLE | FLAG_DELTA):
+        """
+        Compresses encoded pixels
+        @param data: bytes-like
+        @param itemsize: int: bytes per encoded sample
+        @param filters: int: FLAG_SHUFFLE and FLAG_DELTA
+        @return: tuple: flags, bytes
+        """
+        if filters & FLAG_SHUFFLE and itemsize > 1:
+            planes = shuffle(data, itemsize)
+            if filters & FLAG_DELTA:
+                planes = delta(planes)
+            data = planes
+        else:
+            filters = 0
+
+        data = memoryview(data).cast("B")
+
+        if self.codec == COMPRESSION_ZSTD:
+            payload = self._compressor.compress(data)
+        elif self.codec == COMPRESSION_LZ4:
+            payload = lz4_block.compress(data, store_size=False,
+                                         acceleration=1 if self.level is None else self.level)
+        else:
+            payload = zlib.compress(data, 1 if self.level is None else self.level)
+
+        return self.codec | filters, payload
+
+    def decompress(self, payload, flags, size, itemsize=4):
+        """
+        Decompresses a payload
+        @param payload: bytes-like
+        @param flags: int: pixels message flags
+        @param size: int: size of the encoded pixels
+        @param itemsize: int: bytes per encoded sample
+        @return: numpy.ndarray: uint8
+        """
+        codec = flags & FLAG_CODEC_MASK
+        payload = bytes(payload)
+
+        if codec == COMPRESSION_ZSTD:
+            if self._decompressor is None:
+                raise RuntimeError("Install zstandard to receive zstd compressed buckets")
+            data = self._decompressor.decompress(payload, max_output_size=size)
+        elif codec == COMPRESSION_LZ4:
+            if lz4_block is None:
+                raise RuntimeError("Install lz4 to receive lz4 compressed buckets")
+            data = lz4_block.decompress(payload, uncompressed_size=size)
+        elif codec == COMPRESSION_ZLIB:
+            data = zlib.decompress(payload, bufsize=size)
+        else:
+            raise ValueError("Unknown compression %d" % codec)
+
+        data = np.frombuffer(data, np.uint8)
+        if flags & FLAG_SHUFFLE:
+            planes = data.reshape(itemsize, -1)
+            if flags & FLAG_DELTA:
+                planes = undelta(planes)
+            data = unshuffle(planes)
+        return data
+
+
+class AdaptiveCompressor(object):
+    """
+    Compresses buckets of every AOV only while it pays off
+    """
+    def __init__(self, codec=None, level=None, link_speed=DEFAULT_LINK_SPEED, min_ratio=0.9,
+                 probe_interval=64, filters=FLAG_SHUFFLE | FLAG_DELTA, adaptive=True):
+        """
+        @param codec: int: one of CODECS, the fastest available by default
+        @param level: int
+        @param link_speed: float: bytes per second, None for loopback
+        @param min_ratio: float: compressed buckets larger than that are sent raw
+        @param probe_interval: int: buckets sent raw before compressing is tried again
+        @param filters: int: FLAG_SHUFFLE and FLAG_DELTA
+        @param adaptive: bool: False always compresses
+        """
+        self.codec = Codec(codec, level)
+        self.link_speed = link_speed
+        self.min_ratio = min_ratio
+        self.probe_interval = probe_interval
+        self.filters = filters
+        self.adaptive = adaptive
+
+        # aov name: [ratio, compression bytes per second, buckets to skip]
+        self.stats = dict()
+
+    @classmethod
+    def for_host(cls, host, **kwargs):
+        """
+        Creates a compressor which never compresses for loopback hosts
+        @param host: str
+        @param kwargs: dict: AdaptiveCompressor arguments
+        @return: AdaptiveCompressor
+        """
+        try:
+            loopback = ipaddress.ip_address(host).is_loopback
+        except ValueError:
+            loopback = host == "localhost"
+
+        if loopback:
+            kwargs["link_speed"] = None
+        return cls(**kwargs)
+
+    def worth_it(self, ratio, speed):
+        """
+        Returns True if compressing is faster than sending the saved bytes
+        @param ratio: float: compressed / raw size
+        @param speed: float: compressed raw bytes per second
+        @return: bool
+        """
+        if ratio > self.min_ratio or not self.link_speed:
+            return False
+        return speed > self.link_speed / (1.0 - ratio)
+
+    def compress(self, aov_name, data, itemsize=4):
+        """
+        Returns the flags and payload to send for the given encoded pixels
+        @param aov_name: str
+        @param data: numpy.ndarray
+        @param itemsize: int: bytes per encoded sample
+        @return: tuple: flags, bytes-like
+        """
+        if not self.adaptive:
+            return self.codec.compress(data, itemsize, self.filters)
+
+        stats = self.stats.setdefault(aov_name, [1.0, 0.0, 0])
+        if stats[2] > 0:
+            stats[2] -= 1
+            return COMPRESSION_NONE, data
+
+        start = time.perf_counter()
+        flags, payload = self.codec.compress(data, itemsize, self.filters)
+        elapsed = max(time.perf_counter() - start, 1e-9)
+
+        stats[0] = len(payload) / float(max(data.nbytes, 1))
+        stats[1] = data.nbytes / elapsed
+
+        if not self.worth_it(stats[0], stats[1]):
+            stats[2] = self.probe_interval
+            if stats[0] >= 1.0:
+                return COMPRESSION_NONE, data
+        return flags, payload
+
+
+def synthetic_aovs(xres, yres, seed=0):
+    """
+    Returns AOVs resembling rendered ones, from noisy beauty to flat ids
+    @param xres: int
+    @param yres: int
+    @param seed: int
+    @return: list: tuple: name, (yres, xres, spp) float32 array
+    """
+    rng = np.random.default_rng(seed)
+    v, u = np.mgrid[0:yres, 0:xres].astype(np.float32)
+    u /= xres
+    v /= yres
+
+    z = 10.0 + 5.0 * u + 2.0 * np.sin(v * 6.0)
+    normal = np.stack([u - 0.5, v - 0.5, np.full_like(u, 0.5)], axis=-1)
+    normal /= np.linalg.norm(normal, axis=-1, keepdims=True)
+    beauty = np.stack([u, v, 0.5 * (u + v), np.ones_like(u)], axis=-1)
+    beauty[..., :3] += rng.normal(0.0, 0.02, (yres, xres, 3))
+
+    return [("RGBA", beauty.astype(np.float32)),
+            ("Z", z[..., None].astype(np.float32)),
+            ("P", np.stack([u * 10.0, v * 10.0, z], axis=-1).astype(np.float32)),
+            ("N", normal.astype(np.float32)),
+            ("ID", (np.floor(u * 8) + np.floor(v * 8) * 8)[..., None].astype(np.float32))]
+
+
+def measure_codec(codec, aovs, bucket_size=64, filters=FLAG_SHUFFLE | FLAG_DELTA):
+    """
+    Compresses and decompresses all AOVs bucket by bucket
+    @param codec: Codec
+    @param aovs: list: tuple: name, image
+    @param bucket_size: int
+    @param filters: int
+    @return: dict: aov name: ratio, compress and decompress MB/s
+    """
+    from aton_client import generate_buckets
+
+    results = dict()
+    for name, image in aovs:
+        yres, xres, spp = image.shape
+        raw = packed = 0
+        compress_time = decompress_time = 0.0
+
+        for x, y, width, height in generate_buckets(xres, yres, bucket_size):
+            data = np.ascontiguousarray(image[y:y + height, x:x + width])
+
+            start = time.perf_counter()
+            flags, payload = codec.compress(data, 4, filters)
+            compress_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            decoded = codec.decompress(payload, flags, data.nbytes, 4)
+            decompress_time += time.perf_counter() - start
+
+            if decoded.tobytes() != data.tobytes():
+                raise RuntimeError("Lossy round trip of %s" % name)
+
+            raw += data.nbytes
+            packed += len(payload)
+
+        results[name] = dict(ratio=packed / float(raw),
+                             compress_mb_per_s=raw / max(compress_time, 1e-9) / 1e6,
+                             decompress_mb_per_s=raw / max(decompress_time, 1e-9) / 1e6)
+    return results
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    @param argv: list
+    @return: int
+    """
+    parser = argparse.ArgumentParser(description="Compare Aton bucket compression codecs.")
+    parser.add_argument("--res", type=int, nargs=2, default=(1920, 1080), metavar=("X", "Y"),
+                        help="image resolution")
+    parser.add_argument("--bucket-size", type=int, default=64, help="bucket size in pixels")
+    parser.add_argument("--no-filters", action="store_true", help="disable shuffle and delta")
+    parser.add_argument("--latency", action="store_true",
+                        help="also measure end to end latency through a Python receiver")
+    parser.add_argument("--json", help="write results to a JSON file, - for stdout")
+    args = parser.parse_args(argv)
+
+    filters = 0 if args.no_filters else FLAG_SHUFFLE | FLAG_DELTA
+    aovs = synthetic_aovs(*args.res)
+    results = dict(none=dict()) if args.latency else dict()
+
+    for name in available_codecs():
+        codec_results = measure_codec(Codec(CODECS[name]), aovs, args.bucket_size, filters)
+        results[name] = dict(aovs=codec_results)
+
+    if args.latency:
+        from aton_benchmark import Benchmark
+
+        # Buckets go over TCP, the shared memory ring would bypass the codecs
+        for name in [None] + available_codecs():
+            benchmark = Benchmark(args.res[0], args.res[1], args.bucket_size,
+                                  images=aovs, compression=name, adaptive=False,
+                                  shared_memory=False)
+            run = benchmark.run()
+            results.setdefault(name or "none", dict()).update(
+                wire_bytes=run["wire_bytes"], latency_ms=run["latency_ms"],
+                mb_per_s=run["mb_per_s"])
+
+    if args.json:
+        if args.json == "-":
+            json.dump(results, sys.stdout, indent=4)
+            sys.stdout.write("\n")
+            return 0
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+    for name, codec_results in results.items():
+        for aov, aov_results in codec_results.get("aovs", dict()).items():
+            sys.stdout.write("Aton | %-5s | %-5s | ratio %.3f | compress %7.1f MB/s | "
+                             "decompress %7.1f MB/s\n" %
+                             (name, aov, aov_results["ratio"], aov_results["compress_mb_per_s"],
+                              aov_results["decompress_mb_per_s"]))
+        if "latency_ms" in codec_results:
+            sys.stdout.write("Aton | %-5s | %.2f MB on wire | %.2f MB/s | latency p50 %.3f ms | "
+                             "p99 %.3f ms\n" %
+                             (name, codec_results["wire_bytes"] / 1e6, codec_results["mb_per_s"],
+                              codec_results["latency_ms"]["p50"],
+                              codec_results["latency_ms"]["p99"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,302 @@
+"""
+Aton Farm
+
+Farm job polling shared by the DCC panels, kept apart from their
+application modules so it runs and can be checked without them.
+FarmMonitor polls the status of submitted jobs in batches, calls back
+with the changed ones and polls less often while nothing changes. Jobs
+reaching a final status are not polled again.
+
+Check the monitor against a fake scheduler with
+
+python aton_farm.py --jobs 1200 --batch-size 500
+"""
+
+import sys
+import threading
+import argparse
+
+
+__author__ = "Vahan Sosoyan"
+__copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
+__version__ = "1.3.7"
+
+
+# Farm job statuses returned by the farm status functions
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_STATUSES = (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)
+JOB_FINAL_STATUSES = (JOB_DONE, JOB_FAILED)
+
+
+def warn(msg, *params):
+    """
+    Writes a warning to stderr
+    @param msg: str
+    @param params: __repr__
+    @return:
+    """
+    sys.stderr.write("Aton | %s\n" % (msg % params))
+
+
+class FarmMonitor(object):
+    """
+    Polls the status of submitted farm jobs in batches and calls back
+    with the changed ones, polling less often while nothing changes
+    """
+    def __init__(self, status_function, updated_function=None, min_interval=2.0,
+                 max_interval=60.0, batch_size=500, warn_function=warn):
+        """
+        @param status_function: function: list of job ids, returns dict of job id: status
+        @param updated_function: function: called from the polling thread with
+                                 dict of changed job id: status
+        @param min_interval: float: seconds
+        @param max_interval: float: seconds
+        @param batch_size: int: job ids per status call
+        @param warn_function: function: called with message and params if a status call fails
+        """
+        self._status_function = status_function
+        self._updated_function = updated_function
+        self._warn_function = warn_function
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._batch_size = batch_size
+        self._statuses = dict()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+    @property
+    def statuses(self):
+        """
+        Returns the last status of every watched job, None if not known yet
+        @return: dict: job id: status
+        """
+        with self._lock:
+            return dict(self._statuses)
+
+    def watch(self, job_ids, start=True):
+        """
+        Starts polling the given jobs, restarting from the shortest interval
+        @param job_ids: list
+        @param start: bool: False only adds the jobs, leaving polling to step()
+        @return:
+        """
+        with self._lock:
+            for job_id in job_ids:
+                self._statuses.setdefault(job_id, None)
+        if not start:
+            return
+        self._wake.set()
+
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def forget(self, job_ids):
+        """
+        Stops polling the given jobs
+        @param job_ids: list
+        @return:
+        """
+        with self._lock:
+            for job_id in job_ids:
+                self._statuses.pop(job_id, None)
+
+    def stop(self):
+        """
+        Stops the thread after the current poll
+        @return:
+        """
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def run(self):
+        """
+        Executes the thread
+        @return:
+        """
+        interval = self._min_interval
+        while not self._stopped:
+            self._wake.wait(interval)
+            if self._stopped:
+                break
+            if self._wake.is_set():
+                self._wake.clear()
+                interval = self._min_interval
+
+            interval = self.step(interval)
+
+    def step(self, interval):
+        """
+        Polls once, returns the interval until the next poll
+        @param interval: float: seconds since the previous poll
+        @return: float
+        """
+        changed = self.poll()
+        if changed is None:
+            return min(interval * 2, self._max_interval)
+        elif changed:
+            if self._updated_function is not None:
+                self._updated_function(changed)
+            return self._min_interval
+        return min(interval * 1.5, self._max_interval)
+
+    def poll(self):
+        """
+        Gets the status of all unfinished jobs, returns None if the status call failed
+        @return: dict: changed job id: status
+        """
+        with self._lock:
+            job_ids = [job_id for job_id, status in self._statuses.items()
+                       if status not in JOB_FINAL_STATUSES]
+
+        statuses = dict()
+        for i in range(0, len(job_ids), self._batch_size):
+            try:
+                statuses.update(self._status_function(job_ids[i:i + self._batch_size]) or dict())
+            except Exception as e:
+                if self._warn_function is not None:
+                    self._warn_function("Farm status failed: %s", str(e))
+                return
+
+        changed = dict()
+        with self._lock:
+            for job_id, status in statuses.items():
+                if job_id in self._statuses and self._statuses[job_id] != status:
+                    self._statuses[job_id] = changed[job_id] = status
+        return changed
+
+
+class FakeScheduler(object):
+    """
+    Scheduler stand-in for checking FarmMonitor, every job moves
+    one status further along its statuses on each status call
+    """
+    def __init__(self):
+        self.jobs = dict()
+        self.calls = list()
+        self.failures = 0
+
+    def submit(self, job_id, statuses=(JOB_QUEUED, JOB_RUNNING, JOB_DONE)):
+        """
+        Adds a job going through the given statuses
+        @param job_id: str
+        @param statuses: tuple: str
+        @return:
+        """
+        self.jobs[job_id] = list(statuses)
+
+    def status(self, job_ids):
+        """
+        Status function of the fake farm, fails while failures are left
+        @param job_ids: list
+        @return: dict: job id: status
+        """
+        self.calls.append(list(job_ids))
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("scheduler unavailable")
+
+        statuses = dict()
+        for job_id in job_ids:
+            steps = self.jobs[job_id]
+            statuses[job_id] = steps.pop(0) if len(steps) > 1 else steps[0]
+        return statuses
+
+
+def check_monitor(num_jobs=1200, batch_size=500, stream=sys.stdout):
+    """
+    Checks batching, backoff and final status pruning of FarmMonitor
+    against a FakeScheduler, raises RuntimeError on the first failure
+    @param num_jobs: int
+    @param batch_size: int
+    @param stream: file: checks are reported to, None is quiet
+    @return:
+    """
+    def expect(condition, message, *params):
+        if not condition:
+            raise RuntimeError(message % params)
+        if stream is not None:
+            stream.write("Aton | ok | %s\n" % (message % params))
+
+    scheduler = FakeScheduler()
+    job_ids = ["job%d" % i for i in range(num_jobs)]
+    for job_id in job_ids:
+        scheduler.submit(job_id)
+    failed_id = job_ids[-1]
+    scheduler.submit(failed_id, (JOB_QUEUED, JOB_FAILED))
+
+    updates = list()
+    monitor = FarmMonitor(scheduler.status, updates.append, min_interval=2.0,
+                          max_interval=60.0, batch_size=batch_size, warn_function=None)
+    monitor.watch(job_ids, start=False)
+
+    # Batching, every job is polled once per poll in batches of batch size
+    interval = monitor.step(2.0)
+    sizes = [len(call) for call in scheduler.calls]
+    expect(sizes == [batch_size] * (num_jobs // batch_size) +
+           ([num_jobs % batch_size] if num_jobs % batch_size else []),
+           "%d jobs polled in batches of %s", num_jobs, sizes)
+    expect(interval == 2.0 and len(updates[-1]) == num_jobs,
+           "all jobs reported as %s, interval reset to %g s", JOB_QUEUED, interval)
+
+    # Final status pruning, done and failed jobs are not polled again
+    monitor.step(interval)
+    expect(monitor.statuses[failed_id] == JOB_FAILED, "%s reported as %s", failed_id,
+           JOB_FAILED)
+    monitor.step(interval)
+    del scheduler.calls[:]
+    monitor.step(interval)
+    polled = sum(len(call) for call in scheduler.calls)
+    expect(polled == 0 and all(status in JOB_FINAL_STATUSES
+                               for status in monitor.statuses.values()),
+           "final jobs pruned from polling, %d polled", polled)
+
+    # Backoff, nothing changing grows the interval by half up to the maximum
+    scheduler.submit("late", (JOB_QUEUED, JOB_QUEUED, JOB_QUEUED, JOB_RUNNING))
+    monitor.watch(["late"], start=False)
+    interval = monitor.step(2.0)
+    expect(interval == 2.0, "new status resets the interval to %g s", interval)
+    intervals = [monitor.step(2.0)]
+    intervals.append(monitor.step(intervals[-1]))
+    expect(intervals == [3.0, 4.5], "unchanged statuses back off to %s s", intervals)
+    expect(monitor.step(45.0) == 2.0, "changed status resets the interval")
+
+    # Failing status calls double the interval up to the maximum
+    scheduler.failures = 3
+    intervals = [monitor.step(16.0)]
+    intervals.append(monitor.step(intervals[-1]))
+    intervals.append(monitor.step(intervals[-1]))
+    expect(intervals == [32.0, 60.0, 60.0], "failing status calls back off to %s s", intervals)
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    @param argv: list
+    @return: int
+    """
+    parser = argparse.ArgumentParser(description="Check the farm monitor against a fake "
+                                                 "scheduler.")
+    parser.add_argument("--jobs", type=int, default=1200, help="number of fake jobs")
+    parser.add_argument("--batch-size", type=int, default=500, help="job ids per status call")
+    args = parser.parse_args(argv)
+
+    try:
+        check_monitor(args.jobs, args.batch_size)
+    except RuntimeError as e:
+        sys.stderr.write("Aton | failed | %s\n" % e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
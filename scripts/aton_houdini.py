@@ -1,9 +1,14 @@
 """
 * How to install
 
-Copy aton_houdini.py to HtoA's scripts folder.
+Copy aton_houdini.py and aton_farm.py to HtoA's scripts folder.
 $HTOA_PATH/scripts/python/htoa/aton_houdini.py
 
+Optionally copy aton_ports.py next to it to assign ports through the
+local port registry Nuke's Aton nodes register in, aton_roi.py to
+follow the region of the Aton node live while Region is checked, and
+aton_protocol.py to read the driver stream with its wire formats.
+
 It's necessary to inject an extra code into HtoA to be able to add a custom driver.
 Therefore insert the following python patch after the line 5 of
 
@@ -23,10 +28,13 @@ aton_houdini.Aton().show()
 
 import os
 import re
+import gzip
 import time
 import psutil
 import socket
+import struct
 import fnmatch
+import threading
 
 import hou
 
@@ -36,6 +44,35 @@ from htoa.node.node import nodeSetArrayString
 
 from arnold import *
 
+from aton_farm import FarmMonitor, JOB_STATUSES
+
+try:
+    from aton_ports import PortRegistry, ROLE_CLIENT
+except ImportError:
+    PortRegistry = None
+
+try:
+    from aton_roi import RoiSubscriber
+except ImportError:
+    RoiSubscriber = None
+
+try:
+    from aton_protocol import (KEY_HEADER, KEY_PIXELS, KEY_CLOSE, PROTOCOL_V1, PROTOCOL_V2,
+                               HELLO_MAGIC, KEY_STRUCT, HEADER_STRUCT, PIXELS_STRUCT,
+                               HELLO_STRUCT, FRAME_STRUCT, HEADER_V2_STRUCT, PIXELS_V2_STRUCT)
+except ImportError:
+    # Wire formats of aton_protocol, for when it isn't installed next to this file
+    KEY_HEADER, KEY_PIXELS, KEY_CLOSE = 0, 1, 2
+    PROTOCOL_V1, PROTOCOL_V2 = 1, 2
+    HELLO_MAGIC = b"ATN2"
+    KEY_STRUCT = struct.Struct("=i")
+    HEADER_STRUCT = struct.Struct("=qiifqiff16f6iQ")
+    PIXELS_STRUCT = struct.Struct("=qiiiiiiiqIQ")
+    HELLO_STRUCT = struct.Struct("<4sII")
+    FRAME_STRUCT = struct.Struct("<II")
+    HEADER_V2_STRUCT = struct.Struct("<qiifqiff16f6iI")
+    PIXELS_V2_STRUCT = struct.Struct("<qiiIiiiiiqII")
+
 
 
 __author__ = "Vahan Sosoyan"
@@ -43,6 +80,19 @@ __copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
 __version__ = "1.3.7"
 
 
+# Ledger proxies by Aton port, see get_ledger_proxy
+_ledger_proxies = dict()
+
+# Options parameters the farm overrides may change
+ASS_OPTIONS_OVERRIDES = ("outputs", "camera", "bucket_scanning", "xres", "yres", "AA_samples",
+                         "enable_adaptive_sampling", "region_min_x", "region_min_y",
+                         "region_max_x", "region_max_y", "ignore_motion_blur",
+                         "ignore_subdivision", "ignore_displacement", "ignore_bump", "ignore_sss")
+
+# Resolution ramp steps in percent, rendered before the selected resolution
+RESOLUTION_RAMP = (10.0, 25.0)
+
+
 def warn(msg, *params):
     """ 
     Warn message in Arnold Rendering process
@@ -251,9 +301,18 @@ def get_host():
 
 def get_port():
     """
-    Returns a port number from Aton driver
+    Returns a port number from the port registry or Aton driver
     @return: int
     """
+    if PortRegistry is not None:
+        try:
+            servers = PortRegistry().servers()
+        except (RuntimeError, EnvironmentError):
+            servers = None
+
+        if servers:
+            return servers[0]
+
     aton_port = os.getenv("ATON_PORT")
 
     if aton_port is None:
@@ -262,6 +321,19 @@ def get_port():
         return int(aton_port)
 
 
+def get_roi_rate():
+    """
+    Returns how many times per second the live render region from Nuke is applied
+    @return: float
+    """
+    aton_roi_rate = os.getenv("ATON_ROI_RATE")
+
+    if aton_roi_rate is None:
+        return 4.0
+    else:
+        return max(float(aton_roi_rate), 0.1)
+
+
 def get_rop_list():
     """
     Returns a list of all output driver names
@@ -288,6 +360,35 @@ def get_bucket_modes():
     return result
 
 
+def get_ledger_proxy(port):
+    """
+    Returns the proxy forwarding to the Aton node on the given port,
+    shared by all sessions and kept while Houdini runs
+    @param port: int
+    @return: LedgerProxy
+    """
+    proxy = _ledger_proxies.get(port)
+    if proxy is None:
+        proxy = _ledger_proxies[port] = LedgerProxy("127.0.0.1", port)
+    return proxy
+
+
+def get_ass_files(ass_file_path):
+    """
+    Returns ASS files to load in order for the given submitted ASS file,
+    delta ASS files of a sequence need their static ASS file loaded first
+    @param ass_file_path: str
+    @return: list: str
+    """
+    with open_ass(ass_file_path, "r") as f:
+        for line in f:
+            if line.startswith("### aton static: "):
+                return [line[len("### aton static: "):].strip(), ass_file_path]
+            elif not line.startswith("#"):
+                break
+    return [ass_file_path]
+
+
 def get_all_cameras(path=False):
     """
     Returns a list of all camera names
@@ -310,13 +411,23 @@ class HickStatus(QtCore.QThread):
     """
     finished = QtCore.Signal(bool)
 
-    def __init__(self, ipr):
+    def __init__(self, ipr, transitions=False):
         """ Gets IPRViewer
         @param ipr: hou.IPRViewer
+        @param transitions: bool: emit only once hick has been busy and then idle again
         """
         super(HickStatus, self).__init__()
 
         self._ipr = ipr
+        self._transitions = transitions
+        self._busy = False
+
+    def reset(self):
+        """
+        Waits for hick to be busy again before the next transition
+        @return:
+        """
+        self._busy = False
 
     def run(self):
         """
@@ -324,14 +435,18 @@ class HickStatus(QtCore.QThread):
         @return:
         """
         while self._ipr.isActive():
-            if self.is_finished():
+            finished = self.is_finished()
+            if finished is False:
+                self._busy = True
+            elif finished and (self._busy or not self._transitions):
+                self._busy = False
                 self.finished.emit(True)
 
     @staticmethod
     def is_finished():
         """
         Checks whether the hick process has finished
-        @return: bool
+        @return: bool, None if there is no hick process
         """
         for p in psutil.Process(os.getpid()).children(recursive=True):
             if p.name().startswith("hick"):
@@ -341,6 +456,517 @@ class HickStatus(QtCore.QThread):
                     return
 
 
+class LedgerTile(object):
+    """
+    Tile region submitted to the farm and the buckets received for it
+    """
+    def __init__(self, region, rect, job_ids, submission):
+        """
+        @param region: list: int region passed to farm_start
+        @param rect: tuple: x_min, y_min, x_max, y_max, max exclusive
+        @param job_ids: list
+        @param submission: tuple: farm_start arguments
+        """
+        self.region = region
+        self.rect = rect
+        self.job_ids = job_ids
+        self.submission = submission
+        self.submitted = time.time()
+        self.updated = None
+        self.attempts = 1
+        self.received = 0
+
+        self.__buckets = set()
+
+    @property
+    def area(self):
+        """
+        Returns area of the tile in pixels
+        @return: int
+        """
+        return (self.rect[2] - self.rect[0]) * (self.rect[3] - self.rect[1])
+
+    @property
+    def complete(self):
+        """
+        Returns True if buckets have covered the whole tile
+        @return: bool
+        """
+        return self.received >= self.area
+
+    def add_bucket(self, x, y, width, height):
+        """
+        Adds the part of a bucket inside the tile, progressive passes
+        of the same bucket are only counted once
+        @param x: int
+        @param y: int
+        @param width: int
+        @param height: int
+        @return: bool: True if the bucket is inside the tile
+        """
+        x_min, y_min = max(x, self.rect[0]), max(y, self.rect[1])
+        x_max, y_max = min(x + width, self.rect[2]), min(y + height, self.rect[3])
+
+        if x_min >= x_max or y_min >= y_max:
+            return False
+
+        self.updated = time.time()
+        bucket = (x_min, y_min, x_max, y_max)
+        if bucket not in self.__buckets:
+            self.__buckets.add(bucket)
+            self.received += (x_max - x_min) * (y_max - y_min)
+        return True
+
+    def resubmitted(self, job_ids):
+        """
+        Restarts the tile after being submitted again
+        @param job_ids: list
+        @return:
+        """
+        self.job_ids = job_ids
+        self.submitted = time.time()
+        self.updated = None
+        self.attempts += 1
+        self.received = 0
+        self.__buckets.clear()
+
+
+class TileLedger(object):
+    """
+    Completion ledger of a distributed session, maps the tile regions
+    passed to farm_start to the buckets received from the driver stream
+    """
+    def __init__(self, session_id, frame=None):
+        """
+        @param session_id: int
+        @param frame: float
+        """
+        self.session_id = session_id
+        self.frame = frame
+        self.tiles = list()
+
+        self.__lock = threading.Lock()
+
+    @property
+    def complete(self):
+        """
+        Returns True if all tiles have been received
+        @return: bool
+        """
+        with self.__lock:
+            return all(tile.complete for tile in self.tiles)
+
+    @property
+    def progress(self):
+        """
+        Returns number of complete tiles
+        @return: int
+        """
+        with self.__lock:
+            return len([tile for tile in self.tiles if tile.complete])
+
+    def add_tile(self, region, job_ids, submission):
+        """
+        Adds a tile submitted with the given region
+        @param region: list: int x_min, y_min, x_max, y_max, max inclusive
+        @param job_ids: list
+        @param submission: tuple: farm_start arguments
+        @return: LedgerTile
+        """
+        rect = (region[0], region[1], region[2] + 1, region[3] + 1)
+        tile = LedgerTile(list(region), rect, job_ids, submission)
+        with self.__lock:
+            self.tiles.append(tile)
+        return tile
+
+    def add_bucket(self, x, y, width, height):
+        """
+        Adds a bucket received from the driver stream
+        @param x: int
+        @param y: int
+        @param width: int
+        @param height: int
+        @return:
+        """
+        with self.__lock:
+            for tile in self.tiles:
+                tile.add_bucket(x, y, width, height)
+
+    def missing(self, timeout):
+        """
+        Returns incomplete tiles which haven't started or stalled for timeout seconds
+        @param timeout: float
+        @return: list: LedgerTile
+        """
+        now = time.time()
+        with self.__lock:
+            return [tile for tile in self.tiles if not tile.complete and
+                    now - (tile.updated or tile.submitted) > timeout]
+
+    def resubmitted(self, tile, job_ids):
+        """
+        Restarts the tile after being submitted again
+        @param tile: LedgerTile
+        @param job_ids: list
+        @return:
+        """
+        with self.__lock:
+            tile.resubmitted(job_ids)
+
+
+class DriverStreamTap(object):
+    """
+    Passive parser of a driver_aton stream reporting the buckets of both
+    protocol versions, pixels are skipped without being decoded
+    """
+    def __init__(self, header_callback, bucket_callback):
+        """
+        @param header_callback: function: session, frame
+        @param bucket_callback: function: session, x, y, width, height
+        """
+        self.__header_callback = header_callback
+        self.__bucket_callback = bucket_callback
+        self.__buffer = bytearray()
+        self.__skip = 0
+        self.__parser = self.__parse()
+        self.__request = next(self.__parser)
+
+    def feed(self, data):
+        """
+        Parses the next bytes of the stream
+        @param data: bytes-like
+        @return:
+        """
+        pos, size = 0, len(data)
+        while pos < size:
+            if self.__skip:
+                count = min(self.__skip, size - pos)
+                self.__skip -= count
+                pos += count
+                if not self.__skip:
+                    self.__advance(None)
+                continue
+
+            count = min(self.__request - len(self.__buffer), size - pos)
+            self.__buffer += data[pos:pos + count]
+            pos += count
+            if len(self.__buffer) == self.__request:
+                chunk = bytes(self.__buffer)
+                del self.__buffer[:]
+                self.__advance(chunk)
+
+    def __advance(self, value):
+        """
+        Passes the requested bytes to the parser, negative requests skip bytes
+        @param value: bytes
+        @return:
+        """
+        request = self.__parser.send(value)
+        while not request:
+            request = self.__parser.send(b"")
+
+        if request < 0:
+            self.__skip = -request
+        else:
+            self.__request = request
+
+    def __parse(self):
+        """
+        Generator yielding the number of bytes it needs next
+        @return:
+        """
+        version, messages = PROTOCOL_V1, 0
+        while True:
+            if version >= PROTOCOL_V2:
+                size, key = FRAME_STRUCT.unpack((yield FRAME_STRUCT.size))
+            else:
+                key, size = KEY_STRUCT.unpack((yield KEY_STRUCT.size))[0], None
+            messages += 1
+
+            if key == KEY_HEADER and version >= PROTOCOL_V2:
+                fields = HEADER_V2_STRUCT.unpack_from((yield size))
+                self.__header_callback(fields[0], fields[6])
+
+            elif key == KEY_HEADER:
+                fields = HEADER_STRUCT.unpack((yield HEADER_STRUCT.size))
+                yield -fields[-1]
+                self.__header_callback(fields[0], fields[6])
+
+            elif key == KEY_PIXELS and version >= PROTOCOL_V2:
+                fields = PIXELS_V2_STRUCT.unpack((yield PIXELS_V2_STRUCT.size))
+                yield -(size - PIXELS_V2_STRUCT.size)
+                self.__bucket_callback(fields[0], fields[4], fields[5], fields[6], fields[7])
+
+            elif key == KEY_PIXELS:
+                fields = PIXELS_STRUCT.unpack((yield PIXELS_STRUCT.size))
+                yield -(fields[-1] + fields[5] * fields[6] * fields[7] * 4)
+                self.__bucket_callback(fields[0], fields[3], fields[4], fields[5], fields[6])
+
+            elif key == KEY_CLOSE and messages == 1 and version == PROTOCOL_V1:
+                # Protocol v2 hello, Aton nodes answer with the client version
+                magic, client_version, _ = HELLO_STRUCT.unpack((yield HELLO_STRUCT.size))
+                if magic == HELLO_MAGIC:
+                    version = min(client_version, PROTOCOL_V2)
+
+            elif size is not None:
+                yield -size
+
+            else:
+                # Close or quit, nothing follows
+                yield -(1 << 62)
+
+
+class LedgerProxy(object):
+    """
+    Forwards driver connections to the Aton node and passes their
+    buckets to the tile ledgers of their sessions
+    """
+    def __init__(self, target_host, target_port):
+        """
+        @param target_host: str
+        @param target_port: int
+        """
+        self.target = (target_host, target_port)
+        self.ledgers = dict()
+
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__sock.bind(("", 0))
+        self.__sock.listen(128)
+        self.port = self.__sock.getsockname()[1]
+
+        thread = threading.Thread(target=self.__accept)
+        thread.daemon = True
+        thread.start()
+
+    def __accept(self):
+        """
+        Accepts driver connections
+        @return:
+        """
+        while True:
+            try:
+                connection = self.__sock.accept()[0]
+            except socket.error:
+                break
+
+            thread = threading.Thread(target=self.__serve, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def __serve(self, connection):
+        """
+        Connects to the target and forwards both directions
+        @param connection: socket.socket
+        @return:
+        """
+        try:
+            upstream = socket.create_connection(self.target)
+        except socket.error:
+            connection.close()
+            return
+
+        for sock in (connection, upstream):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        thread = threading.Thread(target=self.__forward, args=(upstream, connection))
+        thread.daemon = True
+        thread.start()
+        self.__forward(connection, upstream, DriverStreamTap(self.__header, self.__bucket))
+
+    def __forward(self, source, target, tap=None):
+        """
+        Copies everything from source to target, closing both at the end
+        @param source: socket.socket
+        @param target: socket.socket
+        @param tap: DriverStreamTap
+        @return:
+        """
+        data = bytearray(1 << 18)
+        view = memoryview(data)
+        try:
+            while True:
+                size = source.recv_into(data)
+                if not size:
+                    break
+                target.sendall(view[:size])
+                if tap is not None:
+                    tap.feed(view[:size])
+        except (socket.error, struct.error):
+            pass
+        finally:
+            source.close()
+            target.close()
+
+    def __header(self, session, frame):
+        ledger = self.ledgers.get(session)
+        if ledger is not None and ledger.frame is None:
+            ledger.frame = frame
+
+    def __bucket(self, session, x, y, width, height):
+        ledger = self.ledgers.get(session)
+        if ledger is not None:
+            ledger.add_bucket(x, y, width, height)
+
+
+class AssNode(object):
+    """
+    Node block of a text ASS file, kept as written and compared as text
+    """
+    PARAM_RE = re.compile(r"^ ([A-Za-z_]\w*)(\s|$)")
+
+    def __init__(self, lines):
+        """
+        @param lines: list: str lines from the node type to the closing brace
+        """
+        self.lines = lines
+        self.type = lines[0].strip()
+        self.name = (self.param("name") or str()).strip('"')
+
+    @property
+    def text(self):
+        """
+        Returns the node block
+        @return: str
+        """
+        return "".join(self.lines)
+
+    @property
+    def references(self):
+        """
+        Returns all words which may name another node
+        @return: set
+        """
+        words = set()
+        for line in self.lines[2:-1]:
+            for word in re.split(r"[\s\"]+", line):
+                words.add(word)
+                words.add(word.rsplit(".", 1)[0])
+        return words
+
+    def params(self):
+        """
+        Returns the lines of every parameter, arrays continue on the following lines
+        @return: list: tuple: str name, list lines
+        """
+        params = list()
+        for line in self.lines[2:-1]:
+            match = self.PARAM_RE.match(line)
+            if match or not params:
+                params.append((match.group(1) if match else str(), [line]))
+            else:
+                params[-1][1].append(line)
+        return params
+
+    def param(self, name):
+        """
+        Returns the value of a single line parameter
+        @param name: str
+        @return: str
+        """
+        for param, lines in self.params():
+            if param == name:
+                return lines[0].strip()[len(name):].strip()
+
+    def set_params(self, params):
+        """
+        Replaces or adds parameters
+        @param params: list: tuple: str name, list lines
+        @return:
+        """
+        params = list(params)
+        names = dict(params)
+        result = list()
+        for name, lines in self.params():
+            if name in names:
+                result += names.pop(name)
+            else:
+                result += lines
+        result += [line for name, lines in params if name in names for line in lines]
+
+        self.lines = self.lines[:2] + result + self.lines[-1:]
+
+
+def read_ass(path):
+    """
+    Reads the comment header and nodes of a text ASS file
+    @param path: str
+    @return: tuple: list str header lines, list AssNode
+    """
+    header, nodes, block = list(), list(), list()
+    with open_ass(path, "r") as f:
+        for line in f:
+            if block:
+                block.append(line)
+                if line.rstrip() == "}":
+                    nodes.append(AssNode(block))
+                    block = list()
+            elif line.startswith("#") and not nodes:
+                header.append(line)
+            elif line.strip():
+                block.append(line)
+    return header, nodes
+
+
+def write_ass(path, header, nodes):
+    """
+    Writes a text ASS file
+    @param path: str
+    @param header: list: str comment lines
+    @param nodes: list: AssNode
+    @return:
+    """
+    with open_ass(path, "w") as f:
+        f.writelines(header)
+        for node in nodes:
+            f.write("\n")
+            f.write(node.text)
+
+
+def open_ass(path, mode):
+    """
+    Opens a text ASS file, compressed if it ends with .gz
+    @param path: str
+    @param mode: str: r or w
+    @return: file
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + ("b" if str is bytes else "t"))
+    return open(path, mode)
+
+
+def split_ass_sequence(static_path, scenes):
+    """
+    Writes the nodes all frames have in common into one static ASS file and
+    overwrites every frame with the nodes which differ, headed by a reference
+    to the static file, see get_ass_files. Static nodes never refer to frame nodes,
+    so the static file can be loaded before any frame
+    @param static_path: str
+    @param scenes: list: tuple: str frame ass file path, list str header, list AssNode
+    @return:
+    """
+    texts = [dict((node.name, node.text) for node in nodes) for _, _, nodes in scenes]
+    header, nodes = scenes[0][1], scenes[0][2]
+
+    static = [node for node in nodes if node.name and node.type != "options" and
+              all(i.get(node.name) == node.text for i in texts[1:])]
+
+    # Nodes referring to a frame node are loaded with the frames
+    names = set(node.name for _, _, nodes in scenes for node in nodes if node.name)
+    changed = True
+    while changed:
+        frame_names = names.difference(node.name for node in static)
+        keep = [node for node in static if not node.references & frame_names]
+        changed = len(keep) != len(static)
+        static = keep
+
+    write_ass(static_path, header, static)
+
+    static_names = set(node.name for node in static)
+    for path, header, nodes in scenes:
+        write_ass(path, header + ["### aton static: %s\n" % static_path],
+                  [node for node in nodes if node.name not in static_names])
+
+
 class BoxWidget(QtWidgets.QFrame):
     """
     Abstract Class for UI Widgets
@@ -764,8 +1390,11 @@ class OutputUI(object):
         self.camera = 0
         self.bucket_scan = 0
         self.resolution = 0
+        self.resolution_ramp = False
         self.camera_aa_enabled = 0
         self.aa_samples = aa
+        self.aa_ramp = False
+        self.aa_ramp_start = -3
         self.region_enabled = False
         self.region_x = 0
         self.region_y = 0
@@ -797,8 +1426,11 @@ class OutputUI(object):
         self.camera = 0
         self.bucket_scan = 0
         self.resolution = 0
+        self.resolution_ramp = False
         self.camera_aa_enabled = 0
         self.aa_samples = self.__aa_samples
+        self.aa_ramp = False
+        self.aa_ramp_start = -3
         self.region_enabled = False
         self.region_x = 0
         self.region_y = 0
@@ -1497,6 +2129,9 @@ class Aton(QtWidgets.QWidget):
     """
     Main UI Object
     """
+    # Job statuses from the farm monitor thread
+    farm_status_changed = QtCore.Signal(dict)
+
     def __init__(self, icon_path=None):
         QtWidgets.QWidget.__init__(self)
 
@@ -1508,6 +2143,11 @@ class Aton(QtWidgets.QWidget):
         self.__output = None
         self.__ui_update = True
         self.__hick_status = None
+        self.__ramp_status = None
+        self.__farm_monitor = None
+        self.__job_statuses = dict()
+        self.__session_id = 0
+        self.__ramp = list()
         self.__output_list = list()
         self.__default_port = get_port()
         self.__default_host = get_host()
@@ -1517,6 +2157,19 @@ class Aton(QtWidgets.QWidget):
         self.__reconnect_farm = 1
         self.__reconnect_distribute = 1
 
+        # Distributed sessions tile ledgers
+        self.__ledgers = dict()
+        self.__ledger_attempts = 3
+        self.__ledger_timer = QtCore.QTimer(self)
+        self.__ledger_timer.setInterval(10000)
+        self.__ledger_timer.timeout.connect(self.__check_ledgers)
+
+        # Live render region from Nuke, applied at ATON_ROI_RATE
+        self.__roi_subscriber = None
+        self.__roi_timer = QtCore.QTimer(self)
+        self.__roi_timer.setInterval(int(1000 / get_roi_rate()))
+        self.__roi_timer.timeout.connect(self.__apply_live_region)
+
         # Init UI
         self.setObjectName(self.__obj_name)
         self.setProperty("saveWindowPref", True)
@@ -1541,8 +2194,11 @@ class Aton(QtWidgets.QWidget):
         self.__progrssive_check_box = CheckBox("", "Progressive", False)
         self.__bucket_combo_box = ComboBox("Bucket Scan")
         self.__resolution_combo_box = ComboBox("Resolution")
+        self.__resolution_ramp_check_box = CheckBox("", "Ramp", False)
         self.__camera_aa_combo_box = ComboBox("Camera (AA)")
         self.__camera_aa_slider = SliderBox("", 3, False)
+        self.__camera_aa_ramp_check_box = CheckBox("", "Ramp", False)
+        self.__camera_aa_ramp_spin_box = SpinBox("From:", -3, False)
         self.__render_region_check_box = CheckBox("Region")
         self.__render_region_x_spin_box = SpinBox("X:", 0, False)
         self.__render_region_y_spin_box = SpinBox("Y:", 0, False)
@@ -1555,6 +2211,8 @@ class Aton(QtWidgets.QWidget):
         self.__seq_end_spin_box = SpinBox("End:", int(self.end_frame), False)
         self.__seq_step_spin_box = SpinBox("Step:", 1, False)
         self.__seq_rebuild_checkbox = CheckBox("", "Rebuild", False)
+        self.__seq_order_combo_box = ComboBox("Order:", False)
+        self.__seq_delta_checkbox = CheckBox("", "Delta ASS", False)
         self.__motion_blur_check_box = CheckBox("", "Motion Blur", False)
         self.__subdivs_check_box = CheckBox("", "Subdivs", False)
         self.__displace_check_box = CheckBox("", "Displace", False)
@@ -1584,6 +2242,20 @@ class Aton(QtWidgets.QWidget):
             if self.ipr.isActive():
                 self.ipr.killRender()
 
+        self.__ledger_timer.stop()
+        self.__roi_timer.stop()
+        if self.__roi_subscriber is not None:
+            self.__roi_subscriber.close()
+
+        if self.__farm_monitor is not None:
+            self.__farm_monitor.stop()
+
+        if PortRegistry is not None:
+            try:
+                PortRegistry().release(ROLE_CLIENT)
+            except (RuntimeError, EnvironmentError):
+                pass
+
         self.__remove_aton_overrides()
         self.__remove_callbacks()
 
@@ -1651,11 +2323,14 @@ class Aton(QtWidgets.QWidget):
         # Resolution Layout
         resolution_layout = QtWidgets.QHBoxLayout()
         resolution_layout.addWidget(self.__resolution_combo_box)
+        resolution_layout.addWidget(self.__resolution_ramp_check_box)
 
         # Camera AA Layout
         camera_aa_layout = QtWidgets.QHBoxLayout()
         camera_aa_layout.addWidget(self.__camera_aa_combo_box)
         camera_aa_layout.addWidget(self.__camera_aa_slider)
+        camera_aa_layout.addWidget(self.__camera_aa_ramp_check_box)
+        camera_aa_layout.addWidget(self.__camera_aa_ramp_spin_box)
 
         # Render region layout
         render_region_layout = QtWidgets.QHBoxLayout()
@@ -1685,6 +2360,8 @@ class Aton(QtWidgets.QWidget):
         sequence_layout.addWidget(self.__seq_end_spin_box)
         sequence_layout.addWidget(self.__seq_step_spin_box)
         sequence_layout.addWidget(self.__seq_rebuild_checkbox)
+        sequence_layout.addWidget(self.__seq_order_combo_box)
+        sequence_layout.addWidget(self.__seq_delta_checkbox)
 
         # Main Buttons Layout
         main_buttons_layout = QtWidgets.QHBoxLayout()
@@ -1764,6 +2441,7 @@ class Aton(QtWidgets.QWidget):
         self.__camera_aa_slider.set_maximum(64, 16)
         self.__camera_aa_slider.set_value(self.output.aa_samples, self.output.aa_samples)
         self.__camera_aa_slider.set_enabled(False)
+        self.__camera_aa_ramp_spin_box.set_enabled(False)
 
         # Render region layout
         self.__render_region_x_spin_box.set_enabled(False)
@@ -1777,6 +2455,9 @@ class Aton(QtWidgets.QWidget):
 
         # Sequence layout
         self.__seq_rebuild_checkbox.set_enabled(False)
+        self.__seq_order_combo_box.set_enabled(False)
+        self.__seq_delta_checkbox.set_enabled(False)
+        self.__seq_order_combo_box.add_items(["Frames First", "Tiles First"])
         self.__seq_start_spin_box.set_enabled(False)
         self.__seq_end_spin_box.set_enabled(False)
         self.__seq_step_spin_box.set_enabled(False)
@@ -1807,10 +2488,14 @@ class Aton(QtWidgets.QWidget):
         self.__bucket_combo_box.current_index_changed.connect(self.__add_aton_overrides)
         self.__resolution_combo_box.current_index_changed.connect(self.__resolution_update_ui)
         self.__resolution_combo_box.current_index_changed.connect(self.__add_aton_overrides)
+        self.__resolution_ramp_check_box.toggled.connect(self.__resolution_ramp_update_ui)
         self.__camera_aa_combo_box.current_index_changed.connect(self.__camera_aa_update_ui)
         self.__camera_aa_combo_box.current_index_changed.connect(self.__add_aton_overrides)
         self.__camera_aa_slider.value_changed.connect(self.__camera_samples_update_ui)
         self.__camera_aa_slider.value_changed.connect(self.__add_aton_overrides)
+        self.__camera_aa_ramp_check_box.toggled.connect(self.__camera_aa_ramp_update_ui)
+        self.__camera_aa_ramp_check_box.toggled.connect(self.__camera_aa_ramp_spin_box.set_enabled)
+        self.__camera_aa_ramp_spin_box.value_changed.connect(self.__camera_aa_ramp_update_ui)
         self.__render_region_check_box.toggled.connect(self.__region_update_ui)
         self.__render_region_x_spin_box.value_changed.connect(self.__region_x_update_ui)
         self.__render_region_y_spin_box.value_changed.connect(self.__region_y_update_ui)
@@ -1829,10 +2514,12 @@ class Aton(QtWidgets.QWidget):
         self.__render_region_t_spin_box.value_changed.connect(self.__add_aton_overrides)
         self.__render_region_reset_button.clicked.connect(self.__reset_region_ui)
         self.__render_region_get_button.clicked.connect(self.__get_render_region)
+        self.__render_region_check_box.toggled.connect(self.__follow_live_region)
+        self.__port_slider.value_changed.connect(self.__follow_live_region)
         self.__sequence_checkbox.toggled.connect(self.__seq_start_spin_box.set_enabled)
         self.__sequence_checkbox.toggled.connect(self.__seq_end_spin_box.set_enabled)
         self.__sequence_checkbox.toggled.connect(self.__seq_step_spin_box.set_enabled)
-        self.__sequence_checkbox.toggled.connect(self.__seq_rebuild_checkbox.set_enabled)
+        self.__sequence_checkbox.toggled.connect(self.__sequence_update_ui)
         self.__motion_blur_check_box.toggled.connect(self.__add_aton_overrides)
         self.__subdivs_check_box.toggled.connect(self.__add_aton_overrides)
         self.__displace_check_box.toggled.connect(self.__add_aton_overrides)
@@ -1896,7 +2583,10 @@ class Aton(QtWidgets.QWidget):
         self.__bucket_combo_box.new_items(["Use ROPs"] + get_bucket_modes())
         self.__bucket_combo_box.set_default_name(self.output.bucket_scanning)
         self.__resolution_combo_box.set_current_index(0)
+        self.__resolution_ramp_check_box.set_checked(False)
         self.__camera_aa_combo_box.set_current_index(0)
+        self.__camera_aa_ramp_check_box.set_checked(False)
+        self.__camera_aa_ramp_spin_box.set_value(-3)
         self.__render_region_x_spin_box.set_value(0)
         self.__render_region_y_spin_box.set_value(0)
         self.__render_region_check_box.set_checked(False)
@@ -1905,6 +2595,8 @@ class Aton(QtWidgets.QWidget):
         self.__seq_start_spin_box.set_value(hou.playbar.frameRange()[0])
         self.__seq_end_spin_box.set_value(hou.playbar.frameRange()[1])
         self.__seq_step_spin_box.set_value(1)
+        self.__seq_order_combo_box.set_current_index(0)
+        self.__seq_delta_checkbox.set_checked(False)
         self.__motion_blur_check_box.set_checked(False)
         self.__subdivs_check_box.set_checked(False)
         self.__displace_check_box.set_checked(False)
@@ -1934,18 +2626,31 @@ class Aton(QtWidgets.QWidget):
         self.__distribute_combo_box.set_enabled(value)
         self.__ipr_update_check_box.set_enabled(not value)
         self.__progrssive_check_box.set_enabled(not value)
+        self.__resolution_ramp_check_box.set_enabled(not value)
+        self.__camera_aa_ramp_check_box.set_enabled(not value)
+        self.__camera_aa_ramp_spin_box.set_enabled(not value and
+                                                   self.__camera_aa_ramp_check_box.is_checked())
 
-        sequence_checked = self.__sequence_checkbox.is_checked()
-        self.__sequence_checkbox.set_enabled(not value)
-        self.__seq_start_spin_box.set_enabled(not value and sequence_checked)
-        self.__seq_end_spin_box.set_enabled(not value and sequence_checked)
-        self.__seq_step_spin_box.set_enabled(not value and sequence_checked)
-        self.__seq_rebuild_checkbox.set_enabled(not value and sequence_checked)
+        self.__sequence_update_ui(self.__sequence_checkbox.is_checked())
 
         selected = self.__output_list_box.selected_items()
         if selected:
             self.__output_list_box.set_current_item(selected[-1])
 
+    def __sequence_update_ui(self, value):
+        """
+        Updates UI of the Sequence mode, Rebuild for Local, Order and Delta ASS for Farm mode
+        @param value: bool
+        @return:
+        """
+        farm = bool(self.__mode_combo_box.current_index())
+        self.__seq_start_spin_box.set_enabled(value)
+        self.__seq_end_spin_box.set_enabled(value)
+        self.__seq_step_spin_box.set_enabled(value)
+        self.__seq_rebuild_checkbox.set_enabled(value and not farm)
+        self.__seq_order_combo_box.set_enabled(value and farm)
+        self.__seq_delta_checkbox.set_enabled(value and farm)
+
     def __cpu_update_ui(self):
         """
         Stores UI value for selected outputs
@@ -1993,17 +2698,24 @@ class Aton(QtWidgets.QWidget):
 
     def __port_increment(self):
         """
-        Increments ports based on the
-        selected OutputItems and stores the values
+        Increments ports based on the selected OutputItems and stores the values,
+        reserving listening Aton nodes or free ports in the port registry if available
         @return:
         """
         if self.__ui_update:
 
-            value = self.__default_port
+            outputs = self.selected_outputs
+            ports = xrange(self.__default_port, self.__default_port + len(outputs))
 
-            for output in self.selected_outputs:
-                output.ui.port = value
-                value += 1
+            if PortRegistry is not None:
+                try:
+                    ports = PortRegistry().assign([i.rop_path for i in outputs],
+                                                  self.__default_port)
+                except (RuntimeError, EnvironmentError):
+                    pass
+
+            for output, port in zip(outputs, ports):
+                output.ui.port = port
 
             self.__ui_update = False
             self.__port_slider.set_value(self.output.ui.port,
@@ -2039,8 +2751,11 @@ class Aton(QtWidgets.QWidget):
             self.__camera_combo_box.set_current_index(output.ui.camera)
             self.__bucket_combo_box.set_current_index(output.ui.bucket_scan)
             self.__resolution_combo_box.set_current_index(output.ui.resolution)
+            self.__resolution_ramp_check_box.set_checked(output.ui.resolution_ramp)
             self.__camera_aa_combo_box.set_current_index(output.ui.camera_aa_enabled)
             self.__camera_aa_slider.set_value(output.ui.aa_samples, output.ui.aa_samples)
+            self.__camera_aa_ramp_check_box.set_checked(output.ui.aa_ramp)
+            self.__camera_aa_ramp_spin_box.set_value(output.ui.aa_ramp_start)
             self.__render_region_check_box.set_checked(output.ui.region_enabled)
             self.__render_region_x_spin_box.set_value(output.ui.region_x)
             self.__render_region_y_spin_box.set_value(output.ui.region_y)
@@ -2119,6 +2834,15 @@ class Aton(QtWidgets.QWidget):
             for output in self.selected_outputs:
                 output.ui.resolution = self.__resolution_combo_box.current_index()
 
+    def __resolution_ramp_update_ui(self):
+        """
+        Stores UI value for selected outputs
+        @return:
+        """
+        if self.__ui_update:
+            for output in self.selected_outputs:
+                output.ui.resolution_ramp = self.__resolution_ramp_check_box.is_checked()
+
     def __resolution_list_update_ui(self):
         """
         Update Resolution UI
@@ -2156,6 +2880,16 @@ class Aton(QtWidgets.QWidget):
             for output in self.selected_outputs:
                 output.ui.aa_samples = self.__camera_aa_slider.value()
 
+    def __camera_aa_ramp_update_ui(self):
+        """
+        Stores UI value for selected outputs
+        @return:
+        """
+        if self.__ui_update:
+            for output in self.selected_outputs:
+                output.ui.aa_ramp = self.__camera_aa_ramp_check_box.is_checked()
+                output.ui.aa_ramp_start = self.__camera_aa_ramp_spin_box.value()
+
     def __region_update_ui(self):
         """
         Stores UI value for selected outputs
@@ -2277,25 +3011,83 @@ class Aton(QtWidgets.QWidget):
 
         if crop_data is not None:
             if len(crop_data) == 4:
-                reg_x = int(float(crop_data[0]) * float(self.output.origin_res_x))
-                reg_y = int(float(crop_data[1]) * float(self.output.origin_res_y))
-                reg_r = int(float(crop_data[2]) * float(self.output.origin_res_x))
-                reg_t = int(float(crop_data[3]) * float(self.output.origin_res_y))
+                self.__set_render_region(*[float(i) for i in crop_data])
 
-                self.__render_region_x_spin_box.set_value(reg_x)
-                self.__render_region_y_spin_box.set_value(reg_y)
-                self.__render_region_r_spin_box.set_value(reg_r)
-                self.__render_region_t_spin_box.set_value(reg_t)
+    def __set_render_region(self, ux, uy, ur, ut):
+        """
+        Sets the render region from the normalised Aton region
+        @param ux: float
+        @param uy: float
+        @param ur: float
+        @param ut: float
+        @return:
+        """
+        self.__render_region_x_spin_box.set_value(int(ux * float(self.output.origin_res_x)))
+        self.__render_region_y_spin_box.set_value(int(uy * float(self.output.origin_res_y)))
+        self.__render_region_r_spin_box.set_value(int(ur * float(self.output.origin_res_x)))
+        self.__render_region_t_spin_box.set_value(int(ut * float(self.output.origin_res_y)))
+
+    def __follow_live_region(self, *args):
+        """
+        Follows the region of the Aton node on the current port while Region is checked
+        @return:
+        """
+        if RoiSubscriber is None:
+            return
+
+        if self.__render_region_check_box.is_checked():
+            port = self.__port_slider.value()
+            if self.__roi_subscriber is None:
+                self.__roi_subscriber = RoiSubscriber(self.__default_host, port)
+            else:
+                self.__roi_subscriber.set_target(self.__default_host, port)
+            self.__roi_timer.start()
+
+        elif self.__roi_subscriber is not None:
+            self.__roi_timer.stop()
+            self.__roi_subscriber.close()
+            self.__roi_subscriber = None
+
+    def __apply_live_region(self):
+        """
+        Applies the latest region received from Nuke
+        @return:
+        """
+        region = self.__roi_subscriber.pop()
+        if region is not None and self.output is not None and \
+                self.__render_region_check_box.is_checked():
+            self.__set_render_region(*region)
 
     def __get_resolution(self, output=None):
         """
-        Get Resolution and Region overrides
+        Get Resolution and Region overrides, the current ramp step while ramping
         @param output: OutputItem
         @return: tuple
         """
         if output is None:
             output = self.output
 
+        res_scale = self.__get_resolution_scale(output)
+
+        if self.__ramp and output is self.output and self.__ramp[0][0] is not None:
+            res_scale = self.__ramp[0][0]
+
+        res_x = int(output.origin_res_x * res_scale / 100.0)
+        res_y = int(output.origin_res_y * res_scale / 100.0)
+        reg_x = int(output.ui.region_x * res_scale / 100.0)
+        reg_y = int(res_y - (output.ui.region_t * res_scale / 100.0))
+        reg_r = int((output.ui.region_r * res_scale / 100.0) - 1)
+        reg_t = int((res_y - (output.ui.region_y * res_scale / 100.0)) - 1)
+
+        return tuple((res_x, res_y, reg_x, reg_y, reg_r, reg_t))
+
+    @staticmethod
+    def __get_resolution_scale(output):
+        """
+        Get Resolution override in percent
+        @param output: OutputItem
+        @return: float
+        """
         index = output.ui.resolution
 
         if index == 2:
@@ -2311,14 +3103,29 @@ class Aton(QtWidgets.QWidget):
         else:
             res_scale = 100.0
 
-        res_x = int(output.origin_res_x * res_scale / 100.0)
-        res_y = int(output.origin_res_y * res_scale / 100.0)
-        reg_x = int(output.ui.region_x * res_scale / 100.0)
-        reg_y = int(res_y - (output.ui.region_t * res_scale / 100.0))
-        reg_r = int((output.ui.region_r * res_scale / 100.0) - 1)
-        reg_t = int((res_y - (output.ui.region_y * res_scale / 100.0)) - 1)
+        return res_scale
 
-        return tuple((res_x, res_y, reg_x, reg_y, reg_r, reg_t))
+    def __get_ramp(self, output):
+        """
+        Get steps of the Resolution and AA ramps rendered before the selected overrides,
+        lower resolutions at the lowest AA first and then the AA steps at full resolution
+        @param output: OutputItem
+        @return: list: tuples of resolution percent and AA samples, None keeps the selected one
+        """
+        aa_steps = list()
+        if output.ui.aa_ramp:
+            start = output.ui.aa_ramp_start
+            aa_samples = output.ui.aa_samples if output.ui.camera_aa_enabled else \
+                output.origin_aa_samples
+            aa_steps = [i for i in range(start, aa_samples) if i != 0 and (i <= 1 or i == start)]
+
+        ramp = list()
+        if output.ui.resolution_ramp:
+            res_scale = self.__get_resolution_scale(output)
+            ramp = [(i, aa_steps[0] if aa_steps else None)
+                    for i in RESOLUTION_RAMP if i < res_scale]
+
+        return ramp + [(None, i) for i in aa_steps]
 
     def __set_auto_update(self, value):
         """
@@ -2362,6 +3169,11 @@ class Aton(QtWidgets.QWidget):
                 else:
                     self.ipr.setPreview(self.output.ui.progressive)
 
+                # Resolution and AA ramps, cheaper passes first for a faster first image
+                self.__ramp = list()
+                if not self.__sequence_checkbox.is_checked():
+                    self.__ramp = self.__get_ramp(self.output)
+
                 self.ipr.startRender()
                 self.ipr.pauseRender()
                 
@@ -2373,6 +3185,9 @@ class Aton(QtWidgets.QWidget):
 
                     if self.__sequence_checkbox.is_checked():
                         self.hick_status.start()
+                    elif self.__ramp:
+                        self.ramp_status.reset()
+                        self.ramp_status.start()
                 else:
                     self.__stop_render()
             else:
@@ -2389,6 +3204,7 @@ class Aton(QtWidgets.QWidget):
             self.ipr.killRender()
 
             self.__remove_aton_overrides()
+            self.__ramp = list()
             self.__general_ui_set_enabled(True)
             self.__terminate_hick()
 
@@ -2396,6 +3212,9 @@ class Aton(QtWidgets.QWidget):
         else:
             for output in self.selected_outputs:
                 self.farm_stop(output.job_ids)
+                self.__forget_jobs(output.job_ids)
+                self.__remove_ledgers(output)
+                output.set_status()
 
     def __change_time(self):
         """
@@ -2424,64 +3243,178 @@ class Aton(QtWidgets.QWidget):
             self.__stop_render()
             self.__start_render(self.__change_time)
 
+    def __next_ramp_step(self):
+        """
+        Renders the next step of the Resolution and AA ramps once the current one has finished
+        @return:
+        """
+        # Ramp status only emits once hick has rendered and gone idle since the last step
+        if self.__ramp:
+            self.__ramp.pop(0)
+            self.ramp_status.reset()
+            self.__add_aton_overrides()
+
     def __export_ass(self):
         """
-        Exports an ass file, calls overrides and submits to the farm job
+        Exports ass files of the frames to render, calls overrides and submits to the farm job
         @return:
         """
+        frames = self.__farm_frames()
+        current_frame = self.current_frame
+        delta = len(frames) > 1 and self.__seq_delta_checkbox.is_checked()
+
         for output in self.__output_list_box.selected_items():
 
             if output.rop is not None:
-                session_id = int(time.time())
-                ass_path = self.export_ass_path(output.rop_path, session_id)
-                ass_name = self.export_ass_name(output.rop_path, session_id)
+                scenes = list()
+                for frame in frames:
+                    hou.setFrame(frame)
+                    session_id = self.__new_session_id()
+                    ass_file_path = self.__export_frame_ass(output, session_id, len(frames) > 1)
+
+                    if ass_file_path is None or not delta and \
+                            not self.__add_ass_overrides(output, ass_file_path, session_id):
+                        break
+
+                    scenes.append((self.current_frame, session_id, ass_file_path))
+
+                if len(scenes) == len(frames):
+                    if not delta or self.__add_delta_ass_overrides(output, scenes):
+                        self.__init_farm_job(output, scenes)
 
-                if ass_path and ass_name:
+        hou.setFrame(current_frame)
 
-                    if os.path.isdir(ass_path):
+    def __add_delta_ass_overrides(self, output, scenes):
+        """
+        Overrides a copy of the first frame, patches the overridden options and
+        the aton driver into all frames and splits them into a static ASS file
+        and small per frame delta ASS files
+        @param output: OutputItem
+        @param scenes: list: tuple: frame, session id and ass file path of each frame
+        @return: bool
+        """
+        output.set_status("Writing delta ASS...")
 
-                        output.set_status("Exporting ASS...")
+        first_path = scenes[0][2]
+        copy_path = os.path.join(os.path.dirname(first_path),
+                                 ".aton_" + os.path.basename(first_path))
+        header, nodes = read_ass(first_path)
+        write_ass(copy_path, header, nodes)
 
-                        rop_ass_enable_param = output.rop.parm("ar_ass_export_enable")
-                        rop_ass_file_parm = output.rop.parm("ar_ass_file")
-                        rop_picture_param = output.rop.parm("ar_picture")
+        try:
+            if not self.__add_ass_overrides(output, copy_path, scenes[0][1]):
+                return False
+            overridden = read_ass(copy_path)[1]
+        finally:
+            os.remove(copy_path)
+
+        options = [node for node in nodes if node.type == "options"][0]
+        drivers = [node for node in overridden if node.type == "driver_aton"]
+        options_params = [param for param in
+                          [node for node in overridden if node.type == "options"][0].params()
+                          if param[0] in ASS_OPTIONS_OVERRIDES and param not in options.params()]
+
+        frames = list()
+        for frame, session_id, ass_file_path in scenes:
+            header, nodes = read_ass(ass_file_path)
+            for node in nodes:
+                if node.type == "options":
+                    node.set_params(options_params)
+
+            for driver in drivers:
+                driver = AssNode(list(driver.lines))
+                if driver.param("session") is not None:
+                    driver.set_params([("session", [" session %d\n" % session_id])])
+                nodes.append(driver)
+
+            frames.append((ass_file_path, header, nodes))
+
+        static_path = re.sub(r"(\.ass(\.gz)?)?$", r".static\g<0>", first_path, 1)
+        split_ass_sequence(static_path, frames)
+
+        output.set_status()
+        return True
+
+    def __export_frame_ass(self, output, session_id, sequence=False):
+        """
+        Exports an ass file of the current frame
+        @param output: OutputItem
+        @param session_id: int
+        @param sequence: bool: adds the frame number to the ass name if it has none
+        @return: str: exported ass file path, None on failure
+        """
+        ass_path = self.export_ass_path(output.rop_path, session_id)
+        ass_name = self.export_ass_name(output.rop_path, session_id)
 
-                        if rop_ass_file_parm is not None:
+        if ass_path and ass_name:
 
-                            default_state = rop_ass_enable_param.eval()
-                            default_path = rop_ass_file_parm.rawValue()
-                            default_picture = rop_picture_param.eval()
+            if os.path.isdir(ass_path):
 
-                            rop_picture_param.set("")
-                            rop_ass_enable_param.set(1)
-                            ass_file_path = os.path.join(ass_path, ass_name)
-                            rop_ass_file_parm.set(ass_file_path)
-                            ass_file_path = rop_ass_file_parm.eval()
+                output.set_status("Exporting ASS...")
 
-                            output.rop.parm("execute").pressButton()
+                rop_ass_enable_param = output.rop.parm("ar_ass_export_enable")
+                rop_ass_file_parm = output.rop.parm("ar_ass_file")
+                rop_picture_param = output.rop.parm("ar_picture")
 
-                            rop_ass_enable_param.set(default_state)
-                            rop_ass_file_parm.set(default_path)
-                            rop_picture_param.set(default_picture)
+                if rop_ass_file_parm is not None:
 
-                            # Exported
-                            output.set_status()
+                    default_state = rop_ass_enable_param.eval()
+                    default_path = rop_ass_file_parm.rawValue()
+                    default_picture = rop_picture_param.eval()
 
-                            if self.__add_ass_overrides(output, ass_file_path, session_id):
-                                self.__init_farm_job(output, ass_file_path, session_id)
-                    else:
-                        output.set_status("Error: Invalid ASS path!")
-                else:
-                    output.set_status("Error: ASS path or ASS name is None!")
+                    if sequence and "$F" not in ass_name:
+                        ass_name = re.sub(r"(\.ass(\.gz)?)?$", r".$F4\g<0>", ass_name, 1)
+
+                    rop_picture_param.set("")
+                    rop_ass_enable_param.set(1)
+                    ass_file_path = os.path.join(ass_path, ass_name)
+                    rop_ass_file_parm.set(ass_file_path)
+                    ass_file_path = rop_ass_file_parm.eval()
+
+                    output.rop.parm("execute").pressButton()
+
+                    rop_ass_enable_param.set(default_state)
+                    rop_ass_file_parm.set(default_path)
+                    rop_picture_param.set(default_picture)
+
+                    # Exported
+                    output.set_status()
 
-    def __init_farm_job(self, output, ass_file_path, session_id):
+                    return ass_file_path
+            else:
+                output.set_status("Error: Invalid ASS path!")
+        else:
+            output.set_status("Error: ASS path or ASS name is None!")
+
+    def __farm_frames(self):
+        """
+        Returns frames to submit, the Sequence range or the current frame
+        @return: list: float
+        """
+        if not self.__sequence_checkbox.is_checked():
+            return [self.current_frame]
+
+        return [float(i) for i in xrange(self.__seq_start_spin_box.value(),
+                                         self.__seq_end_spin_box.value() + 1,
+                                         self.__seq_step_spin_box.value())]
+
+    def __new_session_id(self):
+        """
+        Returns a new session id, unique even if several are created within a second
+        @return: int
         """
-        Initialises farm job requirements
+        self.__session_id = max(int(time.time()), self.__session_id + 1)
+        return self.__session_id
+
+    def __init_farm_job(self, output, scenes):
+        """
+        Initialises farm job requirements, submitting every tile of every frame
+        in the order selected in the Sequence layout
         @param output: OutputItem
-        @param ass_file_path: str
-        @param session_id: int
+        @param scenes: list: tuple: frame, session id and ass file path of each frame
         @return:
         """
+        self.__forget_jobs(output.job_ids)
         output.job_ids = list()
         distribute = output.ui.distribute
 
@@ -2491,9 +3424,10 @@ class Aton(QtWidgets.QWidget):
             x_res = r_reg - x_reg
             y_res = t_reg - y_reg
 
-        region_list = list()
+        regions = list()
         for tile in generate_tiles(x_res, y_res, distribute):
 
+            region_list = list()
             if distribute:
                 region_list = [tile[0], tile[1], tile[2], tile[3]]
 
@@ -2508,12 +3442,140 @@ class Aton(QtWidgets.QWidget):
                 else:
                     region_list = [tile[0], tile[1], tile[2] - 1, tile[3] - 1]
 
-            # Unicode to str
-            cpu = str(self.__cpu_combo_box.item_text(output.ui.cpu))
-            ram = str(self.__ram_combo_box.item_text(output.ui.ram))
+            regions.append(region_list)
+
+        ledgers = dict()
+        proxy = None
+        if distribute:
+            proxy = get_ledger_proxy(output.ui.port)
+            for frame, session_id, _ in scenes:
+                ledgers[session_id] = proxy.ledgers[session_id] = TileLedger(session_id, frame)
+
+        # Frames first gets a quick overview of all frames, tiles first finishes frames early
+        if self.__seq_order_combo_box.current_index():
+            matrix = [(scene, region) for scene in scenes for region in regions]
+        else:
+            matrix = [(scene, region) for region in regions for scene in scenes]
+
+        # Unicode to str
+        cpu = str(self.__cpu_combo_box.item_text(output.ui.cpu))
+        ram = str(self.__ram_combo_box.item_text(output.ui.ram))
+
+        for (frame, session_id, ass_file_path), region_list in matrix:
+
+            submission = (ass_file_path, output.rop_path, session_id, frame, cpu, ram, region_list)
+            job_ids = self.farm_start(*submission) or list()
+            output.job_ids += job_ids
+
+            if distribute:
+                ledgers[session_id].add_tile(region_list, job_ids, submission)
+
+        for session_id, ledger in ledgers.items():
+            self.__ledgers[session_id] = (output, ledger, proxy)
+            self.__ledger_timer.start()
+
+        if output.job_ids:
+            self.farm_monitor.watch(output.job_ids)
+
+    def __check_ledgers(self):
+        """
+        Re-submits the tiles of distributed sessions which haven't been
+        received within the farm tile timeout
+        @return:
+        """
+        for session_id, (output, ledger, _) in list(self.__ledgers.items()):
+
+            if ledger.complete:
+                self.__remove_ledger(session_id)
+                output.set_status()
+                continue
+
+            resubmitted = failed = 0
+            for tile in ledger.missing(self.farm_tile_timeout(output.rop_path)):
+
+                if tile.attempts > self.__ledger_attempts:
+                    failed += 1
+                    continue
 
-            output.job_ids += \
-                self.farm_start(ass_file_path, output.rop_path, session_id, self.current_frame, cpu, ram, region_list)
+                self.farm_stop(tile.job_ids)
+                self.__forget_jobs(tile.job_ids)
+                job_ids = self.farm_start(*tile.submission) or list()
+                output.job_ids += job_ids
+                ledger.resubmitted(tile, job_ids)
+
+                if job_ids:
+                    self.farm_monitor.watch(job_ids)
+                resubmitted += 1
+
+            if failed:
+                output.set_status("Error: %d tiles failed after %d attempts!" %
+                                  (failed, self.__ledger_attempts))
+            elif resubmitted:
+                output.set_status("Re-submitted %d tiles" % resubmitted)
+            else:
+                self.__set_farm_status(output)
+
+    def __farm_status_updated(self, statuses):
+        """
+        Called when the farm monitor got new job statuses
+        @param statuses: dict: job id: status
+        @return:
+        """
+        self.__job_statuses.update(statuses)
+
+        for output in self.__output_list:
+            if any(job_id in statuses for job_id in output.job_ids):
+                self.__set_farm_status(output)
+
+    def __set_farm_status(self, output):
+        """
+        Shows the job status counts and tile progress of the given output
+        @param output: OutputItem
+        @return:
+        """
+        statuses = [self.__job_statuses.get(job_id) for job_id in output.job_ids]
+        status = ", ".join("%d %s" % (statuses.count(i), i) for i in JOB_STATUSES if i in statuses)
+
+        for item, ledger, _ in self.__ledgers.values():
+            if item is output:
+                tiles = "Tiles %d/%d" % (ledger.progress, len(ledger.tiles))
+                status = "%s | %s" % (status, tiles) if status else tiles
+
+        output.set_status(status)
+
+    def __forget_jobs(self, job_ids):
+        """
+        Stops monitoring the given jobs
+        @param job_ids: list
+        @return:
+        """
+        for job_id in job_ids:
+            self.__job_statuses.pop(job_id, None)
+
+        if self.__farm_monitor is not None:
+            self.__farm_monitor.forget(job_ids)
+
+    def __remove_ledger(self, session_id):
+        """
+        Stops tracking the tiles of the given session
+        @param session_id: int
+        @return:
+        """
+        _, _, proxy = self.__ledgers.pop(session_id)
+        proxy.ledgers.pop(session_id, None)
+
+        if not self.__ledgers:
+            self.__ledger_timer.stop()
+
+    def __remove_ledgers(self, output):
+        """
+        Stops tracking the tiles of all sessions of the given output
+        @param output: OutputItem
+        @return:
+        """
+        for session_id, (item, _, _) in list(self.__ledgers.items()):
+            if item is output:
+                self.__remove_ledger(session_id)
 
     def __aa_samples_changed(self, output=None):
         """
@@ -2647,8 +3709,9 @@ class Aton(QtWidgets.QWidget):
         AiNodeSetStr(aton_node, "output", output.rop_name)
         AiNodeSetInt(aton_node, "reconnect", self.__reconnect_farm)
 
-        # Distributive rendering session
+        # Distributive rendering session, sent through the ledger proxy tracking its tiles
         if output.ui.distribute:
+            AiNodeSetInt(aton_node, "port", get_ledger_proxy(output.ui.port).port)
             AiNodeSetInt(aton_node, "reconnect", self.__reconnect_distribute)
             AiNodeSetInt(aton_node, "session", session_id)
 
@@ -2778,9 +3841,13 @@ class Aton(QtWidgets.QWidget):
                     self.output.rop.parm("res_overridey").set(self.output.origin_res_y)
                     self.output.rop.parm("aspect_override").set(self.output.pixel_aspect)
 
-                # AA Samples
-                if self.__aa_samples_changed():
-                    self.output.rop.parm("ar_AA_samples").set(self.__camera_aa_slider.value())
+                # AA Samples, the current ramp step while ramping
+                ramp_aa_samples = self.__ramp[0][1] if self.__ramp else None
+
+                if ramp_aa_samples is not None or self.__aa_samples_changed():
+                    self.output.rop.parm("ar_AA_samples").set(self.__camera_aa_slider.value()
+                                                              if ramp_aa_samples is None else
+                                                              ramp_aa_samples)
 
                     if self.__adaptive_sampling_enabled():
                         self.output.user_options += "declare aton_enable_adaptive_sampling constant BOOL " \
@@ -2829,7 +3896,7 @@ class Aton(QtWidgets.QWidget):
                 if self.__resolution_changed(output):
                     output.rollback_resolution()
 
-                if self.__aa_samples_changed(output):
+                if self.__aa_samples_changed(output) or self.__ramp and output is self.output:
                     output.rollback_aa_samples()
 
                 output.rollback_user_options()
@@ -2916,7 +3983,8 @@ class Aton(QtWidgets.QWidget):
     def farm_start(self, ass_file_path, rop_path, session_id, frame, cpu, ram, region):
         """
         Farm submission start method to be implemented in the
-        sub-classes and return the submitted job ids for each farm submission call
+        sub-classes and return the submitted job ids for each farm submission call,
+        get_ass_files returns the files to render in case of delta ASS sequences
         @param ass_file_path: str
         @param rop_path: str
         @param session_id: int
@@ -2937,6 +4005,26 @@ class Aton(QtWidgets.QWidget):
         """
         pass
 
+    def farm_status(self, job_ids):
+        """
+        Farm status method to be re-implemented in the sub-classes, called
+        from a background thread with many job ids at once and returning the
+        status of each job as one of JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+        @param job_ids: list
+        @return: dict: job id: str
+        """
+        return dict()
+
+    def farm_tile_timeout(self, rop_path):
+        """
+        Farm tile timeout method to be re-implemented in the sub-classes,
+        returns seconds a distributed tile may go without sending a bucket
+        before it gets stopped and submitted again
+        @param rop_path: str
+        @return: float
+        """
+        return 900.0
+
     @property
     def output_list_box(self):
         """
@@ -2997,6 +4085,31 @@ class Aton(QtWidgets.QWidget):
 
         return self.__hick_status
 
+    @property
+    def ramp_status(self):
+        """
+        Gets HickStatus object of the Resolution and AA ramps
+        @return: HickStatus
+        """
+        if self.__ramp_status is None:
+            self.__ramp_status = HickStatus(self.ipr, transitions=True)
+            self.__ramp_status.finished.connect(self.__next_ramp_step)
+
+        return self.__ramp_status
+
+    @property
+    def farm_monitor(self):
+        """
+        Gets FarmMonitor object
+        @return: FarmMonitor
+        """
+        if self.__farm_monitor is None:
+            self.__farm_monitor = FarmMonitor(self.farm_status, self.farm_status_changed.emit,
+                                              warn_function=warn)
+            self.farm_status_changed.connect(self.__farm_status_updated)
+
+        return self.__farm_monitor
+
     @property
     def port(self):
         """
@@ -2,8 +2,10 @@ __author__ = "Vahan Sosoyan"
 __copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
 __version__ = "1.3.7"
 
+import os
 import sys
 from timeit import default_timer
+from collections import OrderedDict
 
 import maya.mel as mel
 import maya.OpenMaya as OM
@@ -29,6 +31,11 @@ else:
     from PySide import QtGui as QtWidgets
     from shiboken import wrapInstance
 
+try:
+    from aton_roi import RoiSubscriber
+except ImportError:
+    RoiSubscriber = None
+
 class BoxWidget(QtWidgets.QFrame):
     def __init__(self, label, first = True):
         super(BoxWidget, self).__init__()
@@ -226,6 +233,15 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         self.defaultAiTranslator = None
         self.defaultHost = getSceneOption(0)
         self.defaultPort = getSceneOption(1)
+        self.ovrShaders = OverrideShaders()
+        self.iprUpdates = IPRUpdateQueue(self.IPRUpdate)
+        self.hiddenCameras = HiddenCameras()
+
+        # Live render region from Nuke, applied at ATON_ROI_RATE
+        self.roiSubscriber = None
+        self.roiTimer = QtCore.QTimer()
+        self.roiTimer.setInterval(int(1000 / max(float(os.getenv("ATON_ROI_RATE", 4)), 0.1)))
+        self.roiTimer.timeout.connect(self.applyLiveRegion)
 
         # Sequence mode
         self.frame_sequence = AiFrameSequence()
@@ -264,30 +280,31 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
             self.stepSpinBox.setEnabled(value)
 
         def resetUI(*args):
-            self.hostLineEdit.setText(self.defaultHost)
-            self.hostCheckBox.setChecked(True)
-            self.portSlider.setValue(self.defaultPort, 0)
-            self.portCheckBox.setChecked(True)
-            self.cameraComboBox.setCurrentIndex(0)
-            self.resolutionSlider.setValue(100, 20)
-            self.cameraAaSlider.setValue(getSceneOption(5))
-            self.renderRegionXSpinBox.setValue(0)
-            self.renderRegionYSpinBox.setValue(0)
-            self.renderRegionRSpinBox.setValue(getSceneOption(3))
-            self.renderRegionTSpinBox.setValue(getSceneOption(4))
-            self.overscanSlider.setValue(0, 0)
-            self.motionBlurCheckBox.setChecked(getSceneOption(6))
-            self.subdivsCheckBox.setChecked(getSceneOption(7))
-            self.displaceCheckBox.setChecked(getSceneOption(8))
-            self.bumpCheckBox.setChecked(getSceneOption(9))
-            self.sssCheckBox.setChecked(getSceneOption(10))
-            self.shaderComboBox.setCurrentIndex(0)
-            self.textureRepeatSlider.setValue(1, 1)
-            self.selectedShaderCheckbox.setChecked(0)
-            self.startSpinBox.setValue(getSceneOption(11))
-            self.endSpinBox.setValue(getSceneOption(12))
-            self.stepSpinBox.setValue(1)
-            self.seqCheckBox.setChecked(False)
+            with self.iprUpdates:
+                self.hostLineEdit.setText(self.defaultHost)
+                self.hostCheckBox.setChecked(True)
+                self.portSlider.setValue(self.defaultPort, 0)
+                self.portCheckBox.setChecked(True)
+                self.cameraComboBox.setCurrentIndex(0)
+                self.resolutionSlider.setValue(100, 20)
+                self.cameraAaSlider.setValue(getSceneOption(5))
+                self.renderRegionXSpinBox.setValue(0)
+                self.renderRegionYSpinBox.setValue(0)
+                self.renderRegionRSpinBox.setValue(getSceneOption(3))
+                self.renderRegionTSpinBox.setValue(getSceneOption(4))
+                self.overscanSlider.setValue(0, 0)
+                self.motionBlurCheckBox.setChecked(getSceneOption(6))
+                self.subdivsCheckBox.setChecked(getSceneOption(7))
+                self.displaceCheckBox.setChecked(getSceneOption(8))
+                self.bumpCheckBox.setChecked(getSceneOption(9))
+                self.sssCheckBox.setChecked(getSceneOption(10))
+                self.shaderComboBox.setCurrentIndex(0)
+                self.textureRepeatSlider.setValue(1, 1)
+                self.selectedShaderCheckbox.setChecked(0)
+                self.startSpinBox.setValue(getSceneOption(11))
+                self.endSpinBox.setValue(getSceneOption(12))
+                self.stepSpinBox.setValue(1)
+                self.seqCheckBox.setChecked(False)
 
         self.setAttribute(QtCore.Qt.WA_AlwaysShowToolTips)
         self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
@@ -371,11 +388,15 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         self.renderRegionTSpinBox.setValue(getSceneOption(4))
         renderRegionGetNukeButton = QtWidgets.QPushButton("Get")
         renderRegionGetNukeButton.clicked.connect(self.getNukeCropNode)
+        self.renderRegionLiveCheckBox = QtWidgets.QCheckBox("Live")
+        self.renderRegionLiveCheckBox.setEnabled(RoiSubscriber is not None)
+        self.renderRegionLiveCheckBox.toggled.connect(self.followLiveRegion)
         renderRegionLayout.addWidget(self.renderRegionXSpinBox)
         renderRegionLayout.addWidget(self.renderRegionYSpinBox)
         renderRegionLayout.addWidget(self.renderRegionRSpinBox)
         renderRegionLayout.addWidget(self.renderRegionTSpinBox)
         renderRegionLayout.addWidget(renderRegionGetNukeButton)
+        renderRegionLayout.addWidget(self.renderRegionLiveCheckBox)
 
         # Overscan Layout
         overscanLayout = QtWidgets.QHBoxLayout()
@@ -390,7 +411,7 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         # Shaders layout
         shaderLayout = QtWidgets.QHBoxLayout()
         self.shaderComboBox = ComboBox("Shader override", False)
-        self.shaderComboBox.addItems(["Disabled", "Checker", "Grey", "Mirror", "Normal", "Occlusion", "UV"])
+        self.shaderComboBox.addItems(["Disabled"] + self.ovrShaders.names())
         self.selectedShaderCheckbox = QtWidgets.QCheckBox("Selected objects only")
         shaderLayout.addWidget(self.shaderComboBox)
         shaderLayout.addWidget(self.selectedShaderCheckbox)
@@ -481,23 +502,23 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         mainLayout.addLayout(mainButtonslayout)
 
         # IPR Updates
-        self.cameraComboBox.currentIndexChanged.connect(lambda: self.IPRUpdate(0))
-        self.bucketComboBox.currentIndexChanged.connect(lambda: self.IPRUpdate(6))
-        self.resolutionSlider.valueChanged.connect(lambda: self.IPRUpdate(1))
-        self.cameraAaSlider.valueChanged.connect(lambda: self.IPRUpdate(2))
-        self.renderRegionXSpinBox.valueChanged.connect(lambda: self.IPRUpdate(1))
-        self.renderRegionYSpinBox.valueChanged.connect(lambda: self.IPRUpdate(1))
-        self.renderRegionRSpinBox.valueChanged.connect(lambda: self.IPRUpdate(1))
-        self.renderRegionTSpinBox.valueChanged.connect(lambda: self.IPRUpdate(1))
-        self.overscanSlider.valueChanged.connect(lambda: self.IPRUpdate(1))
-        self.motionBlurCheckBox.toggled.connect(lambda: self.IPRUpdate(3))
-        self.subdivsCheckBox.toggled.connect(lambda: self.IPRUpdate(3))
-        self.displaceCheckBox.toggled.connect(lambda: self.IPRUpdate(3))
-        self.bumpCheckBox.toggled.connect(lambda: self.IPRUpdate(3))
-        self.sssCheckBox.toggled.connect(lambda: self.IPRUpdate(3))
-        self.shaderComboBox.currentIndexChanged.connect(lambda: self.IPRUpdate(4))
-        self.textureRepeatSlider.valueChanged.connect(lambda: self.IPRUpdate(5))
-        self.selectedShaderCheckbox.toggled.connect(lambda: self.IPRUpdate(4))
+        self.cameraComboBox.currentIndexChanged.connect(lambda: self.iprUpdates.add(0))
+        self.bucketComboBox.currentIndexChanged.connect(lambda: self.iprUpdates.add(6))
+        self.resolutionSlider.valueChanged.connect(lambda: self.iprUpdates.add(1))
+        self.cameraAaSlider.valueChanged.connect(lambda: self.iprUpdates.add(2))
+        self.renderRegionXSpinBox.valueChanged.connect(lambda: self.iprUpdates.add(1))
+        self.renderRegionYSpinBox.valueChanged.connect(lambda: self.iprUpdates.add(1))
+        self.renderRegionRSpinBox.valueChanged.connect(lambda: self.iprUpdates.add(1))
+        self.renderRegionTSpinBox.valueChanged.connect(lambda: self.iprUpdates.add(1))
+        self.overscanSlider.valueChanged.connect(lambda: self.iprUpdates.add(1))
+        self.motionBlurCheckBox.toggled.connect(lambda: self.iprUpdates.add(3))
+        self.subdivsCheckBox.toggled.connect(lambda: self.iprUpdates.add(3))
+        self.displaceCheckBox.toggled.connect(lambda: self.iprUpdates.add(3))
+        self.bumpCheckBox.toggled.connect(lambda: self.iprUpdates.add(3))
+        self.sssCheckBox.toggled.connect(lambda: self.iprUpdates.add(3))
+        self.shaderComboBox.currentIndexChanged.connect(lambda: self.iprUpdates.add(4))
+        self.textureRepeatSlider.valueChanged.connect(lambda: self.iprUpdates.add(5))
+        self.selectedShaderCheckbox.toggled.connect(lambda: self.iprUpdates.add(4))
 
         self.setLayout(mainLayout)
 
@@ -589,6 +610,33 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
             self.renderRegionRSpinBox.setValue(nkR)
             self.renderRegionTSpinBox.setValue(nkT)
 
+    def liveRegionTarget(self):
+        ''' Returns host and port of the Aton node the live region follows '''
+        host = self.hostLineEdit.text() if self.hostCheckBox.isChecked() else self.defaultHost
+        port = self.portSlider.value() if self.portCheckBox.isChecked() else self.defaultPort
+        return host or "127.0.0.1", port
+
+    def followLiveRegion(self, value):
+        ''' Follows the region of the Aton node while Live is checked '''
+        if value:
+            self.roiSubscriber = RoiSubscriber(*self.liveRegionTarget())
+            self.roiTimer.start()
+        elif self.roiSubscriber is not None:
+            self.roiTimer.stop()
+            self.roiSubscriber.close()
+            self.roiSubscriber = None
+
+    def applyLiveRegion(self):
+        ''' Applies the latest region received from Nuke '''
+        self.roiSubscriber.set_target(*self.liveRegionTarget())
+        region = self.roiSubscriber.pop()
+        if region is not None:
+            xres, yres = float(getSceneOption(3)), float(getSceneOption(4))
+            self.renderRegionXSpinBox.setValue(int(region[0] * xres))
+            self.renderRegionYSpinBox.setValue(int(region[1] * yres))
+            self.renderRegionRSpinBox.setValue(int(region[2] * xres))
+            self.renderRegionTSpinBox.setValue(int(region[3] * yres))
+
 
     def setOverscan(self):
         ovrScnValue = bool(self.overscanSlider.value())
@@ -655,15 +703,7 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
             pass
 
         # Temporary makeing hidden cameras visible before scene export
-        hCams = []
-        for i in cmds.listCameras():
-            if not cmds.getAttr(i + ".visibility"):
-                hCams.append(i)
-            sl = cmds.listRelatives(i, s=1)
-            if sl and not cmds.getAttr(sl[0] + ".visibility"):
-                hCams.append(sl[0])
-
-        for i in hCams: cmds.showHidden(i)
+        self.hiddenCameras.show()
 
         # Set Progressive refinement to off
         if self.sequence_enabled:
@@ -676,21 +716,25 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         except RuntimeError:
             cmds.warning("Current renderer is not set to Arnold.")
 
-        # Sequence Rendering
+        # Sequence Rendering, settings are restored once the sequence has stopped
         if self.sequence_enabled:
             self.frame_sequence.start()
+        else:
+            self.restoreSettings()
 
+    def restoreSettings(self):
+        ''' Updates IPR and sets the driver settings back to default '''
         # Update IPR
+        self.iprUpdates.cancel()
         self.IPRUpdate()
 
         # Setting back to default
-        for i in hCams:
-            cmds.hide(i)
+        self.hiddenCameras.hide()
         cmds.setAttr("defaultArnoldDriver.mergeAOVs",  self.defaultMergeAOVs)
         cmds.setAttr("defaultArnoldDisplayDriver.aiTranslator", self.defaultAiTranslator, type="string")
 
         if self.hostCheckBox.isChecked():
-            cmds.setAttr("defaultArnoldDisplayDriver.host", host, type="string")
+            cmds.setAttr("defaultArnoldDisplayDriver.host", self.hostLineEdit.text(), type="string")
         if self.portCheckBox.isChecked():
             cmds.setAttr("defaultArnoldDisplayDriver.port", self.defaultPort)
 
@@ -732,6 +776,8 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         # kill progressBar
         cmds.progressBar(self.gMainProgressBar, edit=True, endProgress=True)
 
+        self.restoreSettings()
+
     def sequence_stepped(self, frame):
         # Refresh IPR
         self.IPRUpdate()
@@ -739,48 +785,12 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         # step progressBar
         cmds.progressBar(self.gMainProgressBar, edit=True, step=1)
 
-    def initOvrShaders(self):
-        ''' Initilize override shaders '''
-        # Checker shader
-        self.checkerShader = AiNode("standard")
-        checkerTexture = AiNode("MayaChecker")
-        self.placeTexture = AiNode("MayaPlace2DTexture")
-        AiNodeLink(self.placeTexture, "uvCoord", checkerTexture)
-        AiNodeLink(checkerTexture, "Kd", self.checkerShader)
-
-        # Grey Shader
-        self.greyShader = AiNode("standard")
-        AiNodeSetFlt(self.greyShader, "Kd", 0.225)
-        AiNodeSetFlt(self.greyShader, "Ks", 1)
-        AiNodeSetFlt(self.greyShader, "specular_roughness", 0.3)
-        AiNodeSetBool(self.greyShader, "specular_Fresnel", True)
-        AiNodeSetBool(self.greyShader, "Fresnel_use_IOR", True)
-        AiNodeSetFlt(self.greyShader, "IOR", 1.3)
-
-        # Mirror Shader
-        self.mirrorShader = AiNode("standard")
-        AiNodeSetFlt(self.mirrorShader, "Kd", 0)
-        AiNodeSetFlt(self.mirrorShader, "Ks", 1)
-        AiNodeSetFlt(self.mirrorShader, "specular_roughness", 0.005)
-        AiNodeSetBool(self.mirrorShader, "specular_Fresnel", True)
-        AiNodeSetFlt(self.mirrorShader, "Ksn", 0.6)
-
-        # Normal Shader
-        self.normalShader = AiNode("utility")
-        AiNodeSetInt(self.normalShader, "shade_mode", 2)
-        AiNodeSetInt(self.normalShader, "color_mode", 2)
-
-        # Occlusion Shader
-        self.occlusionShader = AiNode("utility")
-        AiNodeSetInt(self.occlusionShader, "shade_mode", 3)
-
-        # UV Shader
-        self.uvShader = AiNode("utility")
-        AiNodeSetInt(self.uvShader, "shade_mode", 2)
-        AiNodeSetInt(self.uvShader, "color_mode", 5)
-
-    def IPRUpdate(self, attr=None):
-        ''' This method is called during IPR session '''
+    def IPRUpdate(self, *attrs):
+        ''' This method is called during IPR session, all given attrs
+        are applied under a single pause, none of them means full update '''
+        def update(attr):
+            return not attrs or attr in attrs
+
         try: # If render session is not started yet
             cmds.arnoldIpr(mode='pause')
         except (AttributeError, RuntimeError):
@@ -789,7 +799,7 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         options = AiUniverseGetOptions()
 
         # Camera Update
-        if attr == None or attr == 0:
+        if update(0):
             camera = self.getCamera()
             iterator = AiUniverseGetNodeIterator(AI_NODE_CAMERA)
             while not AiNodeIteratorFinished(iterator):
@@ -798,7 +808,7 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
                     AiNodeSetPtr(options, "camera", node)
 
         # Resolution and Region Update
-        if attr == None or attr == 1:
+        if update(1):
 
             AiNodeSetInt(options, "xres", self.getRegion(0))
             AiNodeSetInt(options, "yres", self.getRegion(1))
@@ -809,13 +819,13 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
             AiNodeSetInt(options, "region_max_y", self.getRegion(5))
 
         # Camera AA Update
-        if attr == None or attr == 2:
+        if update(2):
             cameraAA = self.cameraAaSlider.value()
             options = AiUniverseGetOptions()
             AiNodeSetInt(options, "AA_samples", cameraAA)
 
         # Ignore options Update
-        if attr == None or attr == 3:
+        if update(3):
             motionBlur = self.motionBlurCheckBox.isChecked()
             subdivs = self.subdivsCheckBox.isChecked()
             displace = self.displaceCheckBox.isChecked()
@@ -829,8 +839,7 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
             AiNodeSetBool(options, "ignore_sss", sss)
 
         # Storing default shader assignments
-        if attr == None:
-            self.initOvrShaders()
+        if not attrs:
             self.shadersDict = {}
             iterator = AiUniverseGetNodeIterator(AI_NODE_SHAPE)
             while not AiNodeIteratorFinished(iterator):
@@ -845,7 +854,11 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
 
         # Shader override Update
         shaderIndex = self.shaderComboBox.currentIndex()
-        if attr == 4 or shaderIndex > 0:
+        if 4 in attrs or shaderIndex > 0:
+            ovrShader = None
+            if shaderIndex > 0:
+                ovrShader = self.ovrShaders.shader(self.shaderComboBox.currentName())
+
             iterator = AiUniverseGetNodeIterator(AI_NODE_SHAPE)
             while not AiNodeIteratorFinished(iterator):
                 node = AiNodeIteratorGetNext(iterator)
@@ -862,24 +875,22 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
 
                 # Setting overrides
                 if name in self.shadersDict:
-                    defShader = self.shadersDict[AiNodeGetName(node)]
-                    result = {0: lambda: AiNodeSetPtr(node, "shader", defShader),
-                              1: lambda: AiNodeSetPtr(node, "shader", self.checkerShader),
-                              2: lambda: AiNodeSetPtr(node, "shader", self.greyShader),
-                              3: lambda: AiNodeSetPtr(node, "shader", self.mirrorShader),
-                              4: lambda: AiNodeSetPtr(node, "shader", self.normalShader),
-                              5: lambda: AiNodeSetPtr(node, "shader", self.occlusionShader),
-                              6: lambda: AiNodeSetPtr(node, "shader", self.uvShader)}[shaderIndex]()
+                    if ovrShader is None:
+                        AiNodeSetPtr(node, "shader", self.shadersDict[name])
+                    else:
+                        AiNodeSetPtr(node, "shader", ovrShader)
 
         # Texture Repeat Udpate
-        if attr == None or attr == 5:
-            texRepeat = self.textureRepeatSlider.value()
-            if ARNOLD_5:
-                AiNodeSetVec2(self.placeTexture, "repeatUV", texRepeat, texRepeat)
-            else:
-                AiNodeSetPnt2(self.placeTexture, "repeatUV", texRepeat, texRepeat)
-
-        if attr == None or attr == 6:
+        if update(4) or update(5):
+            placeTexture = self.ovrShaders.node("Checker", "place2d")
+            if placeTexture is not None:
+                texRepeat = self.textureRepeatSlider.value()
+                if ARNOLD_5:
+                    AiNodeSetVec2(placeTexture, "repeatUV", texRepeat, texRepeat)
+                else:
+                    AiNodeSetPnt2(placeTexture, "repeatUV", texRepeat, texRepeat)
+
+        if update(6):
             scanning = self.bucketComboBox.currentName()
             AiNodeSetStr(options, "bucket_scanning", scanning)
 
@@ -899,10 +910,12 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         shaderIndex = self.shaderComboBox.currentIndex()
         selectedObjects = self.selectedShaderCheckbox.isChecked()
         if shaderIndex > 0 and selectedObjects:
-            self.IPRUpdate(4)
+            self.iprUpdates.add(4)
 
     def stop(self):
         ''' Stops the render session and removes the callbacks '''
+        self.iprUpdates.cancel()
+
         if self.timeChangedCB != None:
             OM.MEventMessage.removeCallback(self.timeChangedCB)
             self.timeChangedCB = None
@@ -923,6 +936,8 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         ''' Removes callback when closing the GUI '''
         self.stop()
         self.frame_sequence.stop()
+        self.renderRegionLiveCheckBox.setChecked(False)
+        self.hiddenCameras.removeCallbacks()
         self.deleteInstances()
 
         if self.defaultMergeAOVs is not None:
@@ -937,6 +952,260 @@ class Aton(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         if event.key() == QtCore.Qt.Key_Escape:
             self.frame_sequence.stop()
 
+class HiddenCameras(object):
+    '''
+    Makes hidden cameras visible for the scene export and hides them back
+    afterwards, with a single command each way. Camera shapes and their
+    transforms are gathered with one API scan, which is cached until a
+    camera is added or removed from the scene.
+    '''
+
+    def __init__(self):
+        self.hidden = []
+        self._cameras = None
+        self._callbacks = []
+
+    def cameras(self):
+        ''' Returns handles of all camera shapes and transforms '''
+        if self._cameras is None:
+            self._cameras = []
+            iterator = OM.MItDependencyNodes(OM.MFn.kCamera)
+            while not iterator.isDone():
+                shape = OM.MFnDagNode(iterator.thisNode())
+                self._cameras.append(OM.MObjectHandle(shape.object()))
+                if shape.parentCount():
+                    self._cameras.append(OM.MObjectHandle(shape.parent(0)))
+                iterator.next()
+            self.addCallbacks()
+        return self._cameras
+
+    def show(self):
+        ''' Shows all hidden cameras '''
+        self.hidden = []
+        for handle in self.cameras():
+            if handle.isValid():
+                node = OM.MFnDagNode(handle.object())
+                if not node.findPlug("visibility").asBool():
+                    self.hidden.append(node.fullPathName())
+
+        if self.hidden:
+            cmds.showHidden(self.hidden)
+
+    def hide(self):
+        ''' Hides back the cameras shown by show '''
+        if self.hidden:
+            cmds.hide(self.hidden)
+        self.hidden = []
+
+    def reset(self, *args):
+        ''' Callback method to drop the cached cameras '''
+        self._cameras = None
+
+    def addCallbacks(self):
+        if not self._callbacks:
+            self._callbacks = [OM.MDGMessage.addNodeAddedCallback(self.reset, "camera"),
+                               OM.MDGMessage.addNodeRemovedCallback(self.reset, "camera")]
+
+    def removeCallbacks(self):
+        for callback in self._callbacks:
+            OM.MMessage.removeCallback(callback)
+        self._callbacks = []
+
+class IPRUpdateQueue(object):
+    '''
+    Coalesces IPR update requests. Attributes added within window
+    milliseconds are collected and applied together with one call of
+    the update function, i.e. under a single pause/unpause of the IPR.
+    Updates are never applied more often than maxRate times per second.
+    Adding None requests a full update.
+
+    usage::
+
+       queue = IPRUpdateQueue(aton.IPRUpdate, window=50, maxRate=10)
+       queue.add(1)
+       queue.add(2)
+       # OR AS A TRANSACTION, applied when the block exits
+       with queue:
+           queue.add(1)
+           queue.add(3)
+    '''
+
+    def __init__(self, update, window=50, maxRate=10):
+        self.update = update
+        self.window = window
+        self.maxRate = maxRate
+        self.pending = set()
+
+        self._depth = 0
+        self._lastFlush = 0
+        self._timer = QtCore.QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.flush)
+
+    def __enter__(self):
+        self._depth += 1
+        return self
+
+    def __exit__(self, *args):
+        self._depth -= 1
+        if not self._depth:
+            self.flush()
+
+    def add(self, attr=None):
+        ''' Queues an attribute update '''
+        self.pending.add(attr)
+        if self._depth or self._timer.isActive():
+            return
+
+        delay = self.window
+        if self.maxRate:
+            elapsed = (default_timer() - self._lastFlush) * 1000
+            delay = max(delay, 1000.0 / self.maxRate - elapsed)
+        self._timer.start(int(delay))
+
+    def flush(self):
+        ''' Applies all queued attributes at once '''
+        self._timer.stop()
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, set()
+        self._lastFlush = default_timer()
+
+        if None in pending:
+            self.update()
+        else:
+            self.update(*sorted(pending))
+
+    def cancel(self):
+        ''' Drops queued attributes '''
+        self._timer.stop()
+        self.pending = set()
+
+class OverrideShaders(object):
+    '''
+    Pool of override shaders. Each override type is built on first use and
+    then looked up by name, so it is created once per universe and reused
+    across IPR refreshes. New override types can be added with register,
+    a builder gets a node factory and returns the shader node.
+
+    usage::
+
+       def red(createNode):
+           shader = createNode("flat")
+           AiNodeSetRGB(shader, "color", 1, 0, 0)
+           return shader
+
+       pool = OverrideShaders()
+       pool.register("Red", red)
+       AiNodeSetPtr(shape, "shader", pool.shader("Red"))
+    '''
+
+    prefix = "aton_ovr"
+
+    def __init__(self):
+        self.builders = OrderedDict()
+        self.register("Checker", self._checker)
+        self.register("Grey", self._grey)
+        self.register("Mirror", self._mirror)
+        self.register("Normal", self._normal)
+        self.register("Occlusion", self._occlusion)
+        self.register("UV", self._uv)
+        self.register("Wireframe", self._wireframe)
+        self.register("Facing Ratio", self._facingRatio)
+
+    def register(self, name, builder):
+        ''' Adds a new override type '''
+        self.builders[name] = builder
+
+    def names(self):
+        ''' Returns registered override type names '''
+        return list(self.builders)
+
+    def nodeName(self, name, part=None):
+        ''' Returns unique Arnold node name for the override type '''
+        nodeName = "%s:%s"%(self.prefix, name.lower().replace(" ", "_"))
+        if part is not None:
+            nodeName += ":" + part
+        return nodeName
+
+    def node(self, name, part=None):
+        ''' Returns an existing override node or None '''
+        return AiNodeLookUpByName(self.nodeName(name, part))
+
+    def shader(self, name):
+        ''' Returns override shader, building it if the universe has none '''
+        shader = self.node(name)
+        if shader is None:
+            def createNode(entry, part=None):
+                node = AiNode(entry)
+                AiNodeSetStr(node, "name", self.nodeName(name, part))
+                return node
+            shader = self.builders[name](createNode)
+        return shader
+
+    @staticmethod
+    def _checker(createNode):
+        shader = createNode("standard")
+        checkerTexture = createNode("MayaChecker", "checker")
+        placeTexture = createNode("MayaPlace2DTexture", "place2d")
+        AiNodeLink(placeTexture, "uvCoord", checkerTexture)
+        AiNodeLink(checkerTexture, "Kd", shader)
+        return shader
+
+    @staticmethod
+    def _grey(createNode):
+        shader = createNode("standard")
+        AiNodeSetFlt(shader, "Kd", 0.225)
+        AiNodeSetFlt(shader, "Ks", 1)
+        AiNodeSetFlt(shader, "specular_roughness", 0.3)
+        AiNodeSetBool(shader, "specular_Fresnel", True)
+        AiNodeSetBool(shader, "Fresnel_use_IOR", True)
+        AiNodeSetFlt(shader, "IOR", 1.3)
+        return shader
+
+    @staticmethod
+    def _mirror(createNode):
+        shader = createNode("standard")
+        AiNodeSetFlt(shader, "Kd", 0)
+        AiNodeSetFlt(shader, "Ks", 1)
+        AiNodeSetFlt(shader, "specular_roughness", 0.005)
+        AiNodeSetBool(shader, "specular_Fresnel", True)
+        AiNodeSetFlt(shader, "Ksn", 0.6)
+        return shader
+
+    @staticmethod
+    def _normal(createNode):
+        shader = createNode("utility")
+        AiNodeSetInt(shader, "shade_mode", 2)
+        AiNodeSetInt(shader, "color_mode", 2)
+        return shader
+
+    @staticmethod
+    def _occlusion(createNode):
+        shader = createNode("utility")
+        AiNodeSetInt(shader, "shade_mode", 3)
+        return shader
+
+    @staticmethod
+    def _uv(createNode):
+        shader = createNode("utility")
+        AiNodeSetInt(shader, "shade_mode", 2)
+        AiNodeSetInt(shader, "color_mode", 5)
+        return shader
+
+    @staticmethod
+    def _wireframe(createNode):
+        shader = createNode("wireframe")
+        AiNodeSetStr(shader, "edge_type", "polygons")
+        return shader
+
+    @staticmethod
+    def _facingRatio(createNode):
+        shader = createNode("utility")
+        AiNodeSetInt(shader, "shade_mode", 0)
+        return shader
+
 class Signal(set):
     '''Qt Signal Clone allows'''
     connect = set.add
@@ -955,6 +1224,10 @@ class AiFrameSequence(object):
     used to report progress. frame_changed emits the frame number when the
     frame is changed.
 
+    The sequence is driven by a QTimer, so start returns immediately and the
+    render state is only polled every interval milliseconds while Maya's
+    event loop stays idle in between.
+
     usage::
 
        b = AiFrameSequence(xrange(10, 20, 2), 1)
@@ -963,18 +1236,30 @@ class AiFrameSequence(object):
        b = AiFrameSequence()
        b.frames = xrange(10, 20, 2)
        b.timeout = 1
+       b.interval = 250
        b.start()
     '''
 
-    def __init__(self, frames=None, timeout=None):
+    # Sequence states
+    IDLE, STARTING, RENDERING = range(3)
+
+    def __init__(self, frames=None, timeout=None, interval=100):
         self.frames = frames or []
         self.timeout = timeout
+        self.interval = interval
         self.running = False
+        self.state = self.IDLE
         self.started = Signal()
         self.stopped = Signal()
         self.stepped = Signal()
         self.frame_changed = Signal()
 
+        self._steps = None
+        self._stepStart = 0
+        self._progressBar = None
+        self._timer = QtCore.QTimer()
+        self._timer.timeout.connect(self._poll)
+
     def change_frame(self, frame):
         cmds.currentTime(frame)
         options = AiUniverseGetOptions()
@@ -985,59 +1270,65 @@ class AiFrameSequence(object):
         '''Start stepping through frames'''
         self.running = True
         self.started.emit()
-        gMainProgressBar = mel.eval('$tmp = $gMainProgressBar')
-
-        for i, frame in enumerate(self.frames):
-            isCancelled = cmds.progressBar(gMainProgressBar, q=True, ic=True)
-            if not self.running or isCancelled:
-                break
-            self.change_frame(frame)
-            self.stepped.emit(i)
-
-            # Sleep until frame starts, then finishes
-            sleep_until(conditions = [AiRendering, lambda: not AiRendering()],
-                        wake_condition = lambda: not self.running,
-                        timeout=self.timeout)
-
-        self.running = False
-        self.stopped.emit()
+        self._progressBar = mel.eval('$tmp = $gMainProgressBar')
+        self._steps = enumerate(list(self.frames))
+        self._timer.setInterval(self.interval)
+        self._step()
 
     def stop(self):
         '''Stop stepping through frames'''
         self.running = False
+        if self.state != self.IDLE:
+            self._finish()
+
+    def _cancelled(self):
+        '''Returns True if the sequence was stopped or interrupted by the user'''
+        if not self.running:
+            return True
+        return cmds.progressBar(self._progressBar, q=True, ic=True)
+
+    def _step(self):
+        '''Moves on to the next frame or finishes the sequence'''
+        if self._cancelled():
+            self._finish()
+            return
 
-def qt_sleep(secs=0):
-    '''Non-blocking sleep for Qt'''
-    start = default_timer()
-
-    while True:
-        QtWidgets.qApp.processEvents()
-        if default_timer() - start > secs:
+        try:
+            i, frame = next(self._steps)
+        except StopIteration:
+            self._finish()
             return
 
-def sleep_until(conditions, wake_condition=None, timeout=None):
-    '''
-    Process qApp events until a sequence of conditions becomes True. Return
-    when each condition returns True or the wake_condition returns True or
-    the timeout is reached...
-    :param conditions: Sequence of callables returning True or False
-    :param wake_condition: Optional callable returning True or False
-    :param timeout: Number of seconds to wait before returning
-    '''
+        self.change_frame(frame)
+        self.stepped.emit(i)
 
-    start = default_timer()
+        # Wait until the frame starts, then finishes
+        self.state = self.STARTING
+        self._stepStart = default_timer()
+        self._timer.start()
 
-    for condition in conditions:
-        while True:
-            if condition():
-                break
-            if timeout:
-                if default_timer() - start > timeout:
-                    break
-            if wake_condition():
-                break
+    def _poll(self):
+        '''Timer callback advancing the state machine'''
+        if self._cancelled():
+            self._finish()
+            return
 
-            qt_sleep(0.1)
+        if self.timeout and default_timer() - self._stepStart > self.timeout:
+            self._step()
+        elif self.state == self.STARTING:
+            if AiRendering():
+                self.state = self.RENDERING
+        elif self.state == self.RENDERING:
+            if not AiRendering():
+                self._step()
+
+    def _finish(self):
+        '''Stops the timer and emits the stopped signal'''
+        self._timer.stop()
+        self._steps = None
+        self.state = self.IDLE
+        self.running = False
+        self.stopped.emit()
 
 if __name__ == "__main__":
     aton = Aton()
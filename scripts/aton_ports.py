@@ -0,0 +1,300 @@
+"""
+Aton Ports
+
+Local registry of the ports Aton sessions use on this machine, so outputs
+are not sent to another artist's session or to a stale Nuke. The registry
+is a JSON file shared by all applications, ATON_PORT_REGISTRY or
+aton_ports.json in the temp directory, holding leases of two roles:
+
+server: a listening Aton node, registered by Nuke for every Aton node
+client: a port reserved by a DCC session for one of its outputs
+
+Leases end with their process or when their lease time runs out.
+Ports are assigned to listening Aton nodes first and then to ports
+nothing is bound to. List the current leases with
+
+python aton_ports.py
+"""
+
+import os
+import sys
+import json
+import errno
+import time
+import socket
+import argparse
+import tempfile
+import contextlib
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+__author__ = "Vahan Sosoyan"
+__copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
+__version__ = "1.3.7"
+
+
+ROLE_SERVER = "server"
+ROLE_CLIENT = "client"
+
+DEFAULT_PORT = 9201
+LEASE_TIME = 12 * 3600
+PORT_RANGE = 1000
+
+
+def registry_path():
+    """
+    Returns path of the registry file
+    @return: str
+    """
+    path = os.getenv("ATON_PORT_REGISTRY")
+    if path is None:
+        return os.path.join(tempfile.gettempdir(), "aton_ports.json")
+    return path
+
+
+def is_port_free(port):
+    """
+    Returns True if nothing is bound to the port on this machine
+    @param port: int
+    @return: bool
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        if os.name == "posix":
+            # Ports of closed connections in TIME_WAIT are free to listen on
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("", port))
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+def is_process_alive(pid):
+    """
+    Returns True if the process is running, unknown processes are kept alive
+    @param pid: int
+    @return: bool
+    """
+    if psutil is not None:
+        return psutil.pid_exists(pid)
+
+    if os.name != "posix":
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # Processes of other users can't be signalled
+        return e.errno == errno.EPERM
+    return True
+
+
+class PortRegistry(object):
+    """
+    Leases of ports stored in the registry file
+    """
+    def __init__(self, path=None, pid=None):
+        """
+        @param path: str: registry file, see registry_path
+        @param pid: int: process of the leases made, the current one by default
+        """
+        self.path = registry_path() if path is None else path
+        self.pid = os.getpid() if pid is None else pid
+
+    def leases(self, role=None):
+        """
+        Returns live leases sorted by port
+        @param role: str: ROLE_SERVER or ROLE_CLIENT, None for both
+        @return: list: dict
+        """
+        with self.__locked():
+            leases = self.__read()
+        return [i for i in leases if role is None or i["role"] == role]
+
+    def servers(self):
+        """
+        Returns ports of the listening Aton nodes which no other session has reserved
+        @return: list: int
+        """
+        return self.__servers(self.leases())
+
+    def lease(self, port, role, name="", lease_time=None):
+        """
+        Leases the port, replacing the lease of the same name or port of this process
+        @param port: int
+        @param role: str: ROLE_SERVER or ROLE_CLIENT
+        @param name: str: node or output the port is used by
+        @param lease_time: float: seconds, None lasts as long as the process
+        @return:
+        """
+        with self.__locked():
+            leases = [i for i in self.__read() if not self.__owns(i, role, name, port)]
+            leases.append({"port": port,
+                           "role": role,
+                           "name": name,
+                           "pid": self.pid,
+                           "expires": None if lease_time is None else time.time() + lease_time})
+            self.__write(leases)
+
+    def release(self, role=None, name=None, port=None):
+        """
+        Releases leases of this process, all of them if no name or port is given
+        @param role: str: ROLE_SERVER or ROLE_CLIENT, None for both
+        @param name: str
+        @param port: int
+        @return:
+        """
+        with self.__locked():
+            self.__write([i for i in self.__read() if
+                          i["pid"] != self.pid or
+                          role is not None and i["role"] != role or
+                          name is not None and i["name"] != name or
+                          port is not None and i["port"] != port])
+
+    def assign(self, names, start=DEFAULT_PORT, lease_time=LEASE_TIME):
+        """
+        Reserves a port for each name, preferring listening Aton nodes and
+        then ports which are neither leased nor bound from start on
+        @param names: list: str output names
+        @param start: int: first port to probe
+        @param lease_time: float: seconds
+        @return: list: int
+        """
+        with self.__locked():
+            # Servers are taken from the same read as the leases written below,
+            # so another session can't reserve them in between
+            leases = self.__read()
+            ports = self.__servers(leases)[:len(names)]
+            leased = set(i["port"] for i in leases if i["pid"] != self.pid)
+            port = start
+            while len(ports) < len(names) and port < start + PORT_RANGE:
+                if port not in leased and port not in ports and is_port_free(port):
+                    ports.append(port)
+                port += 1
+
+            if len(ports) < len(names):
+                raise RuntimeError("No free ports in %d-%d" % (start, start + PORT_RANGE))
+
+            leases = [i for i in leases if not (i["pid"] == self.pid and
+                                                i["role"] == ROLE_CLIENT and i["name"] in names)]
+            expires = time.time() + lease_time
+            for name, port in zip(names, ports):
+                leases.append({"port": port,
+                               "role": ROLE_CLIENT,
+                               "name": name,
+                               "pid": self.pid,
+                               "expires": expires})
+            self.__write(leases)
+        return ports
+
+    def __servers(self, leases):
+        """
+        Returns ports of the listening Aton nodes of the leases which no other session has reserved
+        @param leases: list: dict
+        @return: list: int
+        """
+        reserved = set(i["port"] for i in leases
+                       if i["role"] == ROLE_CLIENT and i["pid"] != self.pid)
+        return sorted(set(i["port"] for i in leases
+                          if i["role"] == ROLE_SERVER and i["port"] not in reserved))
+
+    def __owns(self, lease, role, name, port):
+        """
+        Returns True if the lease is of this process and the same role and name or port
+        @return: bool
+        """
+        return lease["pid"] == self.pid and lease["role"] == role and \
+            (lease["name"] == name if name else lease["port"] == port)
+
+    def __read(self):
+        """
+        Returns live leases of the registry file, has to be locked
+        @return: list: dict
+        """
+        try:
+            with open(self.path) as f:
+                leases = json.load(f)
+        except (IOError, OSError, ValueError):
+            return list()
+
+        now = time.time()
+        return sorted([i for i in leases if (i["expires"] is None or i["expires"] > now) and
+                       (i["pid"] == self.pid or is_process_alive(i["pid"]))],
+                      key=lambda i: i["port"])
+
+    def __write(self, leases):
+        """
+        Replaces the registry file, has to be locked
+        @param leases: list: dict
+        @return:
+        """
+        path = "%s.%d.tmp" % (self.path, self.pid)
+        with open(path, "w") as f:
+            json.dump(leases, f, indent=1)
+
+        if os.name != "posix" and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(path, self.path)
+
+    @contextlib.contextmanager
+    def __locked(self, timeout=5.0):
+        """
+        Locks the registry file with a lock directory, taking over locks older than timeout
+        @param timeout: float: seconds
+        @return:
+        """
+        lock = self.path + ".lock"
+        deadline = time.time() + timeout
+        while True:
+            try:
+                os.mkdir(lock)
+                break
+            except OSError:
+                if time.time() > deadline:
+                    try:
+                        if time.time() - os.path.getmtime(lock) > timeout:
+                            os.rmdir(lock)
+                            continue
+                    except OSError:
+                        continue
+                    raise RuntimeError("Port registry %s is locked" % self.path)
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            os.rmdir(lock)
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    @param argv: list
+    @return: int
+    """
+    parser = argparse.ArgumentParser(description="List ports leased by Aton sessions.")
+    parser.add_argument("--registry", help="registry file, see ATON_PORT_REGISTRY")
+    parser.add_argument("--json", action="store_true", help="print leases as JSON")
+    args = parser.parse_args(argv)
+
+    leases = PortRegistry(args.registry).leases()
+    if args.json:
+        json.dump(leases, sys.stdout, indent=4)
+        sys.stdout.write("\n")
+        return 0
+
+    for lease in leases:
+        expires = "process" if lease["expires"] is None else \
+            time.strftime("%H:%M:%S", time.localtime(lease["expires"]))
+        sys.stdout.write("Aton | %d | %s | %s | pid %d | until %s\n" %
+                         (lease["port"], lease["role"], lease["name"], lease["pid"], expires))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
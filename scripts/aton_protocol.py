@@ -0,0 +1,573 @@
+"""
+Aton wire protocol
+
+Python implementation of the messages written by Client::send_header,
+Client::send_pixels, Client::close_image and Client::quit of the
+driver_aton Arnold plugin. Every message starts with an int key followed
+by the message fields in host byte order:
+
+KEY_HEADER: session, xres, yres, pixel_aspect, region_area, version, frame,
+            camera_fov, camera_matrix[16], samples[6], output name size, output name
+KEY_PIXELS: session, xres, yres, bucket_xo, bucket_yo, bucket_size_x, bucket_size_y,
+            spp, ram, time, aov name size, aov name, pixels
+KEY_CLOSE:  no fields, the client disconnects afterwards
+KEY_QUIT:   no fields, the server stops listening
+
+Protocol v2 uses little-endian fixed size fields and frames every message
+with its payload size and type, so receivers can skip messages they don't
+want without decoding them. AOV names are sent once per connection in an
+AOV message and buckets only refer to their id:
+
+KEY_HEADER: HEADER_V2_STRUCT fields, output name
+KEY_AOV:    aov id, spp, encoding, aov name size, aov name
+            encoding is one of ENCODINGS and applies to all buckets of the AOV
+KEY_PIXELS: session, xres, yres, aov id, bucket_xo, bucket_yo, bucket_size_x,
+            bucket_size_y, spp, ram, time, flags, pixels
+            flags hold the compression codec and filters of the encoded pixels,
+            with FLAG_SHARED pixels are replaced by their SHM_REF_STRUCT
+KEY_SHM:    ring capacity, ring name size, ring name
+            pixels of the following buckets are written to this shared memory
+            ring instead of the socket, see aton_shm
+KEY_CLOSE:  no fields
+KEY_QUIT:   no fields
+
+A v2 client opens every connection with a hello, which is a v1 close key
+followed by HELLO_STRUCT. v1 servers drop the connection on the close key,
+so the client falls back to v1, v2 servers reply with their own hello.
+Clients reconnecting to a CAP_RESUME server send their hello with the
+capabilities negotiated before and HELLO_NO_REPLY, and don't wait for
+a reply.
+"""
+
+import os
+import struct
+
+import numpy as np
+
+
+__author__ = "Vahan Sosoyan"
+__copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
+__version__ = "1.3.7"
+
+
+KEY_HEADER = 0
+KEY_PIXELS = 1
+KEY_CLOSE = 2
+KEY_AOV = 3
+KEY_SHM = 4
+KEY_QUIT = 9
+
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+
+# AOV ids are used in place of AOV names on every bucket
+CAP_AOV_TABLE = 1
+# Pixels may use any of the ENCODINGS
+CAP_ENCODINGS = 2
+# Pixels may be compressed with the given codec, see aton_compression
+CAP_ZLIB = 4
+CAP_LZ4 = 8
+CAP_ZSTD = 16
+# Pixels may be passed in shared memory on the same host
+CAP_SHARED_MEMORY = 32
+# Reconnects may skip the hello reply and keep their ring announced without draining it,
+# the connections of a ring are read in order
+CAP_RESUME = 64
+CAPABILITIES = CAP_AOV_TABLE | CAP_ENCODINGS | CAP_ZLIB | CAP_LZ4 | CAP_ZSTD | \
+    CAP_SHARED_MEMORY | CAP_RESUME
+
+# Hello capabilities flag of reconnects to CAP_RESUME servers, see above
+HELLO_NO_REPLY = 0x80000000
+
+# Pixels message flags
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZ4 = 2
+COMPRESSION_ZSTD = 3
+FLAG_CODEC_MASK = 0xff
+FLAG_SHUFFLE = 0x100
+FLAG_DELTA = 0x200
+FLAG_SHARED = 0x400
+
+# Pixel encodings, 8 and 10 bit ones clamp to 0-1 and are meant for display only AOVs.
+# 10 bit samples are packed by three into little-endian 32 bit words
+ENCODING_FLOAT32 = 0
+ENCODING_FLOAT16 = 1
+ENCODING_UINT8 = 2
+ENCODING_UINT10 = 3
+
+ENCODINGS = {"float": ENCODING_FLOAT32,
+             "half": ENCODING_FLOAT16,
+             "8bit": ENCODING_UINT8,
+             "10bit": ENCODING_UINT10}
+
+HELLO_MAGIC = b"ATN2"
+
+KEY_STRUCT = struct.Struct("=i")
+
+# long long, int, int, float, long long, int, float, float, float[16], int[6], size_t
+HEADER_STRUCT = struct.Struct("=qiifqiff16f6iQ")
+
+# long long, int, int, int, int, int, int, int, long long, unsigned int, size_t
+PIXELS_STRUCT = struct.Struct("=qiiiiiiiqIQ")
+
+PIXEL_DTYPE = np.dtype("=f4")
+
+# magic, protocol version, capabilities
+HELLO_STRUCT = struct.Struct("<4sII")
+
+# payload size, message key
+FRAME_STRUCT = struct.Struct("<II")
+
+# Same fields as HEADER_STRUCT with an unsigned int name size
+HEADER_V2_STRUCT = struct.Struct("<qiifqiff16f6iI")
+
+# aov id, spp, encoding, name size
+AOV_V2_STRUCT = struct.Struct("<IIII")
+
+# long long, int, int, unsigned int, int, int, int, int, int, long long, unsigned int,
+# unsigned int
+PIXELS_V2_STRUCT = struct.Struct("<qiiIiiiiiqII")
+
+PIXEL_V2_DTYPE = np.dtype("<f4")
+
+# ring capacity, name size
+SHM_V2_STRUCT = struct.Struct("<QI")
+
+# ring position, size of the pixels in the ring
+SHM_REF_STRUCT = struct.Struct("<QQ")
+
+
+def get_host():
+    """
+    Returns a host name the same way as driver_aton
+    @return: str
+    """
+    return os.getenv("ATON_HOST", "127.0.0.1")
+
+
+def get_port():
+    """
+    Returns a port number the same way as driver_aton
+    @return: int
+    """
+    aton_port = os.getenv("ATON_PORT")
+
+    if aton_port is None:
+        return 9201
+    else:
+        return int(aton_port)
+
+
+def get_spp(channels):
+    """
+    Returns samples per pixel for the given channel count the same way as
+    driver_write_bucket does for Arnold pixel types, i.e. 1, 3 or 4
+    @param channels: int
+    @return: int
+    """
+    if channels == 1:
+        return 1
+    elif channels == 4:
+        return 4
+    return 3
+
+
+class DataHeader(object):
+    """
+    Image header sent once per driver_open
+    """
+    __slots__ = ("session", "xres", "yres", "pixel_aspect", "region_area", "version",
+                 "frame", "camera_fov", "camera_matrix", "samples", "output_name")
+
+    def __init__(self, session=0, xres=0, yres=0, pixel_aspect=1.0, region_area=0, version=0,
+                 frame=0.0, camera_fov=0.0, camera_matrix=None, samples=None, output_name=""):
+        """
+        @param session: int
+        @param xres: int
+        @param yres: int
+        @param pixel_aspect: float
+        @param region_area: int
+        @param version: int
+        @param frame: float
+        @param camera_fov: float
+        @param camera_matrix: list: float
+        @param samples: list: int
+        @param output_name: str
+        """
+        self.session = session
+        self.xres = xres
+        self.yres = yres
+        self.pixel_aspect = pixel_aspect
+        self.region_area = region_area
+        self.version = version
+        self.frame = frame
+        self.camera_fov = camera_fov
+        self.camera_matrix = list(camera_matrix or [float(i % 5 == 0) for i in range(16)])
+        self.samples = list(samples or [0] * 6)
+        self.output_name = output_name
+
+    def __repr__(self):
+        return "DataHeader(session=%d, res=%dx%d, frame=%g, output=%r)" % \
+               (self.session, self.xres, self.yres, self.frame, self.output_name)
+
+    def pack(self):
+        """
+        Packs the message including its key
+        @return: bytes
+        """
+        name = encode_name(self.output_name)
+        return KEY_STRUCT.pack(KEY_HEADER) + \
+            HEADER_STRUCT.pack(self.session, self.xres, self.yres, self.pixel_aspect,
+                               self.region_area, self.version, self.frame, self.camera_fov,
+                               *(self.camera_matrix + self.samples + [len(name)])) + name
+
+    def pack_v2(self):
+        """
+        Packs the protocol v2 message including its frame
+        @return: bytes
+        """
+        name = encode_name(self.output_name)
+        body = HEADER_V2_STRUCT.pack(self.session, self.xres, self.yres, self.pixel_aspect,
+                                     self.region_area, self.version, self.frame, self.camera_fov,
+                                     *(self.camera_matrix + self.samples + [len(name)])) + name
+        return FRAME_STRUCT.pack(len(body), KEY_HEADER) + body
+
+    @classmethod
+    def unpack(cls, fields, name):
+        """
+        Creates a header from the unpacked HEADER_STRUCT fields
+        @param fields: tuple
+        @param name: bytes
+        @return: DataHeader
+        """
+        return cls(fields[0], fields[1], fields[2], fields[3], fields[4], fields[5], fields[6],
+                   fields[7], fields[8:24], fields[24:30], decode_name(name))
+
+
+class DataPixels(object):
+    """
+    Bucket of pixels of a single AOV
+    """
+    __slots__ = ("session", "xres", "yres", "bucket_xo", "bucket_yo", "bucket_size_x",
+                 "bucket_size_y", "spp", "ram", "time", "aov_name", "data")
+
+    def __init__(self, session=0, xres=0, yres=0, bucket_xo=0, bucket_yo=0, bucket_size_x=0,
+                 bucket_size_y=0, spp=0, ram=0, time=0, aov_name="", data=None):
+        """
+        @param session: int
+        @param xres: int
+        @param yres: int
+        @param bucket_xo: int
+        @param bucket_yo: int
+        @param bucket_size_x: int
+        @param bucket_size_y: int
+        @param spp: int
+        @param ram: int
+        @param time: int
+        @param aov_name: str
+        @param data: numpy.ndarray: (bucket_size_y, bucket_size_x, spp) float32
+        """
+        self.session = session
+        self.xres = xres
+        self.yres = yres
+        self.bucket_xo = bucket_xo
+        self.bucket_yo = bucket_yo
+        self.bucket_size_x = bucket_size_x
+        self.bucket_size_y = bucket_size_y
+        self.spp = spp
+        self.ram = ram
+        self.time = time
+        self.aov_name = aov_name
+        self.data = data
+
+    def __repr__(self):
+        return "DataPixels(session=%d, aov=%r, bucket=(%d, %d, %d, %d), spp=%d)" % \
+               (self.session, self.aov_name, self.bucket_xo, self.bucket_yo,
+                self.bucket_size_x, self.bucket_size_y, self.spp)
+
+    @property
+    def num_samples(self):
+        """
+        Returns number of floats in the bucket
+        @return: int
+        """
+        return self.bucket_size_x * self.bucket_size_y * self.spp
+
+    @property
+    def rect(self):
+        """
+        Returns bucket rectangle as x, y, width, height
+        @return: tuple
+        """
+        return self.bucket_xo, self.bucket_yo, self.bucket_size_x, self.bucket_size_y
+
+    def pack_header(self):
+        """
+        Packs the message fields preceding the pixels including its key
+        @return: bytes
+        """
+        name = encode_name(self.aov_name)
+        return KEY_STRUCT.pack(KEY_PIXELS) + \
+            PIXELS_STRUCT.pack(self.session, self.xres, self.yres, self.bucket_xo, self.bucket_yo,
+                               self.bucket_size_x, self.bucket_size_y, self.spp, self.ram,
+                               self.time, len(name)) + name
+
+    def pack(self):
+        """
+        Packs the whole message
+        @return: bytes
+        """
+        return self.pack_header() + pixels_buffer(self.data).tobytes()
+
+    def pack_header_v2(self, aov_id, flags=0, size=None):
+        """
+        Packs the protocol v2 frame and fields preceding the pixels
+        @param aov_id: int
+        @param flags: int
+        @param size: int: pixels size in bytes, default is num_samples floats
+        @return: bytes
+        """
+        if size is None:
+            size = self.num_samples * PIXEL_V2_DTYPE.itemsize
+        return FRAME_STRUCT.pack(PIXELS_V2_STRUCT.size + size, KEY_PIXELS) + \
+            PIXELS_V2_STRUCT.pack(self.session, self.xres, self.yres, aov_id, self.bucket_xo,
+                                  self.bucket_yo, self.bucket_size_x, self.bucket_size_y,
+                                  self.spp, self.ram, self.time, flags)
+
+    @classmethod
+    def unpack(cls, fields, name, data=None):
+        """
+        Creates pixels from the unpacked PIXELS_STRUCT fields
+        @param fields: tuple
+        @param name: bytes
+        @param data: numpy.ndarray
+        @return: DataPixels
+        """
+        return cls(fields[0], fields[1], fields[2], fields[3], fields[4], fields[5],
+                   fields[6], fields[7], fields[8], fields[9], decode_name(name), data)
+
+    @classmethod
+    def unpack_v2(cls, fields, aov_name, data=None):
+        """
+        Creates pixels from the unpacked PIXELS_V2_STRUCT fields
+        @param fields: tuple
+        @param aov_name: str: name of the AOV id in fields[3]
+        @param data: numpy.ndarray
+        @return: DataPixels
+        """
+        return cls(fields[0], fields[1], fields[2], fields[4], fields[5], fields[6],
+                   fields[7], fields[8], fields[9], fields[10], aov_name, data)
+
+
+def encode_name(name):
+    """
+    Encodes a name as a null terminated string
+    @param name: str
+    @return: bytes
+    """
+    if not isinstance(name, bytes):
+        name = name.encode("utf-8")
+    return name + b"\0"
+
+
+def decode_name(data):
+    """
+    Decodes a null terminated string
+    @param data: bytes
+    @return: str
+    """
+    return bytes(data).split(b"\0", 1)[0].decode("utf-8", "replace")
+
+
+def pixels_view(buf, width, height, spp):
+    """
+    Returns a (height, width, spp) float32 view into buf without copying
+    @param buf: bytearray or memoryview
+    @param width: int
+    @param height: int
+    @param spp: int
+    @return: numpy.ndarray
+    """
+    return np.frombuffer(buf, PIXEL_DTYPE, width * height * spp).reshape(height, width, spp)
+
+
+def pixels_buffer(data, dtype=PIXEL_DTYPE):
+    """
+    Returns the pixels as a C-contiguous float32 array, copying only if needed
+    @param data: numpy.ndarray
+    @param dtype: numpy.dtype: PIXEL_V2_DTYPE for protocol v2
+    @return: numpy.ndarray
+    """
+    return np.ascontiguousarray(data, dtype)
+
+
+def parse_encodings(spec):
+    """
+    Parses the encodings driver parameter, i.e. space separated AOV=encoding
+    pairs where * sets the default, e.g. "*=half Z=float crypto=float"
+    @param spec: str
+    @return: dict: aov name: encoding, default under "*"
+    """
+    encodings = dict()
+    for item in (spec or "").split():
+        name, _, encoding = item.partition("=")
+        if encoding not in ENCODINGS:
+            raise ValueError("Unknown encoding %r for %s, use one of %s" %
+                             (encoding, name, ", ".join(sorted(ENCODINGS))))
+        encodings[name] = ENCODINGS[encoding]
+    return encodings
+
+
+def encoded_size(num_samples, encoding):
+    """
+    Returns size in bytes of the encoded pixels
+    @param num_samples: int
+    @param encoding: int
+    @return: int
+    """
+    if encoding == ENCODING_FLOAT16:
+        return num_samples * 2
+    elif encoding == ENCODING_UINT8:
+        return num_samples
+    elif encoding == ENCODING_UINT10:
+        return (num_samples + 2) // 3 * 4
+    return num_samples * PIXEL_V2_DTYPE.itemsize
+
+
+def encoding_itemsize(encoding):
+    """
+    Returns bytes per encoded sample, 10 bit samples count by words
+    @param encoding: int
+    @return: int
+    """
+    if encoding == ENCODING_FLOAT16:
+        return 2
+    elif encoding == ENCODING_UINT8:
+        return 1
+    return 4
+
+
+def encode_pixels(data, encoding):
+    """
+    Encodes float pixels for protocol v2
+    @param data: numpy.ndarray
+    @param encoding: int
+    @return: numpy.ndarray
+    """
+    if encoding == ENCODING_FLOAT16:
+        with np.errstate(over="ignore"):
+            return np.ascontiguousarray(data, "<f2")
+
+    if encoding in (ENCODING_UINT8, ENCODING_UINT10):
+        levels = 255 if encoding == ENCODING_UINT8 else 1023
+        samples = np.nan_to_num(np.array(data, np.float32).ravel(), copy=False)
+        np.clip(samples, 0.0, 1.0, out=samples)
+        samples *= levels
+        samples += 0.5
+
+        if encoding == ENCODING_UINT8:
+            return samples.astype(np.uint8)
+
+        words = np.zeros(((samples.size + 2) // 3, 3), "<u4")
+        words.ravel()[:samples.size] = samples
+        return words[:, 0] | (words[:, 1] << 10) | (words[:, 2] << 20)
+
+    return pixels_buffer(data, PIXEL_V2_DTYPE)
+
+
+def decode_pixels(buf, encoding, num_samples, out=None):
+    """
+    Decodes protocol v2 pixels into float32 samples
+    @param buf: bytes-like
+    @param encoding: int
+    @param num_samples: int
+    @param out: numpy.ndarray: float32 array of num_samples to decode into
+    @return: numpy.ndarray
+    """
+    if encoding == ENCODING_FLOAT32:
+        data = np.frombuffer(buf, PIXEL_V2_DTYPE, num_samples)
+        if out is None:
+            return data
+        np.copyto(out, data)
+        return out
+
+    if out is None:
+        out = np.empty(num_samples, PIXEL_DTYPE)
+
+    if encoding == ENCODING_FLOAT16:
+        np.copyto(out, np.frombuffer(buf, "<f2", num_samples))
+
+    elif encoding == ENCODING_UINT8:
+        np.multiply(np.frombuffer(buf, np.uint8, num_samples), np.float32(1.0 / 255), out=out)
+
+    elif encoding == ENCODING_UINT10:
+        words = np.frombuffer(buf, "<u4", (num_samples + 2) // 3)
+        samples = np.empty((words.size, 3), np.uint32)
+        for i in range(3):
+            np.right_shift(words, 10 * i, out=samples[:, i])
+        samples &= 0x3ff
+        np.multiply(samples.ravel()[:num_samples], np.float32(1.0 / 1023), out=out)
+
+    else:
+        raise ValueError("Unknown pixel encoding %d" % encoding)
+
+    return out
+
+
+def quit_message(protocol=PROTOCOL_V1):
+    """
+    Returns the message stopping a server
+    @param protocol: int
+    @return: bytes
+    """
+    if protocol >= PROTOCOL_V2:
+        return FRAME_STRUCT.pack(0, KEY_QUIT)
+    return KEY_STRUCT.pack(KEY_QUIT)
+
+
+def close_message(protocol=PROTOCOL_V1):
+    """
+    Returns the message closing an image
+    @param protocol: int
+    @return: bytes
+    """
+    if protocol >= PROTOCOL_V2:
+        return FRAME_STRUCT.pack(0, KEY_CLOSE)
+    return KEY_STRUCT.pack(KEY_CLOSE)
+
+
+def hello_message(protocol=PROTOCOL_V2, capabilities=CAPABILITIES):
+    """
+    Returns the hello opening a protocol v2 connection
+    @param protocol: int
+    @param capabilities: int
+    @return: bytes
+    """
+    return KEY_STRUCT.pack(KEY_CLOSE) + HELLO_STRUCT.pack(HELLO_MAGIC, protocol, capabilities)
+
+
+def shm_message(name, capacity):
+    """
+    Returns the protocol v2 message announcing a shared memory ring
+    @param name: str
+    @param capacity: int
+    @return: bytes
+    """
+    name = encode_name(name)
+    body = SHM_V2_STRUCT.pack(capacity, len(name)) + name
+    return FRAME_STRUCT.pack(len(body), KEY_SHM) + body
+
+
+def aov_message(aov_id, aov_name, spp, encoding=0):
+    """
+    Returns the protocol v2 message assigning an id to an AOV
+    @param aov_id: int
+    @param aov_name: str
+    @param spp: int
+    @param encoding: int
+    @return: bytes
+    """
+    name = encode_name(aov_name)
+    body = AOV_V2_STRUCT.pack(aov_id, spp, encoding, len(name)) + name
+    return FRAME_STRUCT.pack(len(body), KEY_AOV) + body
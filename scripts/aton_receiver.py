@@ -0,0 +1,703 @@
+"""
+Aton Receiver
+
+Headless asyncio server decoding the driver_aton stream, the same way as
+the fb_writer thread of the Nuke node does, but serving any number of
+driver connections concurrently. Every connection reads into preallocated
+buffers which are reused for the next message, buckets are passed to the
+handler as NumPy views into those buffers. A handler has to copy the
+pixels it wants to keep after its callback returns. Both protocol versions
+are accepted, buckets of AOVs rejected by Handler.accept_aov are skipped
+without being decoded. Compressed buckets are accepted for every codec
+available in this Python, see aton_compression, and clients on the same
+host pass their pixels through shared memory, see aton_shm.
+
+Monitor incoming renders from the command line
+
+python aton_receiver.py --port 9201
+
+or use it from Python
+
+import asyncio
+from aton_receiver import Receiver, Handler
+
+class Printer(Handler):
+    def pixels(self, connection, pixels):
+        print(pixels.aov_name, pixels.data.mean())
+
+asyncio.run(Receiver(Printer()).serve_forever())
+"""
+
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import inspect
+import collections
+
+import numpy as np
+
+from aton_protocol import (KEY_HEADER, KEY_PIXELS, KEY_CLOSE, KEY_AOV, KEY_SHM, KEY_QUIT,
+                           KEY_STRUCT, HEADER_STRUCT, PIXELS_STRUCT, PIXEL_DTYPE, PROTOCOL_V1,
+                           PROTOCOL_V2, CAPABILITIES, CAP_RESUME, HELLO_MAGIC, HELLO_NO_REPLY,
+                           HELLO_STRUCT, FRAME_STRUCT,
+                           HEADER_V2_STRUCT, AOV_V2_STRUCT, PIXELS_V2_STRUCT, ENCODING_FLOAT32,
+                           DataHeader, SHM_V2_STRUCT, SHM_REF_STRUCT, COMPRESSION_NONE,
+                           FLAG_CODEC_MASK, FLAG_SHARED, DataPixels, get_port, decode_name,
+                           decode_pixels, encoded_size, encoding_itemsize, pixels_view)
+from aton_compression import Codec, capabilities
+from aton_shm import SharedRing, capabilities as shm_capabilities
+
+
+__author__ = "Vahan Sosoyan"
+__copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
+__version__ = "1.3.7"
+
+
+# Rings kept mapped for reconnecting clients
+MAX_RINGS = 8
+
+
+class Handler(object):
+    """
+    Receiver callbacks to be implemented in sub-classes,
+    any of them may also be a coroutine
+    """
+    def accept_aov(self, connection, aov_name):
+        """
+        Returns False to skip the buckets of the given AOV, must not be a coroutine
+        @param connection: Connection
+        @param aov_name: str
+        @return: bool
+        """
+        return True
+
+    def header(self, connection, header):
+        """
+        Called when an image is opened
+        @param connection: Connection
+        @param header: DataHeader
+        @return:
+        """
+        pass
+
+    def pixels(self, connection, pixels):
+        """
+        Called for every bucket, pixels.data is only valid during the call
+        @param connection: Connection
+        @param pixels: DataPixels
+        @return:
+        """
+        pass
+
+    def close(self, connection):
+        """
+        Called when the client has closed the image
+        @param connection: Connection
+        @return:
+        """
+        pass
+
+    def quit(self, connection):
+        """
+        Called when the client asks the server to stop, the receiver stops unless it returns False
+        @param connection: Connection
+        @return: bool
+        """
+        return True
+
+    def disconnected(self, connection):
+        """
+        Called when the connection has been closed
+        @param connection: Connection
+        @return:
+        """
+        pass
+
+
+class Connection(object):
+    """
+    Single driver connection and its receive buffers
+    """
+    def __init__(self, receiver, sock, address):
+        """
+        @param receiver: Receiver
+        @param sock: socket.socket
+        @param address: tuple
+        """
+        self.receiver = receiver
+        self.sock = sock
+        self.address = address
+        self.session = None
+        self.protocol = PROTOCOL_V1
+        self.capabilities = 0
+        self.aovs = dict()
+        self.messages = 0
+        self.bytes = 0
+
+        self._loop = asyncio.get_event_loop()
+        self._key = bytearray(KEY_STRUCT.size)
+        self._fields = bytearray(max(HEADER_STRUCT.size, PIXELS_STRUCT.size, HELLO_STRUCT.size,
+                                     FRAME_STRUCT.size, HEADER_V2_STRUCT.size, AOV_V2_STRUCT.size,
+                                     PIXELS_V2_STRUCT.size, SHM_V2_STRUCT.size,
+                                     SHM_REF_STRUCT.size))
+        self._name = bytearray(256)
+        self._pixels = bytearray(64 * 64 * 4 * PIXEL_DTYPE.itemsize)
+        self._decoded = bytearray(len(self._pixels))
+        self._pending = 0
+        self._encoding = ENCODING_FLOAT32
+        self._flags = COMPRESSION_NONE
+        self._codec = None
+        self._ring = None
+        self._shared = None
+
+        # Done once closed, later connections of its ring wait for it
+        self.closed = self._loop.create_future()
+
+    def __repr__(self):
+        return "Connection(%s:%d)" % self.address[:2]
+
+    async def read_into(self, view):
+        """
+        Reads exactly len(view) bytes into the given buffer
+        @param view: memoryview
+        @return:
+        """
+        size = len(view)
+        position = 0
+        while position < size:
+            count = await self._loop.sock_recv_into(self.sock, view[position:])
+            if not count:
+                raise EOFError("Connection closed by %s" % self)
+            position += count
+        self.bytes += size
+
+    async def read_key(self):
+        """
+        Reads message key
+        @return: int
+        """
+        await self.read_into(memoryview(self._key))
+        return KEY_STRUCT.unpack(self._key)[0]
+
+    async def read_fields(self, fields_struct):
+        """
+        Reads the fixed size message fields
+        @param fields_struct: struct.Struct
+        @return: tuple
+        """
+        view = memoryview(self._fields)[:fields_struct.size]
+        await self.read_into(view)
+        return fields_struct.unpack(view)
+
+    async def read_name(self, size):
+        """
+        Reads a null terminated name
+        @param size: int
+        @return: memoryview
+        """
+        if size > len(self._name):
+            self._name = bytearray(size)
+        view = memoryview(self._name)[:size]
+        await self.read_into(view)
+        return view
+
+    async def read_frame(self):
+        """
+        Reads protocol v2 message frame
+        @return: tuple: key, payload size
+        """
+        size, key = await self.read_fields(FRAME_STRUCT)
+        return key, size
+
+    async def read_hello(self):
+        """
+        Reads the rest of a protocol v2 hello following a close key and
+        replies with the negotiated version. Returns False if the client
+        has disconnected, i.e. it was an actual close message
+        @return: bool
+        """
+        try:
+            magic, version, capabilities = await self.read_fields(HELLO_STRUCT)
+        except EOFError:
+            return False
+
+        if magic != HELLO_MAGIC:
+            raise ValueError("Invalid hello from %s" % self)
+
+        self.protocol = min(version, PROTOCOL_V2)
+        self.capabilities = capabilities & CAPABILITIES & self.receiver.capabilities
+
+        # Reconnecting clients already know the capabilities
+        if capabilities & HELLO_NO_REPLY:
+            return True
+        await self.send(HELLO_STRUCT.pack(HELLO_MAGIC, self.protocol, self.capabilities))
+        return True
+
+    async def read_header(self):
+        """
+        Reads the header message following KEY_HEADER
+        @return: DataHeader
+        """
+        if self.protocol >= PROTOCOL_V2:
+            fields = await self.read_fields(HEADER_V2_STRUCT)
+        else:
+            fields = await self.read_fields(HEADER_STRUCT)
+        name = await self.read_name(fields[-1])
+        return DataHeader.unpack(fields, name)
+
+    async def read_aov(self):
+        """
+        Reads the protocol v2 AOV message following KEY_AOV
+        @return: tuple: aov name, spp, encoding
+        """
+        aov_id, spp, encoding, size = await self.read_fields(AOV_V2_STRUCT)
+        name = await self.read_name(size)
+        self.aovs[aov_id] = aov = (decode_name(name), spp, encoding)
+        return aov
+
+    async def read_shm(self):
+        """
+        Reads the protocol v2 message following KEY_SHM and attaches to its ring
+        @return: SharedRing
+        """
+        capacity, size = await self.read_fields(SHM_V2_STRUCT)
+        name = decode_name(await self.read_name(size))
+
+        self._ring = self.receiver.attach_ring(self, name)
+        return self._ring
+
+    async def read_pixels(self, size=None):
+        """
+        Reads the pixels message following KEY_PIXELS without its pixels,
+        which have to be read with read_pixels_data or skipped with skip_pixels_data
+        @param size: int: v2 payload size
+        @return: DataPixels
+        """
+        if self.protocol >= PROTOCOL_V2:
+            fields = await self.read_fields(PIXELS_V2_STRUCT)
+            if fields[3] not in self.aovs:
+                raise ValueError("Unknown aov id %d from %s" % (fields[3], self))
+            aov_name, _, self._encoding = self.aovs[fields[3]]
+            self._flags = fields[11]
+            self._pending = size - PIXELS_V2_STRUCT.size
+            pixels = DataPixels.unpack_v2(fields, aov_name)
+
+            if self._flags & FLAG_SHARED:
+                self._shared = await self.read_fields(SHM_REF_STRUCT)
+                self._pending = 0
+            return pixels
+
+        fields = await self.read_fields(PIXELS_STRUCT)
+        name = await self.read_name(fields[-1])
+        self._pending = fields[5] * fields[6] * fields[7] * PIXEL_DTYPE.itemsize
+        return DataPixels.unpack(fields, name)
+
+    async def read_pixels_data(self, pixels):
+        """
+        Reads the pixels of the last pixels message into pixels.data
+        @param pixels: DataPixels
+        @return: DataPixels
+        """
+        width, height, spp = pixels.bucket_size_x, pixels.bucket_size_y, pixels.spp
+
+        if self._shared is not None:
+            await self.receiver.ring_turn(self)
+            data = self._ring.view(*self._shared)
+            pixels.data = decode_pixels(data, self._encoding, pixels.num_samples,
+                                        None if self._encoding == ENCODING_FLOAT32 else
+                                        self.decode_buffer(pixels.num_samples))
+            pixels.data = pixels.data.reshape(height, width, spp)
+            return pixels
+
+        size, self._pending = self._pending, 0
+        if size > len(self._pixels):
+            self._pixels = bytearray(size)
+        await self.read_into(memoryview(self._pixels)[:size])
+
+        if self.protocol < PROTOCOL_V2:
+            pixels.data = pixels_view(self._pixels, width, height, spp)
+            return pixels
+
+        num_samples = pixels.num_samples
+        data = self._pixels
+        if self._flags & FLAG_CODEC_MASK:
+            if self._codec is None:
+                self._codec = Codec()
+            data = self._codec.decompress(memoryview(data)[:size], self._flags,
+                                          encoded_size(num_samples, self._encoding),
+                                          encoding_itemsize(self._encoding))
+
+        if self._encoding != ENCODING_FLOAT32:
+            out = decode_pixels(data, self._encoding, num_samples, self.decode_buffer(num_samples))
+            pixels.data = out.reshape(height, width, spp)
+        else:
+            pixels.data = decode_pixels(data, self._encoding,
+                                        num_samples).reshape(height, width, spp)
+        return pixels
+
+    def decode_buffer(self, num_samples):
+        """
+        Returns the reused float32 array to decode pixels into
+        @param num_samples: int
+        @return: numpy.ndarray
+        """
+        if num_samples * PIXEL_DTYPE.itemsize > len(self._decoded):
+            self._decoded = bytearray(num_samples * PIXEL_DTYPE.itemsize)
+        return np.frombuffer(self._decoded, PIXEL_DTYPE, num_samples)
+
+    def release_pixels(self):
+        """
+        Releases the shared memory of the last pixels message once they have been handled
+        @return:
+        """
+        if self._shared is not None:
+            self._ring.release(*self._shared)
+            self._shared = None
+
+    async def skip_pixels_data(self):
+        """
+        Discards the pixels of the last pixels message
+        @return:
+        """
+        if self._shared is not None:
+            await self.receiver.ring_turn(self)
+        self.release_pixels()
+        size, self._pending = self._pending, 0
+        await self.skip(size)
+
+    async def skip(self, size):
+        """
+        Discards the given number of bytes
+        @param size: int
+        @return:
+        """
+        view = memoryview(self._pixels)
+        while size:
+            count = min(size, len(view))
+            await self.read_into(view[:count])
+            size -= count
+
+    def send(self, data):
+        """
+        Writes back to the client
+        @param data: bytes
+        @return: asyncio.Future
+        """
+        return self._loop.sock_sendall(self.sock, data)
+
+    def close_ring(self):
+        """
+        Stops reading the shared memory ring, which is unmapped once no
+        other connection reads it, the client removes it after closing the image
+        @return:
+        """
+        if self._ring is not None:
+            self.receiver.detach_ring(self, True)
+            self._ring = None
+
+    def close(self):
+        """
+        Closes the connection, its ring stays mapped for reconnects
+        @return:
+        """
+        self.sock.close()
+        if self._ring is not None:
+            self.receiver.detach_ring(self)
+            self._ring = None
+        if not self.closed.done():
+            self.closed.set_result(True)
+
+
+class Receiver(object):
+    """
+    Listening asyncio server accepting driver_aton connections
+    """
+    def __init__(self, handler=None, host="", port=None, search=False):
+        """
+        @param handler: Handler
+        @param host: str
+        @param port: int
+        @param search: bool: try the next 99 ports if the given one is taken
+        """
+        self.handler = handler or Handler()
+        self.host = host
+        self.port = get_port() if port is None else port
+        self.search = search
+        self.sessions = dict()
+        self.connections = set()
+        self.capabilities = capabilities() | shm_capabilities() | CAP_RESUME
+
+        # Shared memory rings by name and the connections reading them in order
+        self._rings = collections.OrderedDict()
+
+        self._sock = None
+        self._closed = None
+
+    def listen(self):
+        """
+        Binds the listening socket, returns the port
+        @return: int
+        """
+        start_port = self.port
+        last_port = start_port + (99 if self.search else 1)
+
+        for port in range(start_port, last_port):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                sock.bind((self.host, port))
+            except OSError:
+                sock.close()
+                continue
+
+            sock.listen(128)
+            sock.setblocking(False)
+            self._sock = sock
+            self.port = sock.getsockname()[1]
+            return self.port
+
+        raise RuntimeError("Failed to connect to port: %d" % start_port if not self.search else
+                           "Failed to connect to port: %d-%d" % (start_port, last_port - 1))
+
+    async def serve_forever(self):
+        """
+        Accepts connections until closed or a quit message has been received
+        @return:
+        """
+        if self._sock is None:
+            self.listen()
+
+        loop = asyncio.get_event_loop()
+        self._closed = loop.create_future()
+        accept = None
+
+        try:
+            while not self._closed.done():
+                accept = asyncio.ensure_future(loop.sock_accept(self._sock))
+                await asyncio.wait((accept, self._closed), return_when=asyncio.FIRST_COMPLETED)
+
+                if accept.done():
+                    sock, address = accept.result()
+                    sock.setblocking(False)
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    asyncio.ensure_future(self.serve_connection(Connection(self, sock, address)))
+        finally:
+            if accept is not None and not accept.done():
+                accept.cancel()
+            self._sock.close()
+            self._sock = None
+
+            for connection in list(self.connections):
+                connection.close()
+            for ring, _ in self._rings.values():
+                ring.close()
+            self._rings.clear()
+
+    def attach_ring(self, connection, name):
+        """
+        Returns the ring announced on the connection, mapping it only once
+        for all reconnects of its client
+        @param connection: Connection
+        @param name: str
+        @return: SharedRing
+        """
+        if connection._ring is not None and connection._ring.name != name:
+            self.detach_ring(connection)
+
+        if name not in self._rings:
+            self._rings[name] = SharedRing.attach(name), list()
+            # Unmap rings of clients which are gone
+            for old_name, (ring, readers) in list(self._rings.items())[:-MAX_RINGS]:
+                if not readers:
+                    ring.close()
+                    del self._rings[old_name]
+        self._rings.move_to_end(name)
+
+        ring, readers = self._rings[name]
+        if connection not in readers:
+            readers.append(connection)
+        return ring
+
+    def detach_ring(self, connection, unmap=False):
+        """
+        Stops the connection reading its ring, letting the next connection read it
+        @param connection: Connection
+        @param unmap: bool: unmap the ring if no other connection reads it
+        @return:
+        """
+        name = connection._ring.name
+        ring, readers = self._rings.get(name, (None, list()))
+        if connection in readers:
+            readers.remove(connection)
+        if unmap and ring is not None and not readers:
+            ring.close()
+            del self._rings[name]
+
+    async def ring_turn(self, connection):
+        """
+        Waits until the earlier connections of the ring have been closed, a
+        reconnecting client doesn't wait for them to release their pixels
+        @param connection: Connection
+        @return:
+        """
+        readers = self._rings[connection._ring.name][1]
+        while readers[0] is not connection:
+            await asyncio.shield(readers[0].closed)
+
+    def close(self):
+        """
+        Stops accepting connections
+        @return:
+        """
+        if self._closed is not None and not self._closed.done():
+            self._closed.set_result(True)
+
+    async def dispatch(self, callback, *args):
+        """
+        Calls the handler callback and awaits it if needed
+        @param callback: function
+        @param args: list
+        @return: callback result
+        """
+        result = callback(*args)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def serve_connection(self, connection):
+        """
+        Reads messages from a single connection
+        @param connection: Connection
+        @return:
+        """
+        self.connections.add(connection)
+        handler = self.handler
+
+        try:
+            while True:
+                try:
+                    if connection.protocol >= PROTOCOL_V2:
+                        key, size = await connection.read_frame()
+                    else:
+                        key, size = await connection.read_key(), None
+                except (EOFError, OSError):
+                    break
+
+                connection.messages += 1
+
+                if key == KEY_HEADER:
+                    header = await connection.read_header()
+                    connection.session = header.session
+                    self.sessions[header.session] = header
+                    await self.dispatch(handler.header, connection, header)
+
+                elif key == KEY_PIXELS:
+                    pixels = await connection.read_pixels(size)
+                    connection.session = pixels.session
+                    if handler.accept_aov(connection, pixels.aov_name):
+                        await connection.read_pixels_data(pixels)
+                        await self.dispatch(handler.pixels, connection, pixels)
+                        pixels.data = None
+                        connection.release_pixels()
+                    else:
+                        await connection.skip_pixels_data()
+
+                elif key == KEY_AOV and connection.protocol >= PROTOCOL_V2:
+                    await connection.read_aov()
+
+                elif key == KEY_SHM and connection.protocol >= PROTOCOL_V2:
+                    await connection.read_shm()
+
+                elif key == KEY_CLOSE:
+                    # A close key opening the connection may be a protocol v2 hello
+                    if connection.messages == 1 and connection.protocol == PROTOCOL_V1 and \
+                            await connection.read_hello():
+                        continue
+                    await self.dispatch(handler.close, connection)
+                    connection.close_ring()
+                    break
+
+                elif key == KEY_QUIT:
+                    if await self.dispatch(handler.quit, connection) is not False:
+                        self.close()
+                    break
+
+                elif connection.protocol >= PROTOCOL_V2:
+                    # Unknown messages are skipped by their frame size
+                    await connection.skip(size)
+
+                else:
+                    raise ValueError("Unknown message key %d from %s" % (key, connection))
+
+        except (EOFError, OSError):
+            pass
+        except ValueError as e:
+            # Malformed streams drop only their own connection
+            sys.stderr.write("Aton | %s\n" % e)
+        finally:
+            connection.close()
+            self.connections.discard(connection)
+            await self.dispatch(handler.disconnected, connection)
+
+
+class MonitorHandler(Handler):
+    """
+    Prints incoming images and bucket throughput
+    """
+    def __init__(self, interval=1.0, stream=sys.stdout):
+        """
+        @param interval: float: seconds between throughput reports
+        @param stream: file
+        """
+        self.interval = interval
+        self.stream = stream
+        self.buckets = 0
+        self.bytes = 0
+        self._time = time.time()
+
+    def header(self, connection, header):
+        self.stream.write("Aton | %s | %r\n" % (connection, header))
+
+    def pixels(self, connection, pixels):
+        self.buckets += 1
+        self.bytes += pixels.data.nbytes
+
+        now = time.time()
+        if now - self._time >= self.interval:
+            elapsed = now - self._time
+            self.stream.write("Aton | %d sessions | %.1f buckets/s | %.2f MB/s\n" %
+                              (len(connection.receiver.sessions), self.buckets / elapsed,
+                               self.bytes / elapsed / 1e6))
+            self.buckets = self.bytes = 0
+            self._time = now
+
+    def close(self, connection):
+        self.stream.write("Aton | %s | image closed\n" % connection)
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    @param argv: list
+    @return: int
+    """
+    parser = argparse.ArgumentParser(description="Receive and monitor Aton driver streams.")
+    parser.add_argument("--host", default="", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=get_port(), help="port to listen on")
+    parser.add_argument("--search", action="store_true", help="use next free port if taken")
+    args = parser.parse_args(argv)
+
+    receiver = Receiver(MonitorHandler(), args.host, args.port, args.search)
+    receiver.listen()
+    sys.stdout.write("Aton | Listening on port %d\n" % receiver.port)
+
+    try:
+        asyncio.run(receiver.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
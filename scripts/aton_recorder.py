@@ -0,0 +1,169 @@
+"""
+Aton Recorder
+
+Proxy sitting between driver_aton and the Aton node. Every driver
+connection is forwarded to the target port while its headers, buckets and
+close messages are appended to a capture, which can later be replayed or
+sliced by frame and AOV with aton_capture.Capture. Quit messages are
+forwarded without stopping the recorder.
+
+Messages are decoded and packed again rather than forwarded byte for byte,
+both the capture and the forwarded stream use protocol v1 with float
+pixels, whichever version, encoding or transport the driver uses.
+
+Point the driver to the recorder port and record the render
+
+python aton_recorder.py session.aton --port 9301 --target-port 9201
+
+Without a target the recorder only writes the capture.
+"""
+
+import sys
+import time
+import socket
+import asyncio
+import argparse
+
+from aton_protocol import get_host, get_port, pixels_buffer, close_message, quit_message
+from aton_receiver import Receiver, Handler
+from aton_capture import CaptureWriter
+
+
+__author__ = "Vahan Sosoyan"
+__copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
+__version__ = "1.3.7"
+
+
+class RecorderHandler(Handler):
+    """
+    Writes incoming messages to a capture and forwards them to the target
+    """
+    def __init__(self, writer, target_host=None, target_port=None, flush_interval=1.0):
+        """
+        @param writer: CaptureWriter
+        @param target_host: str
+        @param target_port: int: None disables forwarding
+        @param flush_interval: float: seconds between capture flushes
+        """
+        self.writer = writer
+        self.target_host = get_host() if target_host is None else target_host
+        self.target_port = target_port
+        self.flush_interval = flush_interval
+
+        self._upstreams = dict()
+        self._connections = dict()
+        self._connection_count = writer.next_connection
+        self._flush_time = time.time()
+
+    def connection_id(self, connection):
+        """
+        Returns the capture number of the given connection
+        @param connection: Connection
+        @return: int
+        """
+        if connection not in self._connections:
+            self._connections[connection] = self._connection_count
+            self._connection_count += 1
+        return self._connections[connection]
+
+    async def forward(self, connection, *buffers):
+        """
+        Writes the buffers to the upstream of the given connection,
+        connecting on its first message
+        @param connection: Connection
+        @param buffers: list: bytes-like
+        @return:
+        """
+        if self.target_port is None:
+            return
+
+        loop = asyncio.get_event_loop()
+        upstream = self._upstreams.get(connection)
+
+        if upstream is None:
+            upstream = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            upstream.setblocking(False)
+            upstream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                await loop.sock_connect(upstream, (self.target_host, self.target_port))
+            except OSError:
+                upstream.close()
+                raise
+            self._upstreams[connection] = upstream
+
+        for buf in buffers:
+            await loop.sock_sendall(upstream, memoryview(buf).cast("B"))
+
+    def record(self):
+        """
+        Flushes the capture every flush_interval seconds
+        @return:
+        """
+        now = time.time()
+        if now - self._flush_time >= self.flush_interval:
+            self.writer.flush()
+            self._flush_time = now
+
+    async def header(self, connection, header):
+        self.writer.write_header(header, self.connection_id(connection))
+        self.record()
+        await self.forward(connection, header.pack())
+
+    async def pixels(self, connection, pixels):
+        self.writer.write_pixels(pixels, self.connection_id(connection))
+        self.record()
+        await self.forward(connection, pixels.pack_header(), pixels_buffer(pixels.data))
+
+    async def close(self, connection):
+        self.writer.write_close(connection.session or 0, self.connection_id(connection))
+        await self.forward(connection, close_message())
+
+    async def quit(self, connection):
+        await self.forward(connection, quit_message())
+        return False
+
+    def disconnected(self, connection):
+        upstream = self._upstreams.pop(connection, None)
+        if upstream is not None:
+            upstream.close()
+        self._connections.pop(connection, None)
+        self.writer.flush()
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    @param argv: list
+    @return: int
+    """
+    parser = argparse.ArgumentParser(description="Record Aton driver streams to a capture file.")
+    parser.add_argument("capture", help="capture file to append to")
+    parser.add_argument("--host", default="", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=get_port() + 100, help="port to listen on")
+    parser.add_argument("--target-host", default=get_host(), help="Aton host to forward to")
+    parser.add_argument("--target-port", type=int, default=get_port(),
+                        help="Aton port to forward to")
+    parser.add_argument("--no-forward", action="store_true", help="only write the capture")
+    args = parser.parse_args(argv)
+
+    with CaptureWriter(args.capture) as writer:
+        target_port = None if args.no_forward else args.target_port
+        receiver = Receiver(RecorderHandler(writer, args.target_host, target_port),
+                            args.host, args.port)
+        receiver.listen()
+
+        if target_port is None:
+            sys.stdout.write("Aton | Recording port %d to %s\n" % (receiver.port, args.capture))
+        else:
+            sys.stdout.write("Aton | Recording port %d to %s, forwarding to %s:%d\n" %
+                             (receiver.port, args.capture, args.target_host, target_port))
+
+        try:
+            asyncio.run(receiver.serve_forever())
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+"""
+Aton Relay
+
+Fan-in relay for distributed renders. Tile jobs of a farm session connect
+to the relay instead of the artist's Nuke, the relay reads all of their
+connections concurrently and forwards a single ordered stream over one
+connection, so the fb_writer thread of the Aton node never waits for a
+blade. Buckets wait in a queue ordered by arrival, a newer bucket of the
+same AOV and rectangle replaces the queued one instead of being sent
+twice, e.g. progressive passes of a slow link. Headers of the tiles of a
+session and frame are merged into one whose region area covers all tiles.
+
+Relay the farm port to a local Nuke, at most 100 MB/s
+
+python aton_relay.py --port 9401 --target-port 9201 --rate 100
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+import threading
+import collections
+
+from aton_protocol import PROTOCOL_V2, DataHeader, DataPixels, get_host, get_port
+from aton_receiver import Receiver, Handler
+from aton_client import Client
+
+
+__author__ = "Vahan Sosoyan"
+__copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
+__version__ = "1.3.7"
+
+
+class RelayHandler(Handler):
+    """
+    Queues incoming messages and forwards them from a sender thread
+    """
+    def __init__(self, target_host=None, target_port=None, rate=None, max_buckets=4096,
+                 idle_timeout=5.0, retry_interval=1.0, protocol=PROTOCOL_V2, encodings=None,
+                 compression=None):
+        """
+        @param target_host: str
+        @param target_port: int
+        @param rate: float: bytes per second sent to the target, None is unlimited
+        @param max_buckets: int: queued buckets before drivers are slowed down
+        @param idle_timeout: float: seconds without buckets before the image is closed
+        @param retry_interval: float: seconds between attempts to reach the target
+        @param protocol: int: highest protocol version to negotiate with the target
+        @param encodings: str: AOV encodings, e.g. "*=half Z=float"
+        @param compression: str: codec name or auto
+        """
+        self.client = Client(target_host, target_port, protocol, encodings, compression)
+        self.rate = rate
+        self.max_buckets = max_buckets
+        self.idle_timeout = idle_timeout
+        self.retry_interval = retry_interval
+
+        self.received = 0
+        self.forwarded = 0
+        self.coalesced = 0
+
+        # (session, frame): merged header and region areas of its tiles
+        self.headers = dict()
+        self._areas = collections.defaultdict(int)
+        self._frames = dict()
+
+        self._queue = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        """
+        Starts the sender thread
+        @return:
+        """
+        self._thread.start()
+
+    def stop(self):
+        """
+        Sends the queued messages and stops the sender thread
+        @return:
+        """
+        with self._condition:
+            self._stop = True
+            self._condition.notify()
+        self._thread.join()
+
+    @property
+    def queued(self):
+        """
+        Returns number of queued messages
+        @return: int
+        """
+        return len(self._queue)
+
+    def enqueue(self, key, item):
+        """
+        Queues a message, replacing the queued one with the same key
+        @param key: tuple
+        @param item: DataHeader or DataPixels
+        @return:
+        """
+        with self._condition:
+            if key in self._queue:
+                self.coalesced += 1
+            self._queue[key] = item
+            self._condition.notify()
+
+    def header(self, connection, header):
+        key = header.session, header.frame
+        self._frames[connection] = header.frame
+
+        # Every tile sends the area of its own region
+        self._areas[key] += header.region_area
+        header.region_area = min(self._areas[key], header.xres * header.yres)
+        self.headers[key] = header
+        self.enqueue(("header",) + key, header)
+
+    async def pixels(self, connection, pixels):
+        self.received += 1
+        while self.queued >= self.max_buckets:
+            await asyncio.sleep(0.005)
+
+        # Reconnecting drivers send buckets without a header
+        frame = self._frames.get(connection)
+        if frame is None:
+            header = connection.receiver.sessions.get(pixels.session)
+            frame = 0.0 if header is None else header.frame
+
+        # The receiver reuses its pixels once dispatched, queue a copy
+        x, y, width, height = pixels.rect
+        copy = DataPixels(pixels.session, pixels.xres, pixels.yres, x, y, width, height,
+                          pixels.spp, pixels.ram, pixels.time, pixels.aov_name,
+                          pixels.data.copy())
+        self.enqueue(("pixels", pixels.session, frame, pixels.aov_name) + pixels.rect, copy)
+
+    def disconnected(self, connection):
+        self._frames.pop(connection, None)
+
+    def send_header(self, header):
+        """
+        Opens the image over the current target connection
+        @param header: DataHeader
+        @return:
+        """
+        self.client.send_header(header, reconnect=False)
+
+    def _next(self):
+        """
+        Waits for the next queued message, closing the image when idle
+        @return: tuple: key, item or None when stopped
+        """
+        with self._condition:
+            while not self._queue and not self._stop:
+                if not self._condition.wait(self.idle_timeout) and self.client.connected:
+                    self.client.close_image()
+            if not self._queue:
+                return None
+            return self._queue.popitem(last=False)
+
+    def _requeue(self, key, item):
+        """
+        Puts a message back in front unless a newer one has been queued
+        @param key: tuple
+        @param item: DataHeader or DataPixels
+        @return:
+        """
+        with self._condition:
+            if key not in self._queue:
+                self._queue[key] = item
+                self._queue.move_to_end(key, last=False)
+
+    def _run(self):
+        current = None
+        start, start_bytes = time.time(), self.client.bytes
+
+        while True:
+            message = self._next()
+            if message is None:
+                break
+            key, item = message
+
+            # The image is closed while idle, buckets reopen it with a fresh header
+            if not self.client.connected:
+                current = None
+
+            try:
+                if key[0] == "header":
+                    self.send_header(item)
+                    current = key[1:]
+                else:
+                    # Buckets belong to the last opened image
+                    if key[1:3] != current:
+                        self.send_header(self.headers.get(key[1:3]) or
+                                         DataHeader(item.session, item.xres, item.yres,
+                                                    frame=key[2]))
+                        current = key[1:3]
+                    self.client.send_pixels(item)
+                    self.forwarded += 1
+            except OSError as e:
+                sys.stdout.write("Aton | Relay target %s:%d: %s\n" %
+                                 (self.client.host, self.client.port, e))
+                self.client.disconnect()
+                current = None
+                self._requeue(key, item)
+                if self._stop:
+                    break
+                time.sleep(self.retry_interval)
+                continue
+            except Exception as e:
+                # Drop the message rather than the sender thread
+                sys.stdout.write("Aton | Relay dropped %s: %s: %s\n" %
+                                 (key[0], type(e).__name__, e))
+                self.client.disconnect()
+                current = None
+                continue
+
+            if self.rate:
+                now = time.time()
+                delay = start + (self.client.bytes - start_bytes) / self.rate - now
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -1.0:
+                    # Don't burst after being idle
+                    start, start_bytes = now, self.client.bytes
+
+        if self.client.connected:
+            try:
+                self.client.close_image()
+            except OSError:
+                self.client.disconnect()
+
+        self.client.close_ring()
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    @param argv: list
+    @return: int
+    """
+    parser = argparse.ArgumentParser(description="Relay many Aton driver connections into one.")
+    parser.add_argument("--host", default="", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=get_port() + 200, help="port to listen on")
+    parser.add_argument("--target-host", default=get_host(), help="Aton host to forward to")
+    parser.add_argument("--target-port", type=int, default=get_port(),
+                        help="Aton port to forward to")
+    parser.add_argument("--rate", type=float, help="MB/s sent to the target, default unlimited")
+    parser.add_argument("--max-buckets", type=int, default=4096,
+                        help="queued buckets before drivers are slowed down")
+    parser.add_argument("--idle", type=float, default=5.0,
+                        help="seconds without buckets before the image is closed")
+    parser.add_argument("--encodings", help="AOV encodings, e.g. \"*=half Z=float\"")
+    parser.add_argument("--compression", help="compression codec, zstd, lz4, zlib or auto")
+    args = parser.parse_args(argv)
+
+    handler = RelayHandler(args.target_host, args.target_port,
+                           args.rate * 1e6 if args.rate else None, args.max_buckets, args.idle,
+                           encodings=args.encodings, compression=args.compression)
+    receiver = Receiver(handler, args.host, args.port)
+    receiver.listen()
+    handler.start()
+
+    sys.stdout.write("Aton | Relaying port %d to %s:%d\n" %
+                     (receiver.port, args.target_host, args.target_port))
+
+    try:
+        asyncio.run(receiver.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        handler.stop()
+        sys.stdout.write("Aton | %d buckets received | %d forwarded | %d coalesced\n" %
+                         (handler.received, handler.forwarded, handler.coalesced))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""
+Aton Replay
+
+Sends a capture recorded with aton_recorder back to an Aton node or any
+other receiver. Messages are replayed byte for byte in their recorded
+order, every recorded driver connection is reopened as its own client
+connection, so reconnects and interleaved outputs look the same as in
+the original session. Runs without Arnold, e.g. for benchmarking the
+fb_writer and set_aov_pix path of the Nuke node.
+
+Replay at recorded speed, twice as fast or as fast as possible
+
+python aton_replay.py session.aton --speed 1
+python aton_replay.py session.aton --speed 2
+python aton_replay.py session.aton --speed 0
+
+Simulate four artists rendering at the same time
+
+python aton_replay.py session.aton --speed 0 --parallel 4 --loop 10
+"""
+
+import sys
+import time
+import struct
+import argparse
+import threading
+
+from aton_protocol import (KEY_HEADER, KEY_PIXELS, KEY_CLOSE, KEY_STRUCT, PROTOCOL_V1, get_host,
+                           get_port)
+from aton_capture import Capture
+from aton_client import Client
+
+
+__author__ = "Vahan Sosoyan"
+__copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
+__version__ = "1.3.7"
+
+
+# Session is the first field of both header and pixels messages
+SESSION_STRUCT = struct.Struct("=q")
+
+
+class Replay(object):
+    """
+    Replays a capture to a single host and port
+    """
+    def __init__(self, capture, host=None, port=None, speed=1.0, loops=1, session_offset=0,
+                 **filters):
+        """
+        @param capture: Capture
+        @param host: str
+        @param port: int
+        @param speed: float: timing scale, 0 sends as fast as possible
+        @param loops: int: number of passes, 0 loops until stopped
+        @param session_offset: int: added to every session id
+        @param filters: sessions, frames, aovs and region as in Capture.select
+        """
+        self.capture = capture
+        self.host = get_host() if host is None else host
+        self.port = get_port() if port is None else port
+        self.speed = speed
+        self.loops = loops
+        self.session_offset = session_offset
+        self.records = capture.select(keys=[KEY_HEADER, KEY_PIXELS, KEY_CLOSE], **filters)
+
+        self.messages = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+
+        self._stop = threading.Event()
+
+    def stop(self):
+        """
+        Stops the replay after the current message
+        @return:
+        """
+        self._stop.set()
+
+    def message(self, record):
+        """
+        Returns the message to send for the given record
+        @param record: numpy.void
+        @return: bytes-like
+        """
+        message = self.capture.message(record)
+
+        if self.session_offset and record["key"] != KEY_CLOSE:
+            message = bytearray(message)
+            session = SESSION_STRUCT.unpack_from(message, KEY_STRUCT.size)[0]
+            SESSION_STRUCT.pack_into(message, KEY_STRUCT.size, session + self.session_offset)
+
+        return message
+
+    def play(self):
+        """
+        Sends all records once
+        @return:
+        """
+        if not len(self.records):
+            return
+
+        clients = dict()
+        first_time = self.records["time"][0]
+        start = time.time()
+
+        try:
+            for record in self.records:
+                if self._stop.is_set():
+                    break
+
+                if self.speed > 0:
+                    delay = start + (record["time"] - first_time) / self.speed - time.time()
+                    if delay > 0:
+                        self._stop.wait(delay)
+
+                key = record["key"]
+                connection = int(record["connection"])
+                client = clients.get(connection)
+
+                # The driver opens a new connection for every header
+                if client is None or key == KEY_HEADER:
+                    if client is None:
+                        # Captures keep v1 messages
+                        client = clients[connection] = Client(self.host, self.port, PROTOCOL_V1)
+                    client.connect()
+
+                message = self.message(record)
+                client.send(message)
+
+                self.messages += 1
+                self.bytes += len(message)
+
+                if key == KEY_CLOSE:
+                    client.disconnect()
+                    del clients[connection]
+        finally:
+            for client in clients.values():
+                client.disconnect()
+
+    def run(self):
+        """
+        Plays the capture the given number of loops
+        @return:
+        """
+        start = time.time()
+        loop = 0
+
+        while not self._stop.is_set() and (not self.loops or loop < self.loops):
+            self.play()
+            loop += 1
+
+        self.elapsed = time.time() - start
+
+
+def replay_parallel(replays):
+    """
+    Runs replays in parallel threads and waits for all of them
+    @param replays: list: Replay
+    @return:
+    """
+    threads = [threading.Thread(target=i.run) for i in replays]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.1)
+    except KeyboardInterrupt:
+        for replay in replays:
+            replay.stop()
+        for thread in threads:
+            thread.join()
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    @param argv: list
+    @return: int
+    """
+    parser = argparse.ArgumentParser(description="Replay an Aton capture file.")
+    parser.add_argument("capture", help="capture file recorded with aton_recorder")
+    parser.add_argument("--host", default=get_host(), help="Aton host")
+    parser.add_argument("--port", type=int, default=get_port(), help="Aton port")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="timing scale, 0 sends as fast as possible")
+    parser.add_argument("--loop", type=int, default=1, help="number of passes, 0 is endless")
+    parser.add_argument("--parallel", type=int, default=1, help="number of concurrent replays")
+    parser.add_argument("--session-step", type=int, default=1,
+                        help="session id offset between parallel replays")
+    parser.add_argument("--frames", type=float, nargs="+", help="frames to replay")
+    parser.add_argument("--aovs", nargs="+", help="AOVs to replay")
+    parser.add_argument("--region", type=int, nargs=4, metavar=("X", "Y", "R", "T"),
+                        help="only replay buckets overlapping the region")
+    args = parser.parse_args(argv)
+
+    capture = Capture(args.capture)
+    replays = [Replay(capture, args.host, args.port, args.speed, args.loop,
+                      i * args.session_step, frames=args.frames, aovs=args.aovs,
+                      region=args.region) for i in range(args.parallel)]
+
+    sys.stdout.write("Aton | Replaying %d messages x %d to %s:%d\n" %
+                     (len(replays[0].records), len(replays), args.host, args.port))
+
+    replay_parallel(replays)
+
+    messages = sum(i.messages for i in replays)
+    size = sum(i.bytes for i in replays)
+    elapsed = max(i.elapsed for i in replays) or 1e-9
+    sys.stdout.write("Aton | %d messages | %.2f MB | %.2f s | %.2f MB/s\n" %
+                     (messages, size / 1e6, elapsed, size / elapsed / 1e6))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
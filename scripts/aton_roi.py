@@ -0,0 +1,356 @@
+"""
+Aton Region
+
+Live render region channel between Nuke and the DCC panels, replacing
+the copy, paste and Get round trip through the clipboard. Every Aton node
+publishes its region on its port + ROI_PORT_OFFSET, DCC panels subscribe
+to the port of their output and apply the latest region at their own rate.
+
+Messages are JSON lines in both directions:
+
+{"type": "region", "node": "Aton1", "region": [x, y, r, t]}
+    region normalised by the Aton format, as the clipboard had it
+{"type": "get"}
+    asks the publisher for its current region, sent by subscribers on connect
+
+Follow the region of the Aton node on the given port with
+
+python aton_roi.py --port 9201
+"""
+
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+
+
+__author__ = "Vahan Sosoyan"
+__copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
+__version__ = "1.3.7"
+
+
+ROI_PORT_OFFSET = 500
+
+
+def region_message(region, node=""):
+    """
+    Returns a region message line
+    @param region: list: float x, y, r, t
+    @param node: str
+    @return: bytes
+    """
+    message = {"type": "region", "node": node, "region": [float(i) for i in region]}
+    return (json.dumps(message) + "\n").encode("utf-8")
+
+
+def read_messages(sock, buffer):
+    """
+    Receives the next chunk and returns the complete messages in it
+    @param sock: socket.socket
+    @param buffer: bytearray: incomplete line kept between calls
+    @return: list: dict, None if the connection was closed
+    """
+    data = sock.recv(4096)
+    if not data:
+        return
+
+    buffer += data
+    messages = list()
+    while b"\n" in buffer:
+        index = buffer.index(b"\n")
+        line = bytes(buffer[:index])
+        del buffer[:index + 1]
+        try:
+            messages.append(json.loads(line.decode("utf-8")))
+        except ValueError:
+            continue
+    return messages
+
+
+class RoiPublisher(object):
+    """
+    Publishes the region of an Aton node to all subscribers
+    """
+    def __init__(self, port):
+        """
+        @param port: int: Aton port, the channel listens on port + ROI_PORT_OFFSET
+        """
+        self.port = port
+        self.region = None
+        self.node = ""
+
+        self.__lock = threading.Lock()
+        self.__subscribers = list()
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__sock.bind(("", port + ROI_PORT_OFFSET))
+        self.__sock.listen(16)
+
+        thread = threading.Thread(target=self.__accept)
+        thread.daemon = True
+        thread.start()
+
+    def publish(self, region, node=""):
+        """
+        Sends the region to all subscribers
+        @param region: list: float x, y, r, t
+        @param node: str
+        @return:
+        """
+        with self.__lock:
+            self.region, self.node = list(region), node
+            subscribers = list(self.__subscribers)
+
+        message = region_message(region, node)
+        for sock in subscribers:
+            self.__send(sock, message)
+
+    def close(self):
+        """
+        Stops listening and disconnects all subscribers
+        @return:
+        """
+        # Shutdown wakes the threads blocked on the sockets, which keep them open otherwise
+        try:
+            self.__sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.__sock.close()
+        with self.__lock:
+            subscribers, self.__subscribers = self.__subscribers, list()
+        for sock in subscribers:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            sock.close()
+
+    def __send(self, sock, message):
+        """
+        Sends a message, dropping the subscriber if it is gone
+        @param sock: socket.socket
+        @param message: bytes
+        @return:
+        """
+        try:
+            sock.sendall(message)
+        except socket.error:
+            with self.__lock:
+                if sock in self.__subscribers:
+                    self.__subscribers.remove(sock)
+            sock.close()
+
+    def __accept(self):
+        """
+        Accepts subscribers
+        @return:
+        """
+        while True:
+            try:
+                sock = self.__sock.accept()[0]
+            except socket.error:
+                break
+
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.__lock:
+                self.__subscribers.append(sock)
+
+            thread = threading.Thread(target=self.__serve, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def __serve(self, sock):
+        """
+        Answers the requests of a subscriber
+        @param sock: socket.socket
+        @return:
+        """
+        buffer = bytearray()
+        while True:
+            try:
+                messages = read_messages(sock, buffer)
+            except socket.error:
+                messages = None
+
+            if messages is None:
+                with self.__lock:
+                    if sock in self.__subscribers:
+                        self.__subscribers.remove(sock)
+                sock.close()
+                return
+
+            for message in messages:
+                with self.__lock:
+                    region, node = self.region, self.node
+                if message.get("type") == "get" and region is not None:
+                    self.__send(sock, region_message(region, node))
+
+
+class RoiSubscriber(object):
+    """
+    Follows the region published for an Aton port, reconnecting
+    until the publisher is there. Poll the latest region with pop()
+    """
+    def __init__(self, host, port, retry=2.0):
+        """
+        @param host: str: Nuke host
+        @param port: int: Aton port
+        @param retry: float: seconds between connection attempts
+        """
+        self.host = host
+        self.port = port
+        self.retry = retry
+
+        self.__lock = threading.Lock()
+        self.__pending = None
+        self.__sock = None
+        self.__closed = False
+
+        thread = threading.Thread(target=self.__run)
+        thread.daemon = True
+        thread.start()
+
+    def pop(self):
+        """
+        Returns the latest region received since the last call, None if there is none
+        @return: list: float x, y, r, t
+        """
+        with self.__lock:
+            region, self.__pending = self.__pending, None
+        return region
+
+    def set_target(self, host, port):
+        """
+        Follows another Aton node
+        @param host: str
+        @param port: int
+        @return:
+        """
+        with self.__lock:
+            if (host, port) == (self.host, self.port):
+                return
+            self.host, self.port = host, port
+            self.__pending = None
+            sock = self.__sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def close(self):
+        """
+        Stops following the region
+        @return:
+        """
+        with self.__lock:
+            self.__closed = True
+            sock = self.__sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def __run(self):
+        """
+        Connects and receives regions until closed
+        @return:
+        """
+        while not self.__closed:
+            with self.__lock:
+                target = self.host, self.port + ROI_PORT_OFFSET
+            try:
+                sock = socket.create_connection(target, timeout=self.retry)
+            except socket.error:
+                time.sleep(self.retry)
+                continue
+
+            sock.settimeout(None)
+            with self.__lock:
+                self.__sock = sock
+            try:
+                sock.sendall((json.dumps({"type": "get"}) + "\n").encode("utf-8"))
+                buffer = bytearray()
+                while not self.__closed:
+                    messages = read_messages(sock, buffer)
+                    if messages is None:
+                        break
+                    for message in messages:
+                        if message.get("type") == "region":
+                            with self.__lock:
+                                self.__pending = message["region"]
+            except socket.error:
+                pass
+            finally:
+                with self.__lock:
+                    self.__sock = None
+                sock.close()
+
+
+# Publishers by Aton port, see publish_region
+_publishers = dict()
+
+
+def publish_region(port, region, node=""):
+    """
+    Publishes the region of the Aton node on the given port
+    @param port: int
+    @param region: list: float x, y, r, t
+    @param node: str
+    @return:
+    """
+    publisher = _publishers.get(port)
+    if publisher is None:
+        publisher = _publishers[port] = RoiPublisher(port)
+    publisher.publish(region, node)
+
+
+def close_publisher(port):
+    """
+    Stops publishing the region of the given port
+    @param port: int
+    @return:
+    """
+    publisher = _publishers.pop(port, None)
+    if publisher is not None:
+        publisher.close()
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    @param argv: list
+    @return: int
+    """
+    # Imported here, aton_protocol loads numpy which Nuke doesn't need at startup
+    try:
+        from aton_protocol import get_host, get_port
+    except ImportError:
+        get_host = get_port = None
+
+    parser = argparse.ArgumentParser(description="Follow the region of an Aton node.")
+    parser.add_argument("--host", default=get_host() if get_host else "127.0.0.1",
+                        help="Nuke host")
+    parser.add_argument("--port", type=int, default=get_port() if get_port else 9201,
+                        help="Aton port")
+    parser.add_argument("--rate", type=float, default=4.0, help="regions per second")
+    args = parser.parse_args(argv)
+
+    subscriber = RoiSubscriber(args.host, args.port)
+    try:
+        while True:
+            region = subscriber.pop()
+            if region is not None:
+                sys.stdout.write("Aton | region | %s\n" % " ".join("%.4f" % i for i in region))
+                sys.stdout.flush()
+            time.sleep(1.0 / args.rate)
+    except KeyboardInterrupt:
+        subscriber.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
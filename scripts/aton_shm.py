@@ -0,0 +1,306 @@
+"""
+Aton Shared Memory
+
+Same host transport for protocol v2. The client creates a shared memory
+ring, a memory mapped file in /dev/shm or the temp directory, and
+announces its path with a KEY_SHM message on every connection, from
+then on bucket pixels are copied into the ring and only their fields and
+ring position go through the socket, which stays the control channel.
+The receiver hands out NumPy views into the ring and releases the space
+once the handler has returned, so pixels are never copied by the kernel
+and float buckets are not copied at all on the receiving side.
+
+The ring is kept across reconnects and removed when the client closes
+the image or quits. CAP_RESUME receivers keep it mapped between the
+connections of its client and read them in order.
+
+Ring layout, all fields little-endian:
+
+0:  magic RING_MAGIC
+8:  capacity in bytes
+16: read position, advanced by the reader
+64: data
+
+Positions grow monotonically and wrap around the capacity, a message
+never wraps but starts again at the beginning of the data.
+
+Clients select the ring automatically when the host resolves to this
+machine and the receiver supports it. Compare it with loopback TCP
+
+python aton_shm.py --res 3840 2160 --aovs 20
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import socket
+import argparse
+import tempfile
+import ipaddress
+
+import numpy as np
+
+from aton_protocol import CAP_SHARED_MEMORY
+
+
+__author__ = "Vahan Sosoyan"
+__copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
+__version__ = "1.3.7"
+
+
+RING_MAGIC = b"ATONSHM1"
+RING_HEADER_SIZE = 64
+RING_ALIGNMENT = 64
+# Small rings stay in the CPU caches and avoid page faults of fresh memory
+DEFAULT_RING_SIZE = 4 << 20
+
+
+def ring_directory():
+    """
+    Returns the directory rings are created in, memory backed if possible
+    @return: str
+    """
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def capabilities():
+    """
+    Returns hello capabilities of a receiver in this Python
+    @return: int
+    """
+    return CAP_SHARED_MEMORY
+
+
+def is_local_host(host):
+    """
+    Returns True if the host resolves to this machine
+    @param host: str
+    @return: bool
+    """
+    try:
+        address = socket.gethostbyname(host)
+    except (socket.error, UnicodeError):
+        return False
+
+    if ipaddress.ip_address(address).is_loopback:
+        return True
+
+    try:
+        return address in socket.gethostbyname_ex(socket.gethostname())[2]
+    except socket.error:
+        return False
+
+
+class SharedRing(object):
+    """
+    Single writer, single reader ring buffer in shared memory
+    """
+    def __init__(self, path, memory, owner):
+        """
+        Use SharedRing.create or SharedRing.attach
+        @param path: str
+        @param memory: mmap.mmap
+        @param owner: bool: True removes the file on close
+        """
+        self.name = path
+        self.memory = memory
+        self.owner = owner
+
+        header = np.ndarray(3, np.dtype("<u8"), memory)
+        self.capacity = int(header[1])
+        self._read_position = header[2:3]
+        self._data = memoryview(memory)[RING_HEADER_SIZE:RING_HEADER_SIZE + self.capacity]
+        self._write_position = 0
+
+    def __repr__(self):
+        return "SharedRing(%s, %d)" % (self.name, self.capacity)
+
+    @classmethod
+    def create(cls, capacity=DEFAULT_RING_SIZE):
+        """
+        Creates a new ring to write to
+        @param capacity: int: bytes
+        @return: SharedRing
+        """
+        fd, path = tempfile.mkstemp(".ring", "aton_", ring_directory())
+        try:
+            os.ftruncate(fd, RING_HEADER_SIZE + capacity)
+            memory = mmap.mmap(fd, RING_HEADER_SIZE + capacity)
+        except Exception:
+            os.unlink(path)
+            raise
+        finally:
+            os.close(fd)
+
+        memory[:8] = RING_MAGIC
+        header = np.ndarray(3, np.dtype("<u8"), memory)
+        header[1:] = capacity, 0
+        del header
+        return cls(path, memory, True)
+
+    @classmethod
+    def attach(cls, path):
+        """
+        Attaches to the ring created by a writer
+        @param path: str
+        @return: SharedRing
+        """
+        fd = os.open(path, os.O_RDWR)
+        try:
+            memory = mmap.mmap(fd, os.fstat(fd).st_size)
+        finally:
+            os.close(fd)
+
+        if memory[:8] != RING_MAGIC:
+            memory.close()
+            raise ValueError("Invalid shared memory ring %s" % path)
+        return cls(path, memory, False)
+
+    @property
+    def read_position(self):
+        """
+        Returns position up to which the reader has released the ring
+        @return: int
+        """
+        return int(self._read_position[0])
+
+    def reserve(self, size, timeout=10.0):
+        """
+        Returns the position and a writable view of size bytes,
+        waiting until the reader has released enough space
+        @param size: int
+        @param timeout: float: seconds
+        @return: tuple: int, memoryview
+        """
+        aligned = -(-size // RING_ALIGNMENT) * RING_ALIGNMENT
+        if aligned > self.capacity:
+            raise ValueError("%d bytes don't fit into %r" % (size, self))
+
+        position = self._write_position
+        offset = position % self.capacity
+        if offset + aligned > self.capacity:
+            position += self.capacity - offset
+            offset = 0
+
+        deadline = None
+        while position + aligned - self.read_position > self.capacity:
+            if deadline is None:
+                deadline = time.time() + timeout
+            elif time.time() > deadline:
+                raise TimeoutError("Reader of %r doesn't release any space" % self)
+            time.sleep(0.0001)
+
+        self._write_position = position + aligned
+        return position, self._data[offset:offset + size]
+
+    def drain(self, timeout=10.0):
+        """
+        Waits until the reader has released everything written, returns False on timeout
+        @param timeout: float: seconds
+        @return: bool
+        """
+        deadline = time.time() + timeout
+        while self.read_position < self._write_position:
+            if time.time() > deadline:
+                return False
+            time.sleep(0.0001)
+        return True
+
+    def view(self, position, size):
+        """
+        Returns a view of the bytes written at position
+        @param position: int
+        @param size: int
+        @return: memoryview
+        """
+        offset = position % self.capacity
+        if offset + size > self.capacity:
+            raise ValueError("Invalid ring position %d of size %d" % (position, size))
+        return self._data[offset:offset + size]
+
+    def release(self, position, size):
+        """
+        Releases the space up to the end of the given message
+        @param position: int
+        @param size: int
+        @return:
+        """
+        self._read_position[0] = position + -(-size // RING_ALIGNMENT) * RING_ALIGNMENT
+
+    def close(self):
+        """
+        Closes the ring, the writer also removes it
+        @return:
+        """
+        if self.memory is None:
+            return
+
+        self._read_position = None
+        try:
+            self._data.release()
+            self.memory.close()
+        except BufferError:
+            # A view is still in use, the mapping goes away with it
+            pass
+
+        if self.owner:
+            try:
+                os.unlink(self.name)
+            except OSError:
+                pass
+        self.memory = None
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    @param argv: list
+    @return: int
+    """
+    from aton_benchmark import Benchmark
+
+    parser = argparse.ArgumentParser(description="Compare shared memory with loopback TCP.")
+    parser.add_argument("--res", type=int, nargs=2, default=(3840, 2160), metavar=("X", "Y"),
+                        help="image resolution")
+    parser.add_argument("--bucket-size", type=int, default=64, help="bucket size in pixels")
+    parser.add_argument("--aovs", type=int, default=20, help="number of AOVs")
+    parser.add_argument("--spp", type=int, default=4, choices=(1, 3, 4),
+                        help="samples per pixel of every AOV")
+    parser.add_argument("--frames", type=int, default=1, help="frames to send")
+    parser.add_argument("--json", help="write results to a JSON file, - for stdout")
+    args = parser.parse_args(argv)
+
+    # All AOVs share one image, a 4K frame with 20 AOVs would take gigabytes otherwise
+    image = np.random.rand(args.res[1], args.res[0], args.spp).astype(np.float32)
+    images = [("RGBA" if not i else "aov%d" % i, image) for i in range(args.aovs)]
+
+    results = dict()
+    for transport, shared in (("tcp", False), ("shm", True)):
+        benchmark = Benchmark(args.res[0], args.res[1], args.bucket_size, frames=args.frames,
+                              host="127.0.0.1", images=images, shared_memory=shared,
+                              process=True)
+        results[transport] = benchmark.run(timeout=600.0)
+
+    if args.json:
+        if args.json == "-":
+            json.dump(results, sys.stdout, indent=4)
+            sys.stdout.write("\n")
+            return 0
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+    for transport, run in results.items():
+        sys.stdout.write("Aton | %s | %d buckets | %.2f MB on socket | %.2f s | %.2f MB/s | "
+                         "%.1f buckets/s | latency p50 %.3f ms | p99 %.3f ms\n" %
+                         (transport, run["sent_buckets"], run["wire_bytes"] / 1e6, run["seconds"],
+                          run["mb_per_s"], run["buckets_per_s"], run["latency_ms"]["p50"],
+                          run["latency_ms"]["p99"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
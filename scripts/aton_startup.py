@@ -0,0 +1,129 @@
+"""
+Aton Startup
+
+Measures what the Aton plugin adds to Nuke's startup. Runs Nuke in
+terminal mode several times for each ATON_LOAD mode of init.py and
+reports the process wall time:
+
+off:       the plugin is never loaded
+deferred:  the plugin is loaded on first use, nothing is used
+startup:   the plugin is loaded at startup, the previous behaviour
+first use: deferred, then an Aton node is created
+
+The directory holding the plugin, init.py and Aton.tcl is added to
+NUKE_PATH, this directory by default.
+
+python aton_startup.py --nuke /usr/local/Nuke12.0v3/Nuke12.0 --runs 10
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+
+__author__ = "Vahan Sosoyan"
+__copyright__ = "2019 All rights reserved. See Copyright.txt for more details."
+__version__ = "1.3.7"
+
+
+# Mode name, ATON_LOAD value and terminal script
+MODES = (("off", "off", "pass\n"),
+         ("deferred", "deferred", "pass\n"),
+         ("startup", "startup", "pass\n"),
+         ("first use", "deferred", "import nuke\nnuke.createNode(\"Aton\")\n"))
+
+
+def run_nuke(nuke, script, nuke_path, aton_load):
+    """
+    Runs a Nuke terminal script, returns the wall time
+    @param nuke: str: Nuke executable
+    @param script: str: Python script path
+    @param nuke_path: str: directory added to NUKE_PATH
+    @param aton_load: str: ATON_LOAD value
+    @return: float: seconds
+    """
+    env = dict(os.environ)
+    env["ATON_LOAD"] = aton_load
+    env["NUKE_PATH"] = os.pathsep.join([nuke_path] + ([env["NUKE_PATH"]]
+                                                      if env.get("NUKE_PATH") else []))
+
+    start = time.time()
+    with open(os.devnull, "w") as devnull:
+        code = subprocess.call([nuke, "-t", script], env=env, stdout=devnull, stderr=devnull)
+    seconds = time.time() - start
+
+    if code:
+        raise RuntimeError("%s -t %s failed with %d" % (nuke, script, code))
+    return seconds
+
+
+def measure(nuke, nuke_path, runs=5):
+    """
+    Measures Nuke startup in all modes, interleaving the modes run by run
+    @param nuke: str: Nuke executable
+    @param nuke_path: str: directory added to NUKE_PATH
+    @param runs: int: runs of each mode
+    @return: dict: mode: dict of min, median and all run seconds
+    """
+    scripts = dict()
+    for name, _, text in MODES:
+        fd, scripts[name] = tempfile.mkstemp(".py", "aton_startup_")
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+
+    seconds = dict((name, list()) for name, _, _ in MODES)
+    try:
+        # The first run warms up the file system caches
+        run_nuke(nuke, scripts["off"], nuke_path, "off")
+        for _ in range(runs):
+            for name, aton_load, _ in MODES:
+                seconds[name].append(run_nuke(nuke, scripts[name], nuke_path, aton_load))
+    finally:
+        for path in scripts.values():
+            os.remove(path)
+
+    results = dict()
+    for name, values in seconds.items():
+        values = sorted(values)
+        results[name] = {"min": values[0], "median": values[len(values) // 2], "runs": values}
+    return results
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    @param argv: list
+    @return: int
+    """
+    parser = argparse.ArgumentParser(description="Measure the startup time Aton adds to Nuke.")
+    parser.add_argument("--nuke", default=os.getenv("NUKE_EXE", "Nuke"), help="Nuke executable")
+    parser.add_argument("--nuke-path", default=os.path.dirname(os.path.abspath(__file__)),
+                        help="directory of the Aton plugin, init.py and Aton.tcl")
+    parser.add_argument("--runs", type=int, default=5, help="runs of each mode")
+    parser.add_argument("--json", help="write results to a JSON file, - for stdout")
+    args = parser.parse_args(argv)
+
+    results = measure(args.nuke, args.nuke_path, args.runs)
+
+    if args.json:
+        if args.json == "-":
+            json.dump(results, sys.stdout, indent=4)
+            sys.stdout.write("\n")
+            return 0
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+    base = results["off"]["median"]
+    for name, _, _ in MODES:
+        run = results[name]
+        sys.stdout.write("Aton | %s | median %.3f s | min %.3f s | %+.3f s over off\n" %
+                         (name, run["median"], run["min"], run["median"] - base))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
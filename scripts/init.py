@@ -1 +1,7 @@
-nuke.load("aton")
+import os
+import nuke
+
+# The Aton plugin is loaded on first use of an Aton node by Aton.tcl,
+# ATON_LOAD=startup loads it right away and ATON_LOAD=off never does
+if os.getenv("ATON_LOAD") == "startup":
+    nuke.load("aton")
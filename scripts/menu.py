@@ -3,3 +3,91 @@ toolbar = nuke.menu("Nodes")
 mainToolBar=nuke.toolbar("Nodes")
 m = mainToolBar.addMenu("Image")
 m.addCommand("Aton", "nuke.createNode(\"Aton\")")
+
+try:
+    from aton_ports import PortRegistry, ROLE_SERVER
+except ImportError:
+    PortRegistry = None
+
+try:
+    from aton_roi import publish_region, close_publisher
+except ImportError:
+    publish_region = None
+
+
+def aton_register_port():
+    """
+    Registers the port the Aton node listens on in the port registry
+    """
+    knob = nuke.thisKnob()
+    if knob is None or knob.name() in ("port_knob", "reset_port_knob", "name"):
+        node = nuke.thisNode()
+        try:
+            registry = PortRegistry()
+            if knob is not None and knob.name() == "name":
+                registry.release(ROLE_SERVER)
+                for aton in nuke.allNodes("Aton", recurseGroups=True):
+                    registry.lease(int(aton["port_knob"].value()), ROLE_SERVER, aton.fullName())
+            else:
+                registry.lease(int(node["port_knob"].value()), ROLE_SERVER, node.fullName())
+        except (RuntimeError, EnvironmentError):
+            pass
+
+
+def aton_release_port():
+    """
+    Releases the port of the deleted Aton node
+    """
+    try:
+        PortRegistry().release(ROLE_SERVER, nuke.thisNode().fullName())
+    except (RuntimeError, EnvironmentError):
+        pass
+
+
+if PortRegistry is not None:
+    nuke.addOnCreate(aton_register_port, nodeClass="Aton")
+    nuke.addKnobChanged(aton_register_port, nodeClass="Aton")
+    nuke.addOnDestroy(aton_release_port, nodeClass="Aton")
+
+
+
+# Ports the region of each Aton node is published on
+aton_region_ports = dict()
+
+
+def aton_publish_region():
+    """
+    Publishes the region of the Aton node to the DCC panels following its port
+    """
+    knob = nuke.thisKnob()
+    if knob is not None and knob.name() in ("region_knob", "formats_knob", "port_knob"):
+        node = nuke.thisNode()
+        port = int(node["port_knob"].value())
+        if aton_region_ports.get(node.fullName(), port) != port:
+            close_publisher(aton_region_ports[node.fullName()])
+        aton_region_ports[node.fullName()] = port
+
+        fmt = node["formats_knob"].value()
+        if fmt.width() > 0 and fmt.height() > 0:
+            region = node["region_knob"]
+            try:
+                publish_region(port,
+                               [region.x() / float(fmt.width()), region.y() / float(fmt.height()),
+                                region.r() / float(fmt.width()), region.t() / float(fmt.height())],
+                               node.fullName())
+            except EnvironmentError:
+                pass
+
+
+def aton_close_region():
+    """
+    Stops publishing the region of the deleted Aton node
+    """
+    port = aton_region_ports.pop(nuke.thisNode().fullName(), None)
+    if port is not None:
+        close_publisher(port)
+
+
+if publish_region is not None:
+    nuke.addKnobChanged(aton_publish_region, nodeClass="Aton")
+    nuke.addOnDestroy(aton_close_region, nodeClass="Aton")
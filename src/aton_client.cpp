@@ -5,8 +5,24 @@ All rights reserved. See COPYING.txt for more details.
 */
 
 #include "aton_client.h"
+#include <sstream>
+#include <atomic>
+#include <thread>
+#include <chrono>
+#include <fstream>
+#include <algorithm>
 #include <boost/lexical_cast.hpp>
+#include <boost/filesystem.hpp>
 #include <boost/date_time/posix_time/posix_time.hpp>
+#include <boost/iostreams/copy.hpp>
+#include <boost/iostreams/filtering_stream.hpp>
+#include <boost/iostreams/filter/zlib.hpp>
+#include <boost/iostreams/device/array.hpp>
+#include <boost/iostreams/device/back_inserter.hpp>
+
+#ifdef __F16C__
+#include <immintrin.h>
+#endif
 
 using namespace boost::asio;
 
@@ -41,6 +57,30 @@ const bool host_exists(const char* host)
     return !ec;
 }
 
+const bool is_local_host(const std::string& host)
+{
+    boost::system::error_code ec;
+    io_service io;
+    ip::tcp::resolver resolver(io);
+    ip::tcp::resolver::iterator end;
+    
+    // Addresses of this machine's name
+    std::vector<ip::address> local;
+    const std::string host_name = ip::host_name(ec);
+    ip::tcp::resolver::iterator it = resolver.resolve(ip::tcp::resolver::query(host_name, "0"), ec);
+    for (; !ec && it != end; ++it)
+        local.push_back(it->endpoint().address());
+    
+    it = resolver.resolve(ip::tcp::resolver::query(host, "0"), ec);
+    for (; !ec && it != end; ++it)
+    {
+        const ip::address address = it->endpoint().address();
+        if (address.is_loopback() || std::find(local.begin(), local.end(), address) != local.end())
+            return true;
+    }
+    return false;
+}
+
 const long long get_unique_id()
 {
     using namespace boost::posix_time;
@@ -55,6 +95,308 @@ const int pack_4_int(int a, int b, int c, int d)
     return a * 1000000 + b * 10000 + c * 100 + d;
 }
 
+inline unsigned short float_to_half(const float& value)
+{
+    unsigned int f;
+    memcpy(&f, &value, sizeof(float));
+    
+    const unsigned int sign = (f >> 16) & 0x8000;
+    const unsigned int mantissa = f & 0x7fffff;
+    const int exponent = static_cast<int>((f >> 23) & 0xff) - 127 + 15;
+    
+    // Inf or NaN
+    if (((f >> 23) & 0xff) == 0xff)
+        return sign | 0x7c00 | (mantissa ? 0x200 : 0);
+    
+    // Overflow to Inf
+    if (exponent >= 31)
+        return sign | 0x7c00;
+    
+    // Subnormal or zero, rounded to nearest even
+    if (exponent <= 0)
+    {
+        if (exponent < -10)
+            return sign;
+        
+        const unsigned int m = mantissa | 0x800000;
+        const unsigned int shift = 14 - exponent;
+        const unsigned int rest = m & ((1u << shift) - 1);
+        const unsigned int halfway = 1u << (shift - 1);
+        unsigned int half = m >> shift;
+        if (rest > halfway || (rest == halfway && (half & 1)))
+            half++;
+        return sign | half;
+    }
+    
+    // Normal, rounded to nearest even which may carry into the exponent
+    unsigned int half = sign | (exponent << 10) | (mantissa >> 13);
+    const unsigned int rest = mantissa & 0x1fff;
+    if (rest > 0x1000 || (rest == 0x1000 && (half & 1)))
+        half++;
+    return half;
+}
+
+inline float half_to_float(const unsigned short& half)
+{
+    const unsigned int sign = (half & 0x8000) << 16;
+    int exponent = (half >> 10) & 0x1f;
+    unsigned int mantissa = half & 0x3ff;
+    unsigned int f;
+    
+    if (exponent == 0)
+    {
+        if (mantissa == 0)
+            f = sign;
+        else
+        {
+            // Normalize subnormal
+            exponent = 1;
+            while (!(mantissa & 0x400))
+            {
+                mantissa <<= 1;
+                exponent--;
+            }
+            mantissa &= 0x3ff;
+            f = sign | ((exponent + 127 - 15) << 23) | (mantissa << 13);
+        }
+    }
+    else if (exponent == 31)
+        f = sign | 0x7f800000 | (mantissa << 13);
+    else
+        f = sign | ((exponent + 127 - 15) << 23) | (mantissa << 13);
+    
+    float value;
+    memcpy(&value, &f, sizeof(float));
+    return value;
+}
+
+inline unsigned int quantize(const float& value, const float& levels)
+{
+    // NaN and negative values are clamped to 0
+    const float v = value > 0.0f ? (value < 1.0f ? value : 1.0f) : 0.0f;
+    return static_cast<unsigned int>(v * levels + 0.5f);
+}
+
+const int get_encoding(const std::string& name)
+{
+    if (name == "float")
+        return protocol::encoding_float32;
+    else if (name == "half")
+        return protocol::encoding_float16;
+    else if (name == "8bit")
+        return protocol::encoding_uint8;
+    else if (name == "10bit")
+        return protocol::encoding_uint10;
+    return -1;
+}
+
+const size_t encoded_size(const size_t& num_samples, const int& encoding)
+{
+    switch (encoding)
+    {
+        case protocol::encoding_float16:
+            return num_samples * sizeof(unsigned short);
+        case protocol::encoding_uint8:
+            return num_samples;
+        case protocol::encoding_uint10:
+            return (num_samples + 2) / 3 * sizeof(unsigned int);
+        default:
+            return num_samples * sizeof(float);
+    }
+}
+
+void encode_pixels(const float* data, const size_t& num_samples, const int& encoding,
+                   std::vector<char>& out)
+{
+    out.resize(encoded_size(num_samples, encoding));
+    size_t i = 0;
+    
+    switch (encoding)
+    {
+        case protocol::encoding_float16:
+        {
+            unsigned short* half = reinterpret_cast<unsigned short*>(&out[0]);
+#ifdef __F16C__
+            for (; i + 8 <= num_samples; i += 8)
+            {
+                const __m128i h = _mm256_cvtps_ph(_mm256_loadu_ps(data + i), _MM_FROUND_TO_NEAREST_INT);
+                _mm_storeu_si128(reinterpret_cast<__m128i*>(half + i), h);
+            }
+#endif
+            for (; i < num_samples; ++i)
+                half[i] = float_to_half(data[i]);
+#if BOOST_ENDIAN_BIG_BYTE
+            for (i = 0; i < num_samples; ++i)
+                boost::endian::native_to_little_inplace(half[i]);
+#endif
+            break;
+        }
+        case protocol::encoding_uint8:
+        {
+            unsigned char* q = reinterpret_cast<unsigned char*>(&out[0]);
+            for (; i < num_samples; ++i)
+                q[i] = static_cast<unsigned char>(quantize(data[i], 255.0f));
+            break;
+        }
+        case protocol::encoding_uint10:
+        {
+            unsigned int* words = reinterpret_cast<unsigned int*>(&out[0]);
+            const size_t num_words = out.size() / sizeof(unsigned int);
+            for (size_t w = 0; w < num_words; ++w, i += 3)
+            {
+                unsigned int word = quantize(data[i], 1023.0f);
+                if (i + 1 < num_samples)
+                    word |= quantize(data[i + 1], 1023.0f) << 10;
+                if (i + 2 < num_samples)
+                    word |= quantize(data[i + 2], 1023.0f) << 20;
+                words[w] = boost::endian::native_to_little(word);
+            }
+            break;
+        }
+        default:
+        {
+            memcpy(&out[0], data, out.size());
+#if BOOST_ENDIAN_BIG_BYTE
+            unsigned int* words = reinterpret_cast<unsigned int*>(&out[0]);
+            for (; i < num_samples; ++i)
+                boost::endian::native_to_little_inplace(words[i]);
+#endif
+        }
+    }
+}
+
+void decode_pixels(const char* data, const size_t& num_samples, const int& encoding, float* out)
+{
+    size_t i = 0;
+    
+    switch (encoding)
+    {
+        case protocol::encoding_float16:
+        {
+            const unsigned short* half = reinterpret_cast<const unsigned short*>(data);
+#if BOOST_ENDIAN_BIG_BYTE
+            for (; i < num_samples; ++i)
+                out[i] = half_to_float(boost::endian::little_to_native(half[i]));
+#else
+#ifdef __F16C__
+            for (; i + 8 <= num_samples; i += 8)
+            {
+                const __m128i h = _mm_loadu_si128(reinterpret_cast<const __m128i*>(half + i));
+                _mm256_storeu_ps(out + i, _mm256_cvtph_ps(h));
+            }
+#endif
+            for (; i < num_samples; ++i)
+                out[i] = half_to_float(half[i]);
+#endif
+            break;
+        }
+        case protocol::encoding_uint8:
+        {
+            const unsigned char* q = reinterpret_cast<const unsigned char*>(data);
+            for (; i < num_samples; ++i)
+                out[i] = q[i] * (1.0f / 255.0f);
+            break;
+        }
+        case protocol::encoding_uint10:
+        {
+            const unsigned int* words = reinterpret_cast<const unsigned int*>(data);
+            for (; i < num_samples; ++i)
+            {
+                const unsigned int word = boost::endian::little_to_native(words[i / 3]);
+                out[i] = ((word >> (10 * (i % 3))) & 0x3ff) * (1.0f / 1023.0f);
+            }
+            break;
+        }
+        default:
+        {
+            memcpy(out, data, num_samples * sizeof(float));
+#if BOOST_ENDIAN_BIG_BYTE
+            unsigned int* words = reinterpret_cast<unsigned int*>(out);
+            for (; i < num_samples; ++i)
+                boost::endian::little_to_native_inplace(words[i]);
+#endif
+        }
+    }
+}
+
+const size_t encoding_itemsize(const int& encoding)
+{
+    switch (encoding)
+    {
+        case protocol::encoding_float16:
+            return sizeof(unsigned short);
+        case protocol::encoding_uint8:
+            return sizeof(unsigned char);
+        default:
+            return sizeof(unsigned int);
+    }
+}
+
+unsigned int compress_pixels(const char* data, const size_t& size, const int& encoding,
+                             const int& level, std::vector<char>& filtered,
+                             std::vector<char>& out)
+{
+    // Bytes of the same significance go into planes, each delta coded,
+    // which leaves long runs of small values for zlib
+    unsigned int flags = protocol::compression_zlib;
+    const size_t itemsize = encoding_itemsize(encoding);
+    if (itemsize > 1 && size % itemsize == 0)
+    {
+        const size_t num_items = size / itemsize;
+        filtered.resize(size);
+        for (size_t b = 0; b < itemsize; ++b)
+        {
+            unsigned char previous = 0;
+            char* plane = &filtered[b * num_items];
+            for (size_t i = 0; i < num_items; ++i)
+            {
+                const unsigned char value = data[i * itemsize + b];
+                plane[i] = static_cast<char>(value - previous);
+                previous = value;
+            }
+        }
+        data = &filtered[0];
+        flags |= protocol::flag_shuffle | protocol::flag_delta;
+    }
+    
+    out.clear();
+    boost::iostreams::filtering_ostream stream;
+    stream.push(boost::iostreams::zlib_compressor(boost::iostreams::zlib_params(level)));
+    stream.push(boost::iostreams::back_inserter(out));
+    stream.write(data, size);
+    stream.reset();
+    return flags;
+}
+
+void decompress_pixels(const char* data, const size_t& size, const unsigned int& flags,
+                       const int& encoding, std::vector<char>& filtered, char* out,
+                       const size_t& out_size)
+{
+    if ((flags & protocol::flag_codec_mask) != protocol::compression_zlib)
+        throw std::runtime_error("Unknown pixels compression!");
+    
+    filtered.resize(out_size);
+    boost::iostreams::filtering_istream stream;
+    stream.push(boost::iostreams::zlib_decompressor());
+    stream.push(boost::iostreams::array_source(data, size));
+    stream.read(&filtered[0], out_size);
+    if (static_cast<size_t>(stream.gcount()) != out_size)
+        throw std::runtime_error("Aton pixels are too short!");
+    
+    const size_t itemsize = flags & protocol::flag_shuffle ? encoding_itemsize(encoding) : 1;
+    const size_t num_items = out_size / itemsize;
+    for (size_t b = 0; b < itemsize; ++b)
+    {
+        unsigned char value = 0;
+        const char* plane = &filtered[b * num_items];
+        for (size_t i = 0; i < num_items; ++i)
+        {
+            value = flags & protocol::flag_delta ? value + plane[i] : plane[i];
+            out[i * itemsize + b] = static_cast<char>(value);
+        }
+    }
+}
+
 // Data Class
 DataHeader::DataHeader(const long long& index,
                        const int& xres,
@@ -128,22 +470,211 @@ void DataPixels::free()
 }
 
 
+// Returns the directory rings are created in, memory backed if possible
+inline std::string ring_directory()
+{
+    boost::system::error_code ec;
+    if (boost::filesystem::is_directory("/dev/shm", ec))
+        return "/dev/shm";
+    return boost::filesystem::temp_directory_path().string();
+}
+
+// Returns the ring space taken by a message of size bytes
+inline size_t ring_aligned(const size_t& size)
+{
+    const size_t& alignment = protocol::ring_alignment;
+    return (size + alignment - 1) / alignment * alignment;
+}
+
+// SharedRing Class
+SharedRing::SharedRing(const size_t& capacity): mOwner(true),
+                                                mCapacity(capacity),
+                                                mWritePosition(0),
+                                                mData(NULL),
+                                                mReadPosition(NULL)
+{
+    using namespace boost::interprocess;
+    namespace fs = boost::filesystem;
+    mPath = (fs::path(ring_directory()) / fs::unique_path("aton_%%%%-%%%%-%%%%-%%%%.ring")).string();
+    
+    // Sized file readable by this user only
+    {
+        std::filebuf file;
+        if (!file.open(mPath.c_str(), std::ios_base::in | std::ios_base::out |
+                                      std::ios_base::trunc | std::ios_base::binary))
+            throw std::runtime_error("Could not create " + mPath);
+        file.pubseekoff(protocol::ring_header_size + capacity - 1, std::ios_base::beg);
+        file.sputc(0);
+    }
+    
+    try
+    {
+        fs::permissions(mPath, fs::owner_read | fs::owner_write);
+        file_mapping file(mPath.c_str(), read_write);
+        mFile.swap(file);
+        mapped_region region(mFile, read_write);
+        mRegion.swap(region);
+    }
+    catch (...)
+    {
+        file_mapping::remove(mPath.c_str());
+        throw;
+    }
+    
+    char* base = static_cast<char*>(mRegion.get_address());
+    unsigned long long header[2] = {capacity, 0};
+    boost::endian::native_to_little_inplace(header[0]);
+    memcpy(base, protocol::ring_magic, sizeof(protocol::ring_magic));
+    memcpy(base + sizeof(protocol::ring_magic), header, sizeof(header));
+    mData = base + protocol::ring_header_size;
+    mReadPosition = reinterpret_cast<volatile unsigned long long*>(base + 16);
+}
+
+SharedRing::SharedRing(const std::string& path): mPath(path),
+                                                 mOwner(false),
+                                                 mCapacity(0),
+                                                 mWritePosition(0),
+                                                 mData(NULL),
+                                                 mReadPosition(NULL)
+{
+    using namespace boost::interprocess;
+    file_mapping file(mPath.c_str(), read_write);
+    mFile.swap(file);
+    mapped_region region(mFile, read_write);
+    mRegion.swap(region);
+    
+    char* base = static_cast<char*>(mRegion.get_address());
+    if (mRegion.get_size() < protocol::ring_header_size ||
+        memcmp(base, protocol::ring_magic, sizeof(protocol::ring_magic)) != 0)
+        throw std::runtime_error("Invalid shared memory ring " + mPath);
+    
+    unsigned long long capacity;
+    memcpy(&capacity, base + sizeof(protocol::ring_magic), sizeof(capacity));
+    boost::endian::little_to_native_inplace(capacity);
+    if (protocol::ring_header_size + capacity > mRegion.get_size())
+        throw std::runtime_error("Invalid shared memory ring " + mPath);
+    
+    mCapacity = static_cast<size_t>(capacity);
+    mData = base + protocol::ring_header_size;
+    mReadPosition = reinterpret_cast<volatile unsigned long long*>(base + 16);
+}
+
+SharedRing::~SharedRing()
+{
+    if (mOwner)
+        boost::interprocess::file_mapping::remove(mPath.c_str());
+}
+
+unsigned long long SharedRing::read_position() const
+{
+    const unsigned long long position = boost::endian::little_to_native(*mReadPosition);
+    std::atomic_thread_fence(std::memory_order_acquire);
+    return position;
+}
+
+char* SharedRing::reserve(const size_t& size, unsigned long long& position)
+{
+    const size_t aligned = ring_aligned(size);
+    if (aligned > mCapacity)
+        throw std::runtime_error("Bucket doesn't fit into the shared memory ring");
+    
+    // Messages never wrap but start again at the beginning
+    position = mWritePosition;
+    size_t offset = static_cast<size_t>(position % mCapacity);
+    if (offset + aligned > mCapacity)
+    {
+        position += mCapacity - offset;
+        offset = 0;
+    }
+    
+    using namespace std::chrono;
+    const steady_clock::time_point deadline = steady_clock::now() + seconds(10);
+    while (position + aligned - read_position() > mCapacity)
+    {
+        if (steady_clock::now() > deadline)
+            throw std::runtime_error("Reader doesn't release any shared memory");
+        std::this_thread::sleep_for(microseconds(100));
+    }
+    
+    mWritePosition = position + aligned;
+    return mData + offset;
+}
+
+bool SharedRing::drain(const double& timeout)
+{
+    using namespace std::chrono;
+    const steady_clock::time_point deadline =
+        steady_clock::now() + duration_cast<steady_clock::duration>(duration<double>(timeout));
+    while (read_position() < mWritePosition)
+    {
+        if (steady_clock::now() > deadline)
+            return false;
+        std::this_thread::sleep_for(microseconds(100));
+    }
+    return true;
+}
+
+const char* SharedRing::view(const unsigned long long& position, const size_t& size) const
+{
+    const size_t offset = static_cast<size_t>(position % mCapacity);
+    if (offset + size > mCapacity)
+        throw std::runtime_error("Invalid shared memory ring position");
+    return mData + offset;
+}
+
+void SharedRing::release(const unsigned long long& position, const size_t& size)
+{
+    std::atomic_thread_fence(std::memory_order_release);
+    *mReadPosition = boost::endian::native_to_little(position + ring_aligned(size));
+}
+
+
 // Client Class
-Client::Client(std::string hostname, int port): mHost(hostname),
-                                                mPort(port),
-                                                mImageId(-1),
-                                                mSocket(mIoService),
-                                                mIsConnected(false)
+Client::Client(std::string hostname, int port, int version): mHost(hostname),
+                                                             mPort(port),
+                                                             mImageId(-1),
+                                                             mVersion(version),
+                                                             mCompression(1),
+                                                             mCapabilities(0),
+                                                             mIsConnected(false),
+                                                             mSharedMemory(true),
+                                                             mRingConnected(false),
+                                                             mRing(NULL),
+                                                             mDefaultEncoding(protocol::encoding_float32),
+                                                             mSocket(mIoService)
 {
     mPort_str = std::to_string(port);
+    mIsLocalHost = is_local_host(mHost);
 }
 
 Client::~Client()
 {
     disconnect();
+    delete mRing;
 }
 
-void Client::connect()
+void Client::set_encodings(const std::string& spec)
+{
+    mEncodings.clear();
+    mDefaultEncoding = protocol::encoding_float32;
+    
+    std::istringstream items(spec);
+    std::string item;
+    while (items >> item)
+    {
+        const size_t pos = item.find('=');
+        const int encoding = get_encoding(pos == std::string::npos ? "" : item.substr(pos + 1));
+        if (encoding < 0)
+            throw std::runtime_error("Unknown Aton encoding " + item);
+        
+        if (item.substr(0, pos) == "*")
+            mDefaultEncoding = encoding;
+        else
+            mEncodings[item.substr(0, pos)] = encoding;
+    }
+}
+
+void Client::open_socket()
 {
     using boost::asio::ip::tcp;
     tcp::resolver resolver(mIoService);
@@ -160,9 +691,130 @@ void Client::connect()
         throw boost::system::system_error(error);
 }
 
+void Client::connect()
+{
+    disconnect();
+    open_socket();
+    mAovIds.clear();
+    mAovEncodings.clear();
+    mAovRawBuckets.clear();
+    
+    // Servers keeping reconnects cheap are not asked again, the driver
+    // reconnects for every bucket in reconnect modes
+    const bool resumed = mVersion >= protocol::v2 && (mCapabilities & protocol::cap_resume) &&
+                         resume();
+    if (!resumed)
+    {
+        mCapabilities = 0;
+        if (mVersion >= protocol::v2 && !hello())
+        {
+            // v1 servers drop the connection, stay on v1 from now on
+            mVersion = protocol::v1;
+            open_socket();
+        }
+    }
+    
+    // Pixels of servers on this host go through shared memory
+    if (mVersion >= protocol::v2 && (mCapabilities & protocol::cap_shared_memory) &&
+        mSharedMemory && mIsLocalHost)
+        open_ring();
+}
+
+void Client::open_ring()
+{
+    // The ring is kept across reconnects, once the previous server
+    // connection has released everything, resume servers read the
+    // connections of a ring in order and don't need to be waited for
+    if (mRing != NULL && !(mCapabilities & protocol::cap_resume) && !mRing->drain(1.0))
+    {
+        delete mRing;
+        mRing = NULL;
+    }
+    
+    if (mRing == NULL)
+    {
+        try
+        {
+            mRing = new SharedRing(protocol::ring_size);
+        }
+        catch (const std::exception&)
+        {
+            // Stay on TCP
+            return;
+        }
+    }
+    
+    const std::string& path = mRing->path();
+    mMessage.clear();
+    mMessage.begin(protocol::shm);
+    mMessage.put_long(mRing->capacity());
+    mMessage.put_uint(static_cast<unsigned int>(path.size() + 1));
+    mMessage.put_bytes(path.c_str(), path.size() + 1);
+    mMessage.end();
+    write(mSocket, buffer(mMessage.data()));
+    mRingConnected = true;
+}
+
+bool Client::hello()
+{
+    // Close key keeps v1 servers from reading any further
+    int key = protocol::close;
+    
+    mMessage.clear();
+    mMessage.put_bytes(&key, sizeof(int));
+    mMessage.put_bytes(protocol::hello_magic, sizeof(protocol::hello_magic));
+    mMessage.put_uint(mVersion);
+    mMessage.put_uint(protocol::capabilities);
+    
+    std::vector<char> reply(protocol::hello_size);
+    boost::system::error_code error;
+    write(mSocket, buffer(mMessage.data()), error);
+    if (!error)
+        read(mSocket, buffer(reply), error);
+    
+    if (error || memcmp(&reply[0], protocol::hello_magic, sizeof(protocol::hello_magic)) != 0)
+        return false;
+    
+    MessageReader reader(reply);
+    char magic[sizeof(protocol::hello_magic)];
+    reader.get_bytes(magic, sizeof(magic));
+    mVersion = std::min(mVersion, static_cast<int>(reader.get_uint()));
+    mCapabilities = reader.get_uint() & protocol::capabilities;
+    return true;
+}
+
+bool Client::resume()
+{
+    int key = protocol::close;
+    
+    mMessage.clear();
+    mMessage.put_bytes(&key, sizeof(int));
+    mMessage.put_bytes(protocol::hello_magic, sizeof(protocol::hello_magic));
+    mMessage.put_uint(mVersion);
+    mMessage.put_uint(mCapabilities | protocol::hello_no_reply);
+    
+    boost::system::error_code error;
+    write(mSocket, buffer(mMessage.data()), error);
+    if (error)
+        open_socket();
+    return !error;
+}
+
 void Client::disconnect()
 {
+    // Unread replies would reset the connection before the server has read it
+    boost::system::error_code error;
+    if (mSocket.is_open())
+    {
+        const size_t available = mSocket.available(error);
+        if (!error && available > 0)
+        {
+            std::vector<char> rest(available);
+            mSocket.read_some(buffer(rest), error);
+        }
+    }
     mSocket.close();
+    mRingConnected = false;
 }
 
 void Client::send_header(DataHeader& header)
@@ -171,65 +823,239 @@ void Client::send_header(DataHeader& header)
     connect();
 
     // Send image header message with image desc information
-    int key = 0;
-    write(mSocket, buffer(reinterpret_cast<char*>(&key), sizeof(int)));
-    
-    // Send our width & height
-    write(mSocket, buffer(reinterpret_cast<char*>(&header.mSession), sizeof(long long)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&header.mXres), sizeof(int)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&header.mYres), sizeof(int)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&header.mPixAspectRatio), sizeof(float)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&header.mRArea), sizeof(long long)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&header.mVersion), sizeof(int)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&header.mFrame), sizeof(float)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&header.mCamFov), sizeof(float)));
+    int key = protocol::header;
+    
+    // Get size of aov name
+    size_t output_size = strlen(header.mOutputName) + 1;
 
     const int camMatrixSize = 16;
-    write(mSocket, buffer(reinterpret_cast<char*>(&header.mCamMatrix[0]), sizeof(float)*camMatrixSize));
-    
     const int samplesSize = 6;
-    write(mSocket, buffer(reinterpret_cast<char*>(&header.mSamples[0]), sizeof(int)*samplesSize));
     
-    // Get size of aov name
-    size_t output_size = strlen(header.mOutputName) + 1;
-    write(mSocket, buffer(reinterpret_cast<char*>(&output_size), sizeof(size_t)));
-    write(mSocket, buffer(header.mOutputName, output_size));
+    if (mVersion >= protocol::v2)
+    {
+        mMessage.clear();
+        mMessage.begin(key);
+        mMessage.put_long(header.mSession);
+        mMessage.put_int(header.mXres);
+        mMessage.put_int(header.mYres);
+        mMessage.put_float(header.mPixAspectRatio);
+        mMessage.put_long(header.mRArea);
+        mMessage.put_int(header.mVersion);
+        mMessage.put_float(header.mFrame);
+        mMessage.put_float(header.mCamFov);
+        for (int i = 0; i < camMatrixSize; ++i)
+            mMessage.put_float(header.mCamMatrix[i]);
+        for (int i = 0; i < samplesSize; ++i)
+            mMessage.put_int(header.mSamples[i]);
+        mMessage.put_uint(static_cast<unsigned int>(output_size));
+        mMessage.put_bytes(header.mOutputName, output_size);
+        mMessage.end();
+        write(mSocket, buffer(mMessage.data()));
+        mIsConnected = true;
+        return;
+    }
+
+    // Gather the whole message into a single write
+    std::vector<const_buffer> buffers;
+    buffers.push_back(buffer(reinterpret_cast<char*>(&key), sizeof(int)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&header.mSession), sizeof(long long)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&header.mXres), sizeof(int)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&header.mYres), sizeof(int)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&header.mPixAspectRatio), sizeof(float)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&header.mRArea), sizeof(long long)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&header.mVersion), sizeof(int)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&header.mFrame), sizeof(float)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&header.mCamFov), sizeof(float)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&header.mCamMatrix[0]), sizeof(float)*camMatrixSize));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&header.mSamples[0]), sizeof(int)*samplesSize));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&output_size), sizeof(size_t)));
+    buffers.push_back(buffer(header.mOutputName, output_size));
+    write(mSocket, buffers);
     mIsConnected = true;
 }
 
 void Client::send_pixels(DataPixels& pixels)
 {
     // Send data for image_id
-    int key = 1;
-    write(mSocket, buffer(reinterpret_cast<char*>(&key), sizeof(int)));
+    int key = protocol::pixels;
 
     // Get size of aov name
     size_t aov_size = strlen(pixels.mAovName) + 1;
 
     // Get size of overall samples
     const int num_samples = pixels.mBucket_size_x * pixels.mBucket_size_y * pixels.mSpp;
+    const size_t data_size = sizeof(float) * num_samples;
+    
+    if (mVersion >= protocol::v2)
+    {
+        mMessage.clear();
+        
+        // Send AOV name and encoding once per connection
+        std::map<std::string, unsigned int>::iterator it = mAovIds.find(pixels.mAovName);
+        if (it == mAovIds.end())
+        {
+            const unsigned int aov_id = static_cast<unsigned int>(mAovIds.size());
+            it = mAovIds.insert(std::make_pair(std::string(pixels.mAovName), aov_id)).first;
+            
+            int encoding = protocol::encoding_float32;
+            if (mCapabilities & protocol::cap_encodings)
+            {
+                std::map<std::string, int>::iterator enc = mEncodings.find(pixels.mAovName);
+                encoding = enc != mEncodings.end() ? enc->second : mDefaultEncoding;
+            }
+            mAovEncodings.push_back(encoding);
+            mAovRawBuckets.push_back(0);
+            
+            mMessage.begin(protocol::aov);
+            mMessage.put_uint(aov_id);
+            mMessage.put_uint(pixels.mSpp);
+            mMessage.put_uint(encoding);
+            mMessage.put_uint(static_cast<unsigned int>(aov_size));
+            mMessage.put_bytes(pixels.mAovName, aov_size);
+            mMessage.end();
+        }
+        
+        // Floats are sent as they are on little-endian hosts
+        const int& encoding = mAovEncodings[it->second];
+        const bool in_place = encoding == protocol::encoding_float32 && !BOOST_ENDIAN_BIG_BYTE;
+        
+        // Copy pixels into the shared memory ring, only their position goes through the socket
+        const size_t ring_size = encoded_size(num_samples, encoding);
+        unsigned long long position;
+        char* ring_data = NULL;
+        if (mRingConnected && ring_size <= mRing->capacity())
+        {
+            try
+            {
+                ring_data = mRing->reserve(ring_size, position);
+            }
+            catch (const std::runtime_error&)
+            {
+                // The reader is gone, send over TCP and create a new ring on the next connect
+                delete mRing;
+                mRing = NULL;
+                mRingConnected = false;
+            }
+        }
+        
+        if (ring_data != NULL)
+        {
+            if (in_place)
+                memcpy(ring_data, pixels.mpData, ring_size);
+            else
+            {
+                encode_pixels(pixels.mpData, num_samples, encoding, mEncoded);
+                memcpy(ring_data, &mEncoded[0], ring_size);
+            }
+            
+            mMessage.begin(key);
+            mMessage.put_long(pixels.mSession);
+            mMessage.put_int(pixels.mXres);
+            mMessage.put_int(pixels.mYres);
+            mMessage.put_uint(it->second);
+            mMessage.put_int(pixels.mBucket_xo);
+            mMessage.put_int(pixels.mBucket_yo);
+            mMessage.put_int(pixels.mBucket_size_x);
+            mMessage.put_int(pixels.mBucket_size_y);
+            mMessage.put_int(pixels.mSpp);
+            mMessage.put_long(pixels.mRam);
+            mMessage.put_uint(pixels.mTime);
+            mMessage.put_uint(protocol::flag_shared);
+            mMessage.put_long(position);
+            mMessage.put_long(ring_size);
+            mMessage.end();
+            write(mSocket, buffer(mMessage.data()));
+            return;
+        }
+        
+        const_buffer pixels_buffer = buffer(reinterpret_cast<char*>(&pixels.mpData[0]), data_size);
+        if (!in_place)
+        {
+            encode_pixels(pixels.mpData, num_samples, encoding, mEncoded);
+            pixels_buffer = buffer(mEncoded);
+        }
+        
+        // Compress pixels sent to other hosts, buckets which barely shrink
+        // go out raw for a while before compression is probed again
+        unsigned int flags = 0;
+        int& raw_buckets = mAovRawBuckets[it->second];
+        if ((mCapabilities & protocol::cap_zlib) && mCompression > 0 && !mIsLocalHost)
+        {
+            if (raw_buckets > 0)
+                --raw_buckets;
+            else
+            {
+                const size_t size = buffer_size(pixels_buffer);
+                flags = compress_pixels(buffer_cast<const char*>(pixels_buffer), size, encoding,
+                                        mCompression, mFiltered, mCompressed);
+                if (mCompressed.size() > size * 0.9)
+                    raw_buckets = 64;
+                if (mCompressed.size() < size)
+                    pixels_buffer = buffer(mCompressed);
+                else
+                    flags = 0;
+            }
+        }
+        
+        mMessage.begin(key);
+        mMessage.put_long(pixels.mSession);
+        mMessage.put_int(pixels.mXres);
+        mMessage.put_int(pixels.mYres);
+        mMessage.put_uint(it->second);
+        mMessage.put_int(pixels.mBucket_xo);
+        mMessage.put_int(pixels.mBucket_yo);
+        mMessage.put_int(pixels.mBucket_size_x);
+        mMessage.put_int(pixels.mBucket_size_y);
+        mMessage.put_int(pixels.mSpp);
+        mMessage.put_long(pixels.mRam);
+        mMessage.put_uint(pixels.mTime);
+        mMessage.put_uint(flags);
+        mMessage.end(buffer_size(pixels_buffer));
+        
+        std::vector<const_buffer> buffers;
+        buffers.push_back(buffer(mMessage.data()));
+        buffers.push_back(pixels_buffer);
+        write(mSocket, buffers);
+        return;
+    }
     
-    // Sending data to buffer
-    write(mSocket, buffer(reinterpret_cast<char*>(&pixels.mSession), sizeof(long long)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&pixels.mXres), sizeof(int)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&pixels.mYres), sizeof(int)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&pixels.mBucket_xo), sizeof(int)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&pixels.mBucket_yo), sizeof(int)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&pixels.mBucket_size_x), sizeof(int)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&pixels.mBucket_size_y), sizeof(int)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&pixels.mSpp), sizeof(int)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&pixels.mRam), sizeof(long long)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&pixels.mTime), sizeof(int)));
-    write(mSocket, buffer(reinterpret_cast<char*>(&aov_size), sizeof(size_t)));
-    write(mSocket, buffer(pixels.mAovName, aov_size));
-    write(mSocket, buffer(reinterpret_cast<char*>(&pixels.mpData[0]), sizeof(float)*num_samples));
+    // Gather the whole bucket into a single write
+    std::vector<const_buffer> buffers;
+    buffers.push_back(buffer(reinterpret_cast<char*>(&key), sizeof(int)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&pixels.mSession), sizeof(long long)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&pixels.mXres), sizeof(int)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&pixels.mYres), sizeof(int)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&pixels.mBucket_xo), sizeof(int)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&pixels.mBucket_yo), sizeof(int)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&pixels.mBucket_size_x), sizeof(int)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&pixels.mBucket_size_y), sizeof(int)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&pixels.mSpp), sizeof(int)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&pixels.mRam), sizeof(long long)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&pixels.mTime), sizeof(int)));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&aov_size), sizeof(size_t)));
+    buffers.push_back(buffer(pixels.mAovName, aov_size));
+    buffers.push_back(buffer(reinterpret_cast<char*>(&pixels.mpData[0]), data_size));
+    write(mSocket, buffers);
 }
 
 void Client::close_image()
 {
     // Send image complete message for image_id
-    int key = 2;
-    write(mSocket, buffer(reinterpret_cast<char*>(&key), sizeof(int)));
+    int key = protocol::close;
+    
+    if (mVersion >= protocol::v2)
+    {
+        mMessage.clear();
+        mMessage.begin(key);
+        mMessage.end();
+        write(mSocket, buffer(mMessage.data()));
+    }
+    else
+        write(mSocket, buffer(reinterpret_cast<char*>(&key), sizeof(int)));
+    
+    // The server may not have attached to the ring yet
+    if (mRingConnected)
+        mRing->drain();
 
     // Disconnect from port!
     disconnect();
@@ -238,7 +1064,17 @@ void Client::close_image()
 void Client::quit()
 {
     connect();
-    int key = 9;
-    write(mSocket, buffer(reinterpret_cast<char*>(&key), sizeof(int)));
+    int key = protocol::quit;
+    
+    if (mVersion >= protocol::v2)
+    {
+        mMessage.clear();
+        mMessage.begin(key);
+        mMessage.end();
+        write(mSocket, buffer(mMessage.data()));
+    }
+    else
+        write(mSocket, buffer(reinterpret_cast<char*>(&key), sizeof(int)));
+    
     disconnect();
 }
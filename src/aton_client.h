@@ -7,8 +7,14 @@ All rights reserved. See COPYING.txt for more details.
 #ifndef ATON_CLIENT_H_
 #define ATON_CLIENT_H_
 
+#include <map>
 #include <vector>
+#include <cstring>
 #include <boost/asio.hpp>
+#include <boost/interprocess/file_mapping.hpp>
+#include <boost/interprocess/mapped_region.hpp>
+#include <boost/endian/conversion.hpp>
+#include <boost/predef/other/endian.h>
 
 const int get_port();
 
@@ -16,11 +22,262 @@ const std::string get_host();
 
 const bool host_exists(const char* host);
 
+// Returns true if the host resolves to this machine
+const bool is_local_host(const std::string& host);
+
 const long long get_unique_id();
 
 const int pack_4_int(int a, int b, int c, int d);
 
 
+// Wire protocol versions and message keys, see aton_protocol.py for the layout
+namespace protocol
+{
+    const int v1 = 1;
+    const int v2 = 2;
+    
+    // Message keys
+    const int header = 0;
+    const int pixels = 1;
+    const int close = 2;
+    const int aov = 3;
+    const int shm = 4;
+    const int quit = 9;
+    
+    // Capabilities
+    const unsigned int cap_aov_table = 1;
+    const unsigned int cap_encodings = 2;
+    const unsigned int cap_zlib = 4;
+    const unsigned int cap_shared_memory = 32;
+    const unsigned int cap_resume = 64;
+    const unsigned int capabilities = cap_aov_table | cap_encodings | cap_zlib |
+                                      cap_shared_memory | cap_resume;
+    
+    // Hello capabilities flag of clients reconnecting to a cap_resume server,
+    // which takes the capabilities as they are and doesn't reply
+    const unsigned int hello_no_reply = 0x80000000;
+    
+    // Pixels message flags, the low byte is the compression of the pixels,
+    // shuffle and delta are the byte filters applied before compressing them,
+    // shared pixels are replaced by their ring position and size
+    const unsigned int flag_codec_mask = 0xff;
+    const unsigned int flag_shuffle = 0x100;
+    const unsigned int flag_delta = 0x200;
+    const unsigned int flag_shared = 0x400;
+    
+    // Compressions
+    const unsigned int compression_zlib = 1;
+    const size_t shm_ref_size = 16;
+    
+    // Pixel encodings, 8 and 10 bit ones clamp to 0-1 for display only AOVs
+    const int encoding_float32 = 0;
+    const int encoding_float16 = 1;
+    const int encoding_uint8 = 2;
+    const int encoding_uint10 = 3;
+    
+    // Hello magic following a close key on a new connection
+    const char hello_magic[4] = {'A', 'T', 'N', '2'};
+    const size_t hello_size = 12;
+    
+    // Size of the frame preceding every v2 message
+    const size_t frame_size = 8;
+    
+    // Size of the v2 pixels message fields preceding the pixels
+    const size_t pixels_size = 56;
+    
+    // Shared memory ring layout, see aton_shm.py
+    const char ring_magic[8] = {'A', 'T', 'O', 'N', 'S', 'H', 'M', '1'};
+    const size_t ring_header_size = 64;
+    const size_t ring_alignment = 64;
+    const size_t ring_size = 4 << 20;
+}
+
+// Returns encoding id of "float", "half", "8bit" or "10bit", -1 if unknown
+const int get_encoding(const std::string& name);
+
+// Returns size in bytes of the encoded pixels
+const size_t encoded_size(const size_t& num_samples, const int& encoding);
+
+// Encodes float pixels into little-endian protocol v2 pixels
+void encode_pixels(const float* data, const size_t& num_samples, const int& encoding,
+                   std::vector<char>& out);
+
+// Decodes little-endian protocol v2 pixels into floats
+void decode_pixels(const char* data, const size_t& num_samples, const int& encoding, float* out);
+
+// Returns size in bytes of the encoded samples, 4 for the 10 bit words
+const size_t encoding_itemsize(const int& encoding);
+
+// Byte shuffles, delta codes and zlib compresses encoded pixels into out,
+// returns the pixels message flags, filtered is a reused scratch buffer
+unsigned int compress_pixels(const char* data, const size_t& size, const int& encoding,
+                             const int& level, std::vector<char>& filtered,
+                             std::vector<char>& out);
+
+// Decompresses size bytes of encoded pixels compressed with the given flags
+void decompress_pixels(const char* data, const size_t& size, const unsigned int& flags,
+                       const int& encoding, std::vector<char>& filtered, char* out,
+                       const size_t& out_size);
+
+// Little-endian protocol v2 message writer
+class MessageBuffer
+{
+public:
+    MessageBuffer(): mFrameStart(0) {}
+    
+    void clear() { mData.clear(); }
+    
+    // Starts a new framed message
+    void begin(const int& key)
+    {
+        mFrameStart = mData.size();
+        put_uint(0);
+        put_uint(key);
+    }
+    
+    // Writes the payload size of the message, extra bytes are sent separately
+    void end(const size_t& extra = 0)
+    {
+        unsigned int size = static_cast<unsigned int>(mData.size() - mFrameStart -
+                                                      protocol::frame_size + extra);
+        boost::endian::native_to_little_inplace(size);
+        memcpy(&mData[mFrameStart], &size, sizeof(unsigned int));
+    }
+    
+    void put_int(int value)
+    {
+        boost::endian::native_to_little_inplace(value);
+        put_bytes(&value, sizeof(int));
+    }
+    
+    void put_uint(unsigned int value)
+    {
+        boost::endian::native_to_little_inplace(value);
+        put_bytes(&value, sizeof(unsigned int));
+    }
+    
+    void put_long(long long value)
+    {
+        boost::endian::native_to_little_inplace(value);
+        put_bytes(&value, sizeof(long long));
+    }
+    
+    void put_float(const float& value)
+    {
+        unsigned int bits;
+        memcpy(&bits, &value, sizeof(float));
+        put_uint(bits);
+    }
+    
+    void put_bytes(const void* data, const size_t& size)
+    {
+        const char* bytes = reinterpret_cast<const char*>(data);
+        mData.insert(mData.end(), bytes, bytes + size);
+    }
+    
+    const std::vector<char>& data() const { return mData; }
+    
+private:
+    std::vector<char> mData;
+    size_t mFrameStart;
+};
+
+// Little-endian protocol v2 message reader
+class MessageReader
+{
+public:
+    MessageReader(const std::vector<char>& data): mData(data), mPos(0) {}
+    
+    int get_int()
+    {
+        int value;
+        get_bytes(&value, sizeof(int));
+        return boost::endian::little_to_native(value);
+    }
+    
+    unsigned int get_uint()
+    {
+        unsigned int value;
+        get_bytes(&value, sizeof(unsigned int));
+        return boost::endian::little_to_native(value);
+    }
+    
+    long long get_long()
+    {
+        long long value;
+        get_bytes(&value, sizeof(long long));
+        return boost::endian::little_to_native(value);
+    }
+    
+    float get_float()
+    {
+        unsigned int bits = get_uint();
+        float value;
+        memcpy(&value, &bits, sizeof(float));
+        return value;
+    }
+    
+    void get_bytes(void* data, const size_t& size)
+    {
+        if (mPos + size > mData.size())
+            throw std::runtime_error("Aton message is too short!");
+        memcpy(data, &mData[mPos], size);
+        mPos += size;
+    }
+    
+private:
+    const std::vector<char>& mData;
+    size_t mPos;
+};
+
+
+// Single writer, single reader ring buffer in a memory mapped file,
+// used to pass pixels to a Server on the same host
+class SharedRing
+{
+public:
+    // Creates a new ring to write to, the file is removed again on destruction
+    SharedRing(const size_t& capacity);
+    
+    // Attaches to the ring created by a writer
+    SharedRing(const std::string& path);
+    
+    ~SharedRing();
+    
+    const std::string& path() const { return mPath; }
+    
+    const size_t& capacity() const { return mCapacity; }
+    
+    // Returns size writable bytes and their position, waiting until
+    // the reader has released enough space
+    char* reserve(const size_t& size, unsigned long long& position);
+    
+    // Waits until the reader has released everything written, false on timeout
+    bool drain(const double& timeout = 10.0);
+    
+    // Returns the bytes written at position
+    const char* view(const unsigned long long& position, const size_t& size) const;
+    
+    // Releases the space up to the end of the given message
+    void release(const unsigned long long& position, const size_t& size);
+    
+private:
+    unsigned long long read_position() const;
+    
+    std::string mPath;
+    bool mOwner;
+    size_t mCapacity;
+    unsigned long long mWritePosition;
+    char* mData;
+    
+    // Read position in the ring header, written by the reader
+    volatile unsigned long long* mReadPosition;
+    
+    boost::interprocess::file_mapping mFile;
+    boost::interprocess::mapped_region mRegion;
+};
+
+
 class Client;
 
 class DataHeader
@@ -218,8 +475,8 @@ class Client
     friend class Server;
 public:
     // Creates a new Client object and tell it to connect any messages to
-    // the specified host/port
-    Client(std::string hostname, int port);
+    // the specified host/port, protocol is the highest version to negotiate
+    Client(std::string hostname, int port, int version = protocol::v2);
     
     ~Client();
     
@@ -241,17 +498,63 @@ public:
     void close_image();
     
     bool connected() { return mIsConnected; }
+    
+    // Negotiated protocol version
+    const int& version() const { return mVersion; }
+    
+    // Sets pixel encodings as space separated AOV=encoding pairs,
+    // * sets the default, e.g. "*=half Z=float"
+    void set_encodings(const std::string& spec);
+    
+    // Passes pixels to servers on the same host through shared memory, on by default
+    void set_shared_memory(bool enabled) { mSharedMemory = enabled; }
+    
+    // Sets zlib level of pixels sent to servers on other hosts, 0 disables it, 1 by default
+    void set_compression(int level) { mCompression = level; }
 
     void connect();
     void disconnect();
 private:
     void quit();
     
+    // Opens the socket without negotiating
+    void open_socket();
+    
+    // Sends protocol v2 hello, returns false if the server dropped the connection
+    bool hello();
+    
+    // Sends the hello of a reconnect with the capabilities negotiated before,
+    // returns false if it could not be sent
+    bool resume();
+    
+    // Creates the shared memory ring or reuses it and announces it on the connection
+    void open_ring();
+    
     // Store the port we should connect to
     std::string mHost;
     std::string mPort_str;
-    int mPort, mImageId;
-    bool mIsConnected;
+    int mPort, mImageId, mVersion, mCompression;
+    unsigned int mCapabilities;
+    bool mIsConnected, mSharedMemory, mIsLocalHost, mRingConnected;
+    
+    // Shared memory ring kept across reconnects, NULL for TCP only,
+    // used while it is announced on the current connection
+    SharedRing* mRing;
+    
+    // Pixel encodings by AOV name and the default one
+    std::map<std::string, int> mEncodings;
+    int mDefaultEncoding;
+    
+    // Protocol v2 AOV ids of the current connection and their encodings
+    std::map<std::string, unsigned int> mAovIds;
+    std::vector<int> mAovEncodings;
+    
+    // Buckets per AOV sent uncompressed until compression is probed again
+    std::vector<int> mAovRawBuckets;
+    
+    // Reused protocol v2 message, encoded and compressed pixels buffers
+    MessageBuffer mMessage;
+    std::vector<char> mEncoded, mFiltered, mCompressed;
     
     // TCP stuff
     boost::asio::io_service mIoService;
@@ -51,6 +51,9 @@ node_parameters
     AiParameterStr("output", "");
     AiParameterInt("session", 0);
     AiParameterInt("reconnect", reconnect::disabled);
+    AiParameterInt("protocol", protocol::v2);
+    AiParameterStr("encodings", "");
+    AiParameterInt("compression", 1);
     
     AiMetaDataSetStr(nentry, NULL, AtString("maya.translator"), AtString("aton"));
     AiMetaDataSetStr(nentry, NULL, AtString("maya.attr_prefix"), AtString(""));
@@ -170,8 +173,27 @@ driver_open
     const char* host = AiNodeGetStr(node, AtString("host"));
     const int port = AiNodeGetInt(node, AtString("port"));
     
+    // Highest protocol version to negotiate, falls back to v1 for older servers
+    const int protocol_version = AiNodeGetInt(node, AtString("protocol"));
+    
     if (data->client == NULL)
-        data->client = new Client(host, port);
+        data->client = new Client(host, port, protocol_version);
+    
+    // Pixel encodings as AOV=encoding pairs, e.g. "*=half Z=float"
+    const char* encodings = AiNodeGetStr(node, AtString("encodings"));
+    
+    try
+    {
+        data->client->set_encodings(encodings);
+    }
+    catch(const std::exception &e)
+    {
+        AiMsgWarning("ATON | %s, sending floats", e.what());
+        data->client->set_encodings("");
+    }
+    
+    // Zlib level of pixels sent to other hosts, 0 sends them uncompressed
+    data->client->set_compression(AiNodeGetInt(node, AtString("compression")));
     
     try
     {
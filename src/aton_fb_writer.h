@@ -16,6 +16,9 @@ static void fb_writer(unsigned index, unsigned nthreads, void* data)
 {
     bool killThread = false;
     Aton* node = reinterpret_cast<Aton*> (data);
+    
+    // Frames by session, kept over connections as farm drivers reconnect for every bucket
+    std::map<long long, double> session_frames;
 
     while (!killThread)
     {
@@ -113,6 +116,8 @@ static void fb_writer(unsigned index, unsigned nthreads, void* data)
                         rb = fb->add_renderbuffer(&dh);
                     }
                     
+                    session_frames[_session] = _frame;
+                    
                     // Set FrameBuffer frame
                     node->set_current_frame(_frame);
                     if (fb->frame_changed(_frame))
@@ -160,7 +165,7 @@ static void fb_writer(unsigned index, unsigned nthreads, void* data)
                 }
                 case 1: // Write image data
                 {
-                    // Get Data Pixels
+                    // Get Data Pixels description
                     DataPixels dp = node->m_server.listenPixels();
                     
                     const int& _xres = dp.xres();
@@ -168,18 +173,6 @@ static void fb_writer(unsigned index, unsigned nthreads, void* data)
                     const char* _aov_name = dp.aov_name();
                     const long long& _session = dp.session();
 
-                    // Get Render Buffer
-                    WriteGuard lock(node->m_mutex);
-                    fb = node->get_framebuffer(_session);
-                    
-                    if (fb == NULL)
-                        fb = &node->m_framebuffers.back();
-                    
-                    rb = fb->get_renderbuffer(fb->get_frame());
-
-                    if(rb->resolution_changed(_xres, _yres))
-                        rb->set_resolution(_xres, _yres);
-
                     // Get active aov names
                     if(std::find(active_aovs.begin(),
                                  active_aovs.end(),
@@ -191,63 +184,86 @@ static void fb_writer(unsigned index, unsigned nthreads, void* data)
                             active_aovs.resize(1);
                     }
                     
-                    // Skip non RGBA buckets if AOVs are disabled
-                    if (node->m_enable_aovs || active_aovs[0] == _aov_name)
+                    // Skip non RGBA buckets if AOVs are disabled, without decoding them
+                    if (!node->m_enable_aovs && active_aovs[0] != _aov_name)
                     {
-                        // Get Data Pixels
-                        const int& _spp = dp.spp();
-                        const int& _time = dp.time();
-                        const int& _x = dp.bucket_xo();
-                        const int& _y = dp.bucket_yo();
-                        const long long& _ram = dp.ram();
-                        const int& _width = dp.bucket_size_x();
-                        const int& _height = dp.bucket_size_y();
+                        node->m_server.skipPixelsData();
+                        dp.free();
+                        break;
+                    }
+                    
+                    // Get Pixels before locking
+                    node->m_server.listenPixelsData(dp);
+
+                    // Get Render Buffer
+                    WriteGuard lock(node->m_mutex);
+                    fb = node->get_framebuffer(_session);
+                    
+                    if (fb == NULL)
+                        fb = &node->m_framebuffers.back();
+                    
+                    std::map<long long, double>::const_iterator frame = session_frames.find(_session);
+                    if (frame != session_frames.end())
+                        rb = fb->get_renderbuffer(frame->second);
+                    else
+                        rb = fb->get_renderbuffer(fb->get_frame());
 
-                        // Adding buffer
-                        if(!rb->aov_exists(_aov_name) && (node->m_enable_aovs || rb->empty()))
-                            rb->add_aov(_aov_name, _spp);
-                        else
-                            rb->set_ready(true);
+                    if(rb->resolution_changed(_xres, _yres))
+                        rb->set_resolution(_xres, _yres);
 
-                        // Get RenderBuffer height
-                        const int& h = rb->get_height();
+                    // Get Data Pixels
+                    const int& _spp = dp.spp();
+                    const int& _time = dp.time();
+                    const int& _x = dp.bucket_xo();
+                    const int& _y = dp.bucket_yo();
+                    const long long& _ram = dp.ram();
+                    const int& _width = dp.bucket_size_x();
+                    const int& _height = dp.bucket_size_y();
+
+                    // Adding buffer
+                    if(!rb->aov_exists(_aov_name) && (node->m_enable_aovs || rb->empty()))
+                        rb->add_aov(_aov_name, _spp);
+                    else
+                        rb->set_ready(true);
 
-                        // Get buffer index
-                        const int b = rb->get_aov_index(_aov_name);
+                    // Get RenderBuffer height
+                    const int& h = rb->get_height();
 
-                        // Writing to buffer
-                        int x, y, c, xpos, ypos, offset;
-                        for (x = 0; x < _width; ++x)
+                    // Get buffer index
+                    const int b = rb->get_aov_index(_aov_name);
+
+                    // Writing to buffer
+                    int x, y, c, xpos, ypos, offset;
+                    for (x = 0; x < _width; ++x)
+                    {
+                        for (y = 0; y < _height; ++y)
                         {
-                            for (y = 0; y < _height; ++y)
+                            offset = (_width * y * _spp) + (x * _spp);
+                            for (c = 0; c < _spp; ++c)
                             {
-                                offset = (_width * y * _spp) + (x * _spp);
-                                for (c = 0; c < _spp; ++c)
-                                {
-                                    xpos = x + _x;
-                                    ypos = h - (y + _y + 1);
-                                    const float& _pix = dp.pixel(offset + c);
-                                    rb->set_aov_pix(b, xpos, ypos, _spp, c, _pix);
-                                }
+                                xpos = x + _x;
+                                ypos = h - (y + _y + 1);
+                                const float& _pix = dp.pixel(offset + c);
+                                rb->set_aov_pix(b, xpos, ypos, _spp, c, _pix);
                             }
                         }
+                    }
 
-                        // Update only on first aov
-                        if(rb->first_aov_name(_aov_name) && !node->m_capturing)
+                    // Update only on first aov
+                    if(rb->first_aov_name(_aov_name) && !node->m_capturing)
+                    {
+                        if (node->current_fb_index() == 0 ||
+                            node->current_framebuffer() == fb ||
+                            node->m_output_changed == Aton::item_added)
                         {
-                            if (node->current_fb_index() == 0 ||
-                                node->current_framebuffer() == fb ||
-                                node->m_output_changed == Aton::item_added)
-                            {
-                                // Set status parameters
-                                rb->set_time(_time);
-                                rb->set_memory(_ram);
-                                rb->set_progress(_width * _height);
+                            // Set status parameters
+                            rb->set_time(_time);
+                            rb->set_memory(_ram);
+                            rb->set_progress(_width * _height);
 
-                                // Update the image
-                                const Box box = Box(_x, h - _y - _width, _x + _height, h - _y);
-                                node->flag_update(box);
-                            }
+                            // Update the image
+                            const Box box = Box(_x, h - _y - _width, _x + _height, h - _y);
+                            node->flag_update(box);
                         }
                     }
                     dp.free();
@@ -262,6 +278,10 @@ static void fb_writer(unsigned index, unsigned nthreads, void* data)
                     killThread = true;
                     break;
                 }
+                default: // Unknown messages are skipped by the server
+                {
+                    break;
+                }
             }
         }
     }
@@ -224,30 +224,44 @@ bool RenderBuffer::camera_changed(const float& fov,
     return (_fov != fov || _matrix != matrix);
 }
 
-// Resize the containers to match the resolution
+// Nearest neighbour resample of the buffer data to the new resolution
+template <typename T>
+static void resample(std::vector<T>& data,
+                     const unsigned int& w,
+                     const unsigned int& h,
+                     const unsigned int& new_w,
+                     const unsigned int& new_h)
+{
+    std::vector<T> out(new_w * new_h);
+    
+    if (w > 0 && h > 0 && data.size() == w * h)
+    {
+        for (unsigned int y = 0; y < new_h; ++y)
+        {
+            const unsigned int src_y = y * h / new_h;
+            for (unsigned int x = 0; x < new_w; ++x)
+                out[new_w * y + x] = data[w * src_y + x * w / new_w];
+        }
+    }
+    data.swap(out);
+}
+
+// Resize the containers to match the resolution, resampling the previous
+// pass so a lower resolution one stays visible until the new buckets replace it
 void RenderBuffer::set_resolution(const unsigned int& w,
                                   const unsigned int& h)
 {
-    _width = w;
-    _height = h;
-    
-    const int size = _width * _height;
-    
     std::vector<AOVBuffer>::iterator it;
     for(it = _buffers.begin(); it != _buffers.end(); ++it)
     {
         if (!it->_color_data.empty())
-        {
-            RenderColor color;
-            std::fill(it->_color_data.begin(), it->_color_data.end(), color);
-            it->_color_data.resize(size);
-        }
+            resample(it->_color_data, _width, _height, w, h);
         if (!it->_float_data.empty())
-        {
-            std::fill(it->_float_data.begin(), it->_float_data.end(), 0.0f);
-            it->_float_data.resize(size);
-        }
+            resample(it->_float_data, _width, _height, w, h);
     }
+    
+    _width = w;
+    _height = h;
 }
 
 // Clear buffers and aovs
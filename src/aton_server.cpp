@@ -6,17 +6,36 @@ All rights reserved. See COPYING.txt for more details.
 
 #include "aton_server.h"
 #include "aton_client.h"
+#include <algorithm>
 #include <boost/lexical_cast.hpp>
 
 using namespace boost::asio;
 
 Server::Server(): mPort(0),
+                  mVersion(protocol::v1),
+                  mMessages(0),
+                  mMessageSize(0),
+                  mPendingSize(0),
+                  mEncoding(protocol::encoding_float32),
+                  mFlags(0),
+                  mRing(NULL),
+                  mShared(false),
+                  mSharedPosition(0),
                   mSocket(mIoService),
                   mAcceptor(mIoService)
 {
 }
 
 Server::Server(int port): mPort(0),
+                          mVersion(protocol::v1),
+                          mMessages(0),
+                          mMessageSize(0),
+                          mPendingSize(0),
+                          mEncoding(protocol::encoding_float32),
+                          mFlags(0),
+                          mRing(NULL),
+                          mShared(false),
+                          mSharedPosition(0),
                           mSocket(mIoService),
                           mAcceptor(mIoService)
 {
@@ -27,6 +46,7 @@ Server::~Server()
 {
     if (mAcceptor.is_open())
         mAcceptor.close();
+    close_ring();
 }
 
 void Server::connect(int port, bool search)
@@ -74,8 +94,9 @@ void Server::connect(int port, bool search)
 
 void Server::quit()
 {
+    // Quit without negotiating, the listening thread may be busy
     std::string hostname("localhost");
-    Client client(hostname, mPort);
+    Client client(hostname, mPort, protocol::v1);
     client.quit();
 }
 
@@ -84,6 +105,57 @@ void Server::accept()
     if (mSocket.is_open())
         mSocket.close();
     mAcceptor.accept(mSocket);
+    
+    // Every connection starts with protocol v1
+    mVersion = protocol::v1;
+    mMessages = 0;
+    mPendingSize = 0;
+    mAovNames.clear();
+    mAovEncodings.clear();
+    mShared = false;
+}
+
+bool Server::hello()
+{
+    std::vector<char> request(protocol::hello_size);
+    boost::system::error_code error;
+    read(mSocket, buffer(request), error);
+    
+    // Client disconnected after an actual close message
+    if (error || memcmp(&request[0], protocol::hello_magic, sizeof(protocol::hello_magic)) != 0)
+        return false;
+    
+    MessageReader reader(request);
+    char magic[sizeof(protocol::hello_magic)];
+    reader.get_bytes(magic, sizeof(magic));
+    const int version = static_cast<int>(reader.get_uint());
+    const unsigned int capabilities = reader.get_uint();
+    mVersion = std::min(version, protocol::v2);
+    
+    // Reconnecting clients already know the capabilities
+    if (capabilities & protocol::hello_no_reply)
+        return true;
+    
+    MessageBuffer reply;
+    reply.put_bytes(protocol::hello_magic, sizeof(protocol::hello_magic));
+    reply.put_uint(mVersion);
+    reply.put_uint(capabilities & protocol::capabilities);
+    write(mSocket, buffer(reply.data()));
+    return true;
+}
+
+void Server::read_message(size_t size)
+{
+    mMessage.resize(size);
+    if (size > 0)
+        read(mSocket, buffer(mMessage));
+}
+
+void Server::close_ring()
+{
+    delete mRing;
+    mRing = NULL;
+    mShared = false;
 }
 
 int Server::listen_type()
@@ -92,11 +164,79 @@ int Server::listen_type()
     
     try
     {
-        read(mSocket, buffer(reinterpret_cast<char*>(&type), sizeof(int)));
+        while (true)
+        {
+            if (mVersion >= protocol::v2)
+            {
+                unsigned int frame[2];
+                read(mSocket, buffer(reinterpret_cast<char*>(frame), protocol::frame_size));
+                mMessageSize = boost::endian::little_to_native(frame[0]);
+                type = static_cast<int>(boost::endian::little_to_native(frame[1]));
+            }
+            else
+                read(mSocket, buffer(reinterpret_cast<char*>(&type), sizeof(int)));
+            
+            mMessages++;
+            
+            // Keep AOV names of the connection
+            if (type == protocol::aov && mVersion >= protocol::v2)
+            {
+                read_message(mMessageSize);
+                MessageReader reader(mMessage);
+                const unsigned int aov_id = reader.get_uint();
+                reader.get_uint(); // spp
+                const int encoding = static_cast<int>(reader.get_uint());
+                const unsigned int name_size = reader.get_uint();
+                std::vector<char> name(name_size + 1, '\0');
+                reader.get_bytes(&name[0], name_size);
+                mAovNames[aov_id] = &name[0];
+                mAovEncodings[aov_id] = encoding;
+                continue;
+            }
+            
+            // Pixels of clients on the same host follow in shared memory
+            if (type == protocol::shm && mVersion >= protocol::v2)
+            {
+                read_message(mMessageSize);
+                MessageReader reader(mMessage);
+                reader.get_long(); // capacity
+                const unsigned int name_size = reader.get_uint();
+                std::vector<char> name(name_size + 1, '\0');
+                reader.get_bytes(&name[0], name_size);
+                
+                // Rings stay mapped across the reconnects of their client,
+                // connections are read one after another so the ring is read in order
+                if (mRing == NULL || mRing->path() != &name[0])
+                {
+                    close_ring();
+                    mRing = new SharedRing(std::string(&name[0]));
+                }
+                continue;
+            }
+            
+            // A close key opening the connection may be a protocol v2 hello
+            if (type == protocol::close && mMessages == 1 && mVersion == protocol::v1 && hello())
+                continue;
+            
+            if (type != protocol::header && type != protocol::pixels &&
+                type != protocol::close && type != protocol::quit)
+            {
+                // Unknown messages are skipped by their frame size,
+                // protocol v1 ones have no size to follow the stream past them
+                if (mVersion < protocol::v2)
+                    throw std::runtime_error("Unknown message type!");
+                
+                read_message(mMessageSize);
+                continue;
+            }
+            
+            break;
+        }
     
         if (type == 2 || type == 9)
         {
             mSocket.close();
+            close_ring();
             if (type == 9)
                 mAcceptor.close();
         }
@@ -114,6 +254,37 @@ DataHeader Server::listenHeader()
 {
     DataHeader dh;
     
+    const int camMatrixSize = 16;
+    const int samplesSize = 6;
+    
+    if (mVersion >= protocol::v2)
+    {
+        read_message(mMessageSize);
+        MessageReader reader(mMessage);
+        dh.mSession = reader.get_long();
+        dh.mXres = reader.get_int();
+        dh.mYres = reader.get_int();
+        dh.mPixAspectRatio = reader.get_float();
+        dh.mRArea = reader.get_long();
+        dh.mVersion = reader.get_int();
+        dh.mFrame = reader.get_float();
+        dh.mCamFov = reader.get_float();
+        
+        dh.mCamMatrixStore.resize(camMatrixSize);
+        for (int i = 0; i < camMatrixSize; ++i)
+            dh.mCamMatrixStore[i] = reader.get_float();
+        
+        dh.mSamplesStore.resize(samplesSize);
+        for (int i = 0; i < samplesSize; ++i)
+            dh.mSamplesStore[i] = reader.get_int();
+        
+        const unsigned int output_size = reader.get_uint();
+        char* output_name = new char[output_size];
+        reader.get_bytes(output_name, output_size);
+        dh.mOutputName = output_name;
+        return dh;
+    }
+    
     // Read data from the buffer
     read(mSocket, buffer(reinterpret_cast<char*>(&dh.mSession), sizeof(long long)));
     read(mSocket, buffer(reinterpret_cast<char*>(&dh.mXres), sizeof(int)));
@@ -124,11 +295,9 @@ DataHeader Server::listenHeader()
     read(mSocket, buffer(reinterpret_cast<char*>(&dh.mFrame), sizeof(int)));
     read(mSocket, buffer(reinterpret_cast<char*>(&dh.mCamFov), sizeof(float)));
     
-    const int camMatrixSize = 16;
     dh.mCamMatrixStore.resize(camMatrixSize);
     read(mSocket, buffer(reinterpret_cast<char*>(&dh.mCamMatrixStore[0]), sizeof(float)*camMatrixSize));
 
-    const int samplesSize = 6;
     dh.mSamplesStore.resize(samplesSize);
     read(mSocket, buffer(reinterpret_cast<char*>(&dh.mSamplesStore[0]), sizeof(int)*samplesSize));
     
@@ -147,6 +316,45 @@ DataHeader Server::listenHeader()
 DataPixels Server::listenPixels()
 {
     DataPixels dp;
+    
+    if (mVersion >= protocol::v2)
+    {
+        read_message(protocol::pixels_size);
+        MessageReader reader(mMessage);
+        dp.mSession = reader.get_long();
+        dp.mXres = reader.get_int();
+        dp.mYres = reader.get_int();
+        const unsigned int aov_id = reader.get_uint();
+        dp.mBucket_xo = reader.get_int();
+        dp.mBucket_yo = reader.get_int();
+        dp.mBucket_size_x = reader.get_int();
+        dp.mBucket_size_y = reader.get_int();
+        dp.mSpp = reader.get_int();
+        dp.mRam = reader.get_long();
+        dp.mTime = reader.get_uint();
+        const unsigned int flags = reader.get_uint();
+        
+        // Get aov name from the connection table
+        const std::string& name = mAovNames[aov_id];
+        char* aov_name = new char[name.size() + 1];
+        strcpy(aov_name, name.c_str());
+        dp.mAovName = aov_name;
+        
+        mEncoding = mAovEncodings[aov_id];
+        mFlags = flags;
+        mPendingSize = mMessageSize - protocol::pixels_size;
+        
+        // Shared pixels are replaced by their position and size in the ring
+        mShared = (flags & protocol::flag_shared) && mRing != NULL;
+        if (mShared)
+        {
+            read_message(protocol::shm_ref_size);
+            MessageReader ref(mMessage);
+            mSharedPosition = static_cast<unsigned long long>(ref.get_long());
+            mPendingSize = static_cast<size_t>(ref.get_long());
+        }
+        return dp;
+    }
 
     // Read data from the buffer
     read(mSocket, buffer(reinterpret_cast<char*>(&dp.mSession), sizeof(long long)));
@@ -169,10 +377,87 @@ DataPixels Server::listenPixels()
     read(mSocket, buffer(aov_name, aov_size));
     dp.mAovName = aov_name;
 
-    // Get pixels
-    const int num_samples = dp.bucket_size_x() * dp.bucket_size_y() * dp.spp();
-    dp.mPixelStore.resize(num_samples);
-    read(mSocket, buffer(reinterpret_cast<char*>(&dp.mPixelStore[0]), sizeof(float)*num_samples));
+    mEncoding = protocol::encoding_float32;
+    mFlags = 0;
+    mPendingSize = sizeof(float) * dp.bucket_size_x() * dp.bucket_size_y() * dp.spp();
     return dp;
 }
 
+void Server::listenPixelsData(DataPixels& dp)
+{
+    const size_t num_samples = dp.bucket_size_x() * dp.bucket_size_y() * dp.spp();
+    dp.mPixelStore.resize(num_samples);
+    
+    // Compressed pixels are checked against their size once decompressed
+    const size_t size = encoded_size(num_samples, mEncoding);
+    const bool compressed = mVersion >= protocol::v2 && !mShared &&
+                            (mFlags & protocol::flag_codec_mask) != 0;
+    if (num_samples == 0 || (!compressed && size != mPendingSize))
+    {
+        skipPixelsData();
+        return;
+    }
+    
+    // Get pixels from the ring without any system call
+    if (mShared)
+    {
+        const char* data = mRing->view(mSharedPosition, mPendingSize);
+        if (mEncoding == protocol::encoding_float32 && !BOOST_ENDIAN_BIG_BYTE)
+            memcpy(&dp.mPixelStore[0], data, mPendingSize);
+        else
+            decode_pixels(data, num_samples, mEncoding, &dp.mPixelStore[0]);
+        mRing->release(mSharedPosition, mPendingSize);
+        mShared = false;
+        mPendingSize = 0;
+        return;
+    }
+    
+    // Get compressed pixels, floats are decompressed in place on little-endian hosts
+    if (compressed)
+    {
+        read_message(mPendingSize);
+        mPendingSize = 0;
+        if (mEncoding == protocol::encoding_float32 && !BOOST_ENDIAN_BIG_BYTE)
+            decompress_pixels(mMessage.data(), mMessage.size(), mFlags, mEncoding, mFiltered,
+                              reinterpret_cast<char*>(&dp.mPixelStore[0]), size);
+        else
+        {
+            mDecompressed.resize(size);
+            decompress_pixels(mMessage.data(), mMessage.size(), mFlags, mEncoding, mFiltered,
+                              &mDecompressed[0], size);
+            decode_pixels(&mDecompressed[0], num_samples, mEncoding, &dp.mPixelStore[0]);
+        }
+        return;
+    }
+    
+    // Get pixels, floats are read in place on little-endian hosts
+    if (mVersion < protocol::v2 || (mEncoding == protocol::encoding_float32 && !BOOST_ENDIAN_BIG_BYTE))
+        read(mSocket, buffer(reinterpret_cast<char*>(&dp.mPixelStore[0]), mPendingSize));
+    else
+    {
+        read_message(mPendingSize);
+        decode_pixels(&mMessage[0], num_samples, mEncoding, &dp.mPixelStore[0]);
+    }
+    mPendingSize = 0;
+}
+
+void Server::skipPixelsData()
+{
+    if (mShared)
+    {
+        mRing->release(mSharedPosition, mPendingSize);
+        mShared = false;
+        mPendingSize = 0;
+        return;
+    }
+    
+    // Discard pixels without decoding them
+    mMessage.resize(std::min(mPendingSize, static_cast<size_t>(1 << 16)));
+    while (mPendingSize > 0)
+    {
+        const size_t size = std::min(mPendingSize, mMessage.size());
+        read(mSocket, buffer(&mMessage[0], size));
+        mPendingSize -= size;
+    }
+}
+
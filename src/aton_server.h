@@ -40,7 +40,13 @@ public:
     // passed back ready for handling by the parent application
     int listen_type();
     DataHeader listenHeader();
+    
+    // Reads the bucket description only, its pixels have to be read with
+    // listenPixelsData() or skipped with skipPixelsData() before listening
+    // for the next message. Skipped AOVs are never decoded
     DataPixels listenPixels();
+    void listenPixelsData(DataPixels& dp);
+    void skipPixelsData();
     
     // This can be used to exit a listening loop running on a separate thread
     void quit();
@@ -50,11 +56,43 @@ public:
 
     //! Returns the port the server is currently connected to
     int get_port() { return mPort; }
+    
+    //! Returns the protocol version of the current connection
+    int get_version() { return mVersion; }
 
 private:
+    // Replies to a protocol v2 hello, returns false for an actual close message
+    bool hello();
+    
+    // Reads the payload of the current protocol v2 message
+    void read_message(size_t size);
+    
+    // Detaches from the shared memory ring of the connection
+    void close_ring();
+    
     // Port we're listening to
     int mPort;
     
+    // Protocol version, messages and pending pixel bytes of the current connection
+    int mVersion, mMessages;
+    size_t mMessageSize, mPendingSize;
+    
+    // Protocol v2 AOV names and encodings by id of the current connection
+    std::map<unsigned int, std::string> mAovNames;
+    std::map<unsigned int, int> mAovEncodings;
+    
+    // Encoding and compression flags of the pending pixels
+    int mEncoding;
+    unsigned int mFlags;
+    
+    // Shared memory ring of the current connection and position of the pending pixels in it
+    SharedRing* mRing;
+    bool mShared;
+    unsigned long long mSharedPosition;
+    
+    // Reused protocol v2 message and decompressed pixels buffers
+    std::vector<char> mMessage, mFiltered, mDecompressed;
+    
     // TCP stuff
     boost::asio::io_service mIoService;
     boost::asio::ip::tcp::socket mSocket;